@@ -0,0 +1,1334 @@
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+
+SAMPLE_PARAMETERS = (
+    "masterpiece, best quality, portrait of a knight in ornate armor, dramatic lighting\n"
+    "Negative prompt: lowres, bad anatomy, bad hands, blurry\n"
+    "Steps: 30, Sampler: DPM++ 2M Karras, CFG scale: 7, Seed: {seed}, Size: 768x1024, "
+    "Model hash: 6ce0161689, Model: v1-5-pruned-emaonly, Version: v1.6.0"
+)
+
+
+def _png_info(parameters):
+    from PIL.PngImagePlugin import PngInfo
+
+    info = PngInfo()
+    info.add_text("parameters", parameters)
+    return info
+
+
+def _exif_bytes(parameters):
+    from PIL import Image
+
+    # Так же, как A1111 через piexif: UserComment в Exif IFD, UTF-16 BE
+    exif = Image.Exif()
+    exif.get_ifd(0x8769)[0x9286] = b"UNICODE\0" + parameters.encode("utf-16-be")
+    return exif.tobytes()
+
+
+def make_metadata_corpus(folder, count=300, size=(1024, 1024), seed=0):
+    """
+    Создаёт набор PNG/JPEG/WebP с параметрами генерации в метаданных
+    """
+    from PIL import Image
+
+    rng = random.Random(seed)
+    os.makedirs(folder, exist_ok=True)
+    # Шумное изображение плохо сжимается, как и реальные генерации
+    noise = Image.frombytes("RGB", size, rng.randbytes(size[0] * size[1] * 3))
+    paths = []
+    for index in range(count):
+        parameters = SAMPLE_PARAMETERS.format(seed=rng.randrange(2 ** 32))
+        kind = ("png", "jpg", "webp")[index % 3]
+        path = os.path.join(folder, f"{index:05d}.{kind}")
+        if kind == "png":
+            noise.save(path, pnginfo=_png_info(parameters), compress_level=1)
+        elif kind == "jpg":
+            noise.save(path, exif=_exif_bytes(parameters), quality=90)
+        else:
+            noise.save(path, exif=_exif_bytes(parameters), quality=80)
+        paths.append(path)
+    return paths
+
+
+def _read_with_pil_info(path):
+    # Прежний способ: PIL.Image.open + img.info
+    from PIL import Image
+
+    with Image.open(path) as img:
+        return img.info.get("parameters")
+
+
+def _time_reader(reader, paths, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for path in paths:
+            reader(path)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def bench_metadata_reader(paths, repeat=3):
+    """
+    Сравнивает чтение заголовков (metadata_reader) с PIL.Image.open
+    """
+    from metadata_reader import read_parameters
+
+    header_time = _time_reader(read_parameters, paths, repeat)
+    pil_time = _time_reader(_read_with_pil_info, paths, repeat)
+    return {
+        "files": len(paths),
+        "header_reader_s": round(header_time, 4),
+        "pil_s": round(pil_time, 4),
+        "header_reader_us_per_file": round(header_time / len(paths) * 1e6, 1),
+        "pil_us_per_file": round(pil_time / len(paths) * 1e6, 1),
+        "speedup": round(pil_time / header_time, 2) if header_time else None,
+    }
+
+
+def legacy_parse_prompt(parameters):
+    """
+    Прежний разбор параметров (последовательные str.find) - эталон для сравнения
+    """
+    # Инициализируем значения по умолчанию
+    pos_prompt = "unknown"
+    neg_prompt = "unknown"
+    model = "unknown"
+    
+    # Очищаем параметры от "Parameters:" в начале
+    if parameters.startswith("Parameters:"):
+        parameters = parameters[len("Parameters:"):].strip()
+    
+    # Ищем границы промптов и параметров
+    steps_marker = "Steps:"
+    model_marker = "Model:"
+    denoising_marker = "Denoising strength:"
+    
+    # Ищем негативный промпт
+    neg_markers = ["Negative prompt:", "Negative Prompt:"]
+    neg_start = -1
+    used_marker = None
+    
+    for marker in neg_markers:
+        pos = parameters.find(marker)
+        if pos != -1:
+            neg_start = pos
+            used_marker = marker
+            break
+    
+    # Извлекаем позитивный промпт
+    if neg_start != -1:
+        pos_prompt = parameters[:neg_start].strip()
+        # Ищем конец негативного промпта
+        neg_text = parameters[neg_start + len(used_marker):]
+        steps_pos = neg_text.find(steps_marker)
+        if steps_pos != -1:
+            neg_prompt = neg_text[:steps_pos].strip()
+        else:
+            neg_prompt = neg_text.strip()
+    else:
+        # Если нет негативного промпта, ищем конец позитивного
+        steps_pos = parameters.find(steps_marker)
+        if steps_pos != -1:
+            pos_prompt = parameters[:steps_pos].strip()
+        else:
+            pos_prompt = parameters.strip()
+    
+    # Улучшенное извлечение модели
+    model = "unknown"
+    
+    # Ищем основную модель
+    model_patterns = [
+        # Паттерн 1: Стандартный формат
+        {
+            'start': "Model: ",
+            'end': ["Clip skip:", ", Clip", "ControlNet", "Style Selector", "Version:", "Denoising strength:"],
+            'exclude_if_before': ["ControlNet", "Module:"]  # Не извлекаем, если перед Model: есть эти слова
+        },
+        # Паттерн 2: Формат с хешем
+        {
+            'start': "Model hash: ",
+            'end': ["Model:", "Denoising strength:"],
+            'exclude_if_before': ["ControlNet", "Module:"]
+        }
+    ]
+    
+    for pattern in model_patterns:
+        start_marker = pattern['start']
+        # Проверяем все вхождения start_marker
+        start_pos = 0
+        while True:
+            start_idx = parameters.find(start_marker, start_pos)
+            if start_idx == -1:
+                break
+                
+            # Проверяем, нет ли исключающих слов перед маркером
+            text_before = parameters[max(0, start_idx-50):start_idx]
+            if any(excl in text_before for excl in pattern['exclude_if_before']):
+                start_pos = start_idx + 1
+                continue
+            
+            start_idx += len(start_marker)
+            end_idx = float('inf')
+            
+            # Ищем ближайший конец
+            for end_marker in pattern['end']:
+                marker_idx = parameters.find(end_marker, start_idx)
+                if marker_idx != -1 and marker_idx < end_idx:
+                    end_idx = marker_idx
+            
+            if end_idx != float('inf'):
+                model_text = parameters[start_idx:end_idx].strip()
+                if model_text:
+                    model = model_text.strip().rstrip(',')
+                    # Если нашли основную модель, прерываем поиск
+                    break
+            
+            start_pos = start_idx
+        
+        if model != "unknown":
+            break
+    
+    # Очистка модели от лишних данных
+    if ',' in model:
+        # Берем первую часть, если есть запятая
+        model = model.split(',')[0].strip()
+    
+    # Проверяем и устанавливаем значения по умолчанию для пустых полей
+    if not pos_prompt or pos_prompt.isspace():
+        pos_prompt = "unknown"
+    if not neg_prompt or neg_prompt.isspace():
+        neg_prompt = "unknown"
+    if not model or model.isspace():
+        model = "unknown"
+    
+    return (pos_prompt, neg_prompt, model)
+
+_WORDS = [
+    "masterpiece", "portrait", "knight", "castle", "forest", "cyberpunk", "city",
+    "neon", "dragon", "sunset", "ocean", "(detailed:1.2)", "[blurry]", "girl",
+    "armor", "landscape", "mountains", "cinematic", "lighting", "8k",
+]
+_SAMPLERS = ["Euler a", "DPM++ 2M Karras", "DPM++ SDE", "DDIM", "UniPC"]
+_MODELS = ["v1-5-pruned-emaonly", "sd_xl_base_1.0", "realisticVision_v51", "dreamshaper_8"]
+
+
+def _controlnet_unit(rng, index):
+    return (
+        f'ControlNet {index}: "Module: {rng.choice(["canny", "depth_midas", "openpose"])}, '
+        f'Model: control_v11p_sd15_{rng.choice(["canny", "depth", "openpose"])} [d14c016b], '
+        f'Weight: {rng.choice([0.5, 1, 1.2])}, Resize Mode: Crop and Resize, Low Vram: False, '
+        f'Processor Res: 512, Threshold A: 100, Threshold B: 200, Guidance Start: 0, '
+        f'Guidance End: 1, Pixel Perfect: True, Control Mode: Balanced"'
+    )
+
+
+def make_parameters_corpus(count=2000, seed=0):
+    """
+    Генерирует тексты параметров A1111: короткие, с ControlNet, hires, LoRA,
+    без негативного промпта, без строки настроек и старых версий (без Version),
+    а также с "Steps:" внутри промптов и с обоими написаниями Negative prompt
+    """
+    rng = random.Random(seed)
+    corpus = []
+    for index in range(count):
+        prompt = ", ".join(rng.choice(_WORDS) for _ in range(rng.randint(1, 40)))
+        if rng.random() < 0.3:
+            prompt += f", <lora:style_{rng.randint(1, 9)}:0.8>"
+        if rng.random() < 0.2:
+            prompt += "\nsecond line of prompt"
+        if rng.random() < 0.03:
+            prompt += ", Steps: in it"
+        settings = [
+            f"Steps: {rng.randint(10, 80)}",
+            f"Sampler: {rng.choice(_SAMPLERS)}",
+            f"CFG scale: {rng.choice([5, 6.5, 7, 9])}",
+            f"Seed: {rng.randrange(2 ** 32)}",
+            f"Size: {rng.choice([512, 768, 1024])}x{rng.choice([512, 768, 1024])}",
+            f"Model hash: {rng.randrange(16 ** 10):010x}",
+            f"Model: {rng.choice(_MODELS)}",
+        ]
+        if rng.random() < 0.3:
+            settings += ["Denoising strength: 0.45", "Hires upscale: 2", "Hires steps: 15",
+                         "Hires upscaler: R-ESRGAN 4x+"]
+        if rng.random() < 0.3:
+            settings.append("Clip skip: 2")
+        kind = index % 4
+        if kind == 0:
+            # Тяжёлый случай: несколько блоков ControlNet с запятыми внутри кавычек
+            settings += [_controlnet_unit(rng, unit) for unit in range(rng.randint(1, 3))]
+        elif kind == 3 and rng.random() < 0.5:
+            # Старый формат ControlNet без кавычек
+            settings += ["ControlNet-0 Enabled: True", "ControlNet-0 Module: canny",
+                         "ControlNet-0 Model: control_sd15_canny [fef5e48e]", "ControlNet-0 Weight: 1"]
+        if rng.random() < 0.2:
+            # Старые версии WebUI: без Version, модель в конце строки, иногда только её хеш
+            model_settings = settings[5:7] if rng.random() < 0.5 else settings[5:6]
+            settings = settings[:5] + settings[7:] + model_settings
+        else:
+            settings.append('Lora hashes: "style_1: 0123abcd, style_2: 4567ef01"')
+            settings.append("Version: v1.6.0")
+        text = prompt
+        if kind != 1:
+            negative = ", ".join(rng.choice(_WORDS) for _ in range(rng.randint(1, 20)))
+            if rng.random() < 0.03:
+                negative += " bad Steps: x"
+            marker = "Negative Prompt: " if rng.random() < 0.1 else "Negative prompt: "
+            if rng.random() < 0.03:
+                # Оба написания: прежний разбор ищет сначала "Negative prompt:"
+                text += "\nNegative Prompt: " + rng.choice(_WORDS)
+                marker = "Negative prompt: "
+            text += "\n" + marker + negative
+        if kind != 2:
+            text += "\n" + ", ".join(settings)
+        if rng.random() < 0.05:
+            text = "Parameters: " + text
+        corpus.append(text)
+    return corpus
+
+
+def bench_parameters_parser(corpus, repeat=3):
+    """
+    Сравнивает разбор параметров с прежним по скорости и результату
+    (промпт, негативный промпт, модель). sort - то, что нужно для сортировки
+    файла, record - полная структурированная запись (у неё сравниваются только
+    промпты: модель записи - имя из настроек, а не хеш, как иногда у папок).
+    """
+    from sd_parameters import GenerationParameters, parse_parameters
+
+    def sort_fields(text):
+        generation = GenerationParameters(text)
+        return (generation.prompt or "unknown", generation.negative_prompt or "unknown",
+                generation.model or "unknown")
+
+    def record_fields(text):
+        record = parse_parameters(text)
+        return (record["prompt"] or "unknown", record["negative_prompt"] or "unknown")
+
+    result = {
+        "corpus": len(corpus),
+        "mismatches": sum(1 for text in corpus if sort_fields(text) != legacy_parse_prompt(text)),
+        "record_mismatches": sum(1 for text in corpus if record_fields(text) != legacy_parse_prompt(text)[:2]),
+    }
+    heavy = [text for text in corpus if "ControlNet" in text]
+    for name, texts in (("all", corpus), ("controlnet", heavy)):
+        legacy_time = _time_reader(legacy_parse_prompt, texts, repeat)
+        sort_time = _time_reader(sort_fields, texts, repeat)
+        record_time = _time_reader(parse_parameters, texts, repeat)
+        result[name] = {
+            "count": len(texts),
+            "legacy_us": round(legacy_time / len(texts) * 1e6, 2),
+            "sort_us": round(sort_time / len(texts) * 1e6, 2),
+            "record_us": round(record_time / len(texts) * 1e6, 2),
+            "sort_speedup": round(legacy_time / sort_time, 2) if sort_time else None,
+        }
+    return result
+
+
+class _ReleaseStandIn:
+    """
+    Локальная замена GitHub API для проверки обновлений: отвечает с задержкой delay
+    """
+
+    def __init__(self, delay=0.0, tag="v99.0.0"):
+        import http.server
+        import threading
+
+        body = json.dumps({
+            "tag_name": tag,
+            "body": "test release",
+            "assets": [{"browser_download_url": "http://127.0.0.1/update.exe"}],
+        }).encode()
+        stand_in = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                stand_in.requests += 1
+                time.sleep(delay)
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.requests = 0
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/releases/latest"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def bench_update_check(delay=3.0):
+    """
+    Проверка обновлений против локального сервера: запрос без кеша, из кеша,
+    и время до появления окна, когда сервер отвечает delay секунд
+    """
+    import update_checker
+
+    result = {}
+    with tempfile.TemporaryDirectory() as folder:
+        cache_path = os.path.join(folder, "update_check.json")
+        fast = _ReleaseStandIn()
+        try:
+            checker = update_checker.UpdateChecker("1.0.0", update_url=fast.url, cache_path=cache_path)
+            start = time.perf_counter()
+            info = checker.check_for_updates()
+            result["network_s"] = round(time.perf_counter() - start, 4)
+            start = time.perf_counter()
+            checker.check_for_updates()
+            result["cached_s"] = round(time.perf_counter() - start, 6)
+            result["available"] = info["available"]
+            result["server_requests"] = fast.requests
+        finally:
+            fast.close()
+
+        try:
+            from PyQt5.QtWidgets import QApplication
+        except ImportError:
+            return result
+
+        slow = _ReleaseStandIn(delay=delay)
+        original_url = update_checker.UPDATE_URL
+        original_folder = update_checker.get_cache_folder
+        update_checker.UPDATE_URL = slow.url
+        update_checker.get_cache_folder = lambda: folder
+        try:
+            app = QApplication.instance() or QApplication([])
+            start = time.perf_counter()
+            import gui
+
+            window = gui.SDOrganizerGUI()
+            window.show()
+            app.processEvents()
+            result["time_to_window_s"] = round(time.perf_counter() - start, 4)
+            result["server_delay_s"] = delay
+            window.close()
+        finally:
+            update_checker.UPDATE_URL = original_url
+            update_checker.get_cache_folder = original_folder
+            slow.close()
+    return result
+
+
+class _DownloadStandIn:
+    """
+    Локальный сервер файла обновления с поддержкой Range и If-Range, который
+    обрывает соединение после drop_after байт в каждом из первых drops ответов
+    """
+
+    def __init__(self, payload, drop_after=256 * 1024, drops=3):
+        import http.server
+        import threading
+
+        stand_in = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                stand_in.requests += 1
+                start = 0
+                header = self.headers.get("Range")
+                if_range = self.headers.get("If-Range")
+                stand_in.ranges.append((header, if_range))
+                if header and (if_range is None or if_range == stand_in.etag):
+                    start = int(header.split("=")[1].split("-")[0])
+                    if start >= len(payload):
+                        self.send_response(416)
+                        self.send_header("Content-Range", f"bytes */{len(payload)}")
+                        self.end_headers()
+                        return
+                    self.send_response(206)
+                    self.send_header("Content-Range", f"bytes {start}-{len(payload) - 1}/{len(payload)}")
+                else:
+                    self.send_response(200)
+                self.send_header("ETag", stand_in.etag)
+                self.send_header("Content-Length", str(len(payload) - start))
+                self.end_headers()
+                end = len(payload)
+                if stand_in.drops > 0:
+                    stand_in.drops -= 1
+                    end = min(end, start + drop_after)
+                self.wfile.write(payload[start:end])
+
+            def log_message(self, *args):
+                pass
+
+        self.requests = 0
+        # Заголовки (Range, If-Range) каждого запроса
+        self.ranges = []
+        self.drops = drops
+        self.etag = '"v1"'
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/update.exe"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def bench_update_download(size=8 * 1024 * 1024, drops=3):
+    """
+    Загрузка обновления с обрывами соединения: число запросов, вызовов
+    прогресса, проверка контрольной суммы и размера, отказ продолжать
+    часть файла с другим ETag и повторное использование полной части
+    """
+    import hashlib
+    import update_checker
+
+    payload = os.urandom(size)
+    expected = hashlib.sha256(payload).hexdigest()
+    result = {"size": size, "drops": drops}
+    original_sleep = update_checker.time.sleep
+    # Задержка между попытками не нужна для измерения
+    update_checker.time.sleep = lambda seconds: None
+    server = _DownloadStandIn(payload, drops=drops)
+    try:
+        checker = update_checker.UpdateChecker("1.0.0")
+        calls = []
+        start = time.perf_counter()
+        path = checker.download_update(server.url, calls.append, sha256=expected)
+        result["elapsed_s"] = round(time.perf_counter() - start, 4)
+        result["requests"] = server.requests
+        result["progress_calls"] = len(calls)
+        result["verified"] = path is not None
+        if path:
+            os.remove(path)
+
+        server.drops = 0
+        result["bad_checksum_rejected"] = checker.download_update(server.url, sha256="0" * 64) is None
+        result["bad_size_rejected"] = checker.download_update(server.url, sha256=expected, size=size + 1) is None
+
+        # Часть от прошлой версии файла на сервере: докачка по If-Range не должна её продолжить
+        part_path = update_checker._update_path(server.url, None) + ".part"
+        with open(part_path, "wb") as f:
+            f.write(os.urandom(size // 2))
+        update_checker._write_part_info(part_path, {"etag": '"v0"', "total": size})
+        server.requests = 0
+        path = checker.download_update(server.url, sha256=expected, size=size)
+        result["stale_part_restarted"] = path is not None and server.requests == 1
+        if path:
+            os.remove(path)
+
+        # Полностью загруженная часть: сервер отвечает 416, файл принимается без загрузки
+        with open(part_path, "wb") as f:
+            f.write(payload)
+        update_checker._write_part_info(part_path, {"etag": server.etag, "total": size})
+        path = checker.download_update(server.url, sha256=expected, size=size)
+        result["complete_part_reused"] = path is not None
+        if path:
+            os.remove(path)
+    finally:
+        update_checker.time.sleep = original_sleep
+        server.close()
+    return result
+
+
+def make_sd_corpus(folder, count=1000, seed=0, size=(64, 64), no_metadata=0.1, folders=5):
+    """
+    Создаёт синтетическую папку output: PNG/JPEG/WebP с параметрами A1111
+    (короткими и с ControlNet), файлы без метаданных и одинаковые имена
+    файлов в разных подпапках (как папки по датам у A1111).
+
+    Returns:
+        list: пути созданных файлов
+    """
+    from PIL import Image
+
+    rng = random.Random(seed)
+    texts = make_parameters_corpus(min(count, 5000), seed)
+    images = [
+        Image.frombytes("RGB", size, rng.randbytes(size[0] * size[1] * 3))
+        for _ in range(8)
+    ]
+    paths = []
+    for index in range(count):
+        subfolder = os.path.join(folder, f"2024-01-{index % folders + 1:02d}")
+        if index < folders:
+            os.makedirs(subfolder, exist_ok=True)
+        kind = ("png", "png", "jpg", "webp")[index % 4]
+        # Номер повторяется в каждой подпапке - имена файлов совпадают
+        path = os.path.join(subfolder, f"{index // folders:05d}-{rng.randrange(2 ** 32)}.{kind}")
+        image = images[index % len(images)]
+        parameters = None if rng.random() < no_metadata else texts[index % len(texts)]
+        if kind == "png":
+            image.save(path, pnginfo=_png_info(parameters) if parameters else None, compress_level=1)
+        elif kind == "jpg":
+            image.save(path, exif=_exif_bytes(parameters) if parameters else b"", quality=90)
+        else:
+            image.save(path, exif=_exif_bytes(parameters) if parameters else b"", quality=80)
+        paths.append(path)
+    return paths
+
+
+def bench_parse_and_name(paths, repeat=3):
+    """
+    Микробенчмарки: extract_prompt_from_metadata по файлам корпуса,
+    create_folder_name и sanitize_folder_name по извлечённым промптам
+    """
+    from organizer import create_folder_name, extract_prompt_from_metadata, sanitize_folder_name
+
+    extracted = [extract_prompt_from_metadata(path) for path in paths]
+    prompts = [metadata[:3] for metadata in extracted if metadata]
+    names = [create_folder_name(*prompt) for prompt in prompts]
+    long_names = [prompt[0] for prompt in prompts]
+
+    def time_per_item(func, items):
+        if not items:
+            return None
+        return round(_time_reader(func, items, repeat) / len(items) * 1e6, 2)
+
+    return {
+        "files": len(paths),
+        "with_metadata": len(prompts),
+        "extract_us": time_per_item(extract_prompt_from_metadata, paths),
+        "create_folder_name_us": time_per_item(lambda prompt: create_folder_name(*prompt), prompts),
+        "sanitize_folder_name_us": time_per_item(sanitize_folder_name, names),
+        "sanitize_long_name_us": time_per_item(sanitize_folder_name, long_names),
+    }
+
+
+def bench_batch(corpus_folder, repeat=1, **options):
+    """
+    Сквозная пропускная способность process_all_files: корпус копируется
+    в свежую папку output перед каждым прогоном (копирование не замеряется)
+    """
+    import shutil
+    from collections import Counter
+    from organizer import process_all_files
+
+    runs = []
+    statuses = Counter()
+    for run in range(repeat):
+        with tempfile.TemporaryDirectory() as folder:
+            output = os.path.join(folder, "output")
+            project = os.path.join(folder, "project")
+            shutil.copytree(corpus_folder, output)
+            os.makedirs(project)
+            statuses.clear()
+            start = time.perf_counter()
+            for _, _, result in process_all_files(output, project, **options):
+                statuses[result["status"]] += 1
+            runs.append(time.perf_counter() - start)
+    best = min(runs)
+    files = sum(statuses.values())
+    return {
+        "corpus": sum(len(names) for _, _, names in os.walk(corpus_folder)),
+        "files": files,
+        "best_s": round(best, 4),
+        "files_per_s": round(files / best, 1) if best else None,
+        "statuses": dict(statuses),
+    }
+
+
+def bench_watch_latency(paths, interval=0.01, timeout=60.0, workers=2):
+    """
+    Задержка "файл записан -> файл перемещён" для режима слежения:
+    файлы корпуса по одному копируются в наблюдаемую папку с паузой interval
+    """
+    import shutil
+    import threading
+    from watchdog.observers import Observer
+    from organizer import OutputFolderHandler
+
+    written = {}
+    finished = {}
+    done = threading.Event()
+
+    def on_result(result):
+        finished[result.get("source")] = time.perf_counter()
+        if len(finished) >= len(paths):
+            done.set()
+
+    with tempfile.TemporaryDirectory() as folder:
+        output = os.path.join(folder, "output")
+        project = os.path.join(folder, "project")
+        os.makedirs(output)
+        os.makedirs(project)
+        handler = OutputFolderHandler(project, lambda message: None, workers=workers,
+                                      result_callback=on_result)
+        observer = Observer()
+        observer.schedule(handler, output, recursive=True)
+        observer.start()
+        try:
+            start = time.perf_counter()
+            for index, path in enumerate(paths):
+                destination = os.path.join(output, f"{index:06d}{os.path.splitext(path)[1]}")
+                written[destination] = time.perf_counter()
+                shutil.copyfile(path, destination)
+                time.sleep(interval)
+            done.wait(timeout)
+            elapsed = time.perf_counter() - start
+        finally:
+            observer.stop()
+            observer.join()
+            queue_metrics = handler.metrics()
+            handler.close()
+
+    latencies = sorted(finished[path] - written[path] for path in finished if path in written)
+    result = {
+        "files": len(paths),
+        "handled": len(latencies),
+        "elapsed_s": round(elapsed, 3),
+        "queue": {key: value for key, value in queue_metrics.items() if not key.startswith("latency")},
+    }
+    if latencies:
+        result["latency_avg_s"] = round(sum(latencies) / len(latencies), 4)
+        result["latency_p50_s"] = round(latencies[len(latencies) // 2], 4)
+        result["latency_p95_s"] = round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 4)
+        result["latency_max_s"] = round(latencies[-1], 4)
+    return result
+
+
+def _flatten(results, prefix=""):
+    # {"a": {"b": 1}} -> {"a.b": 1}, только числовые значения
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(_flatten(value, name + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def compare_results(previous, current):
+    """
+    Сравнивает два файла результатов: для каждой числовой метрики - старое
+    значение, новое и их отношение (новое / старое)
+    """
+    old = _flatten(previous.get("results", previous))
+    new = _flatten(current.get("results", current))
+    return {
+        name: {"old": old[name], "new": new[name],
+               "ratio": round(new[name] / old[name], 3) if old[name] else None}
+        for name in sorted(old.keys() & new.keys())
+    }
+
+
+def bench_startup_rescan(folders=2000, files_per_folder=50):
+    """
+    Повторный запуск на папке output, где остались только посторонние файлы:
+    полный обход, обход по снимку дерева и обход по снимку после появления
+    одного нового изображения
+    """
+    import shutil
+    from organizer import process_all_files
+
+    def run(output, project, use_snapshot):
+        start = time.perf_counter()
+        processed = sum(1 for _ in process_all_files(output, project, use_snapshot=use_snapshot))
+        return round(time.perf_counter() - start, 4), processed
+
+    result = {"folders": folders, "files": folders * files_per_folder}
+    with tempfile.TemporaryDirectory() as folder:
+        output = os.path.join(folder, "output")
+        project = os.path.join(folder, "project")
+        os.makedirs(project)
+        for index in range(folders):
+            subfolder = os.path.join(output, f"{index // 100:03d}", f"{index:05d}")
+            os.makedirs(subfolder)
+            for number in range(files_per_folder):
+                with open(os.path.join(subfolder, f"{number:04d}.txt"), "w") as f:
+                    f.write("leftover")
+        # Снимок не запоминает только что изменённые папки - состариваем дерево
+        past = time.time() - 60
+        for path, _, _ in os.walk(output):
+            os.utime(path, (past, past))
+
+        result["full_scan_s"], _ = run(output, project, False)
+        result["first_snapshot_scan_s"], _ = run(output, project, True)
+        result["snapshot_scan_s"], _ = run(output, project, True)
+        changed = os.path.join(output, "000", "00042")
+        shutil.copyfile(make_metadata_corpus(os.path.join(folder, "new"), 1, size=(64, 64))[0],
+                        os.path.join(changed, "new.png"))
+        result["snapshot_scan_after_change_s"], result["processed_after_change"] = run(output, project, True)
+    return result
+
+
+def bench_search(rows=500000, repeat=5):
+    """
+    Поиск по индексу из rows изображений: заполнение индекса и время запросов
+    """
+    from sd_parameters import GenerationParameters
+    from search_index import SearchIndex
+
+    texts = make_parameters_corpus(2000)
+    metadata = []
+    for text in texts:
+        generation = GenerationParameters(text)
+        metadata.append((generation.prompt or "unknown", generation.negative_prompt or "unknown",
+                         generation.model or "unknown", generation))
+    queries = ["cyberpunk", "cyberpunk model:dreamshaper_8", '"ornate armor"', "lora:style_3 -neon",
+               "controlnet:openpose steps:30", "drag*", "seed:12345"]
+    result = {"rows": rows}
+    with tempfile.TemporaryDirectory() as folder:
+        index = SearchIndex(folder, batch_size=5000)
+        start = time.perf_counter()
+        for number in range(rows):
+            index.add(f"/project/{number % 365:03d}/{number:07d}.png", metadata[number % len(metadata)],
+                      1000 + number, number)
+        index.flush()
+        result["build_s"] = round(time.perf_counter() - start, 2)
+        result["db_mb"] = round(os.path.getsize(index.path) / (1024 * 1024), 1)
+        result["queries_ms"] = {}
+        for query in queries:
+            best = None
+            for _ in range(repeat):
+                start = time.perf_counter()
+                found = index.search(query, limit=200, check_exists=False)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            result["queries_ms"][query] = {"ms": round(best * 1000, 2), "found": len(found)}
+        index.close()
+    return result
+
+
+def bench_thumbnails(count=200, size=(1024, 1024)):
+    """
+    Миниатюры для галереи: создание с нуля, чтение из файла кеша
+    и из памяти (мс на изображение)
+    """
+    from thumbnail_cache import ThumbnailCache, make_thumbnail
+
+    result = {"files": count, "size": list(size)}
+    with tempfile.TemporaryDirectory() as folder:
+        paths = make_metadata_corpus(os.path.join(folder, "images"), count, size=size)
+
+        def per_item(func):
+            start = time.perf_counter()
+            for path in paths:
+                func(path)
+            return round((time.perf_counter() - start) / len(paths) * 1000, 3)
+
+        cache = ThumbnailCache(folder)
+        result["generate_ms"] = per_item(lambda path: cache._store(path, os.stat(path), make_thumbnail(path)))
+        cache.close()
+        cache = ThumbnailCache(folder)
+        result["pack_read_ms"] = per_item(cache.get)
+        result["memory_read_ms"] = per_item(cache.cached)
+        result["pack_mb"] = round(os.path.getsize(cache.pack_path) / (1024 * 1024), 2)
+        cache.close()
+    return result
+
+
+def make_prompt_variants(count=100000, bases=5000, seed=0):
+    """
+    Промпты с мелкими отличиями: count вариантов bases исходных промптов,
+    в каждом заменены одно-два слова
+    """
+    rng = random.Random(seed)
+    vocabulary = [f"{word}{number}" for number in range(200) for word in ("tag", "style", "light", "pose", "detail")]
+    base_prompts = [rng.sample(vocabulary, rng.randint(20, 40)) for _ in range(bases)]
+    prompts = []
+    for number in range(count):
+        words = list(base_prompts[number % bases])
+        for _ in range(rng.randint(1, 2)):
+            words[rng.randrange(len(words))] = rng.choice(vocabulary)
+        prompts.append(", ".join(words))
+    return prompts
+
+
+def bench_prompt_groups(count=100000, bases=5000, chunk=10000):
+    """
+    Группировка похожих промптов: скорость assign по мере роста индекса
+    (по порциям из chunk промптов) и однократная группировка дерева папок
+    промптов в пробном режиме
+    """
+    from organizer import group_prompt_folders, prompt_file_content
+    from prompt_groups import PromptGroups
+
+    prompts = make_prompt_variants(count, bases)
+    result = {"prompts": count, "bases": bases}
+    with tempfile.TemporaryDirectory() as folder:
+        groups = PromptGroups(folder, batch_size=5000)
+        rates = []
+        start = time.perf_counter()
+        for offset in range(0, count, chunk):
+            chunk_start = time.perf_counter()
+            for number, prompt in enumerate(prompts[offset:offset + chunk], offset):
+                groups.assign(prompt, "lowres", "model", f"folder_{number}")
+            rates.append(round(min(chunk, count - offset) / (time.perf_counter() - chunk_start)))
+        groups.flush()
+        result["assign_s"] = round(time.perf_counter() - start, 2)
+        result["assign_per_s_by_chunk"] = rates
+        result["groups"] = groups.count()
+        result["db_mb"] = round(os.path.getsize(groups.path) / (1024 * 1024), 1)
+        groups.close()
+
+    with tempfile.TemporaryDirectory() as project:
+        for number, prompt in enumerate(prompts):
+            prompt_folder = os.path.join(project, f"2024-01-{number % 28 + 1:02d}", f"folder_{number:06d}")
+            os.makedirs(prompt_folder)
+            with open(os.path.join(prompt_folder, "prompt.txt"), "w", encoding="utf-8") as f:
+                f.write(prompt_file_content(prompt, "lowres", "model") + "\n")
+        start = time.perf_counter()
+        counts = group_prompt_folders(project, dry_run=True)
+        elapsed = time.perf_counter() - start
+        result["bulk_dry_run_s"] = round(elapsed, 2)
+        result["bulk_folders_per_s"] = round(counts["folders"] / elapsed)
+        result["bulk"] = counts
+    return result
+
+
+def bench_relayout(images=200000, files_per_folder=20):
+    """
+    Смена раскладки дерева проекта из images изображений: каждый промпт
+    встречается в двух папках дат, поэтому часть папок объединяется,
+    а при возврате к раскладке по датам - разделяется. Для сравнения -
+    перемещение тех же файлов по одному.
+    """
+    from datetime import datetime
+    from organizer import prompt_file_content, relayout_project, safe_move_file
+
+    folders = images // files_per_folder
+    prompts = folders // 2
+    result = {"images": images, "folders": folders}
+    with tempfile.TemporaryDirectory() as folder:
+        project = os.path.join(folder, "project")
+        for number in range(folders):
+            prompt_number = number % prompts
+            date = f"2024-{number // prompts % 12 * 5 % 12 + 1:02d}-{prompt_number % 28 + 1:02d}"
+            prompt_folder = os.path.join(project, date, f"prompt_{prompt_number:05d}_abcd")
+            os.makedirs(prompt_folder)
+            with open(os.path.join(prompt_folder, "prompt.txt"), "w", encoding="utf-8") as f:
+                f.write(prompt_file_content(f"prompt {prompt_number}", "lowres", f"model_{prompt_number % 3}") + "\n")
+            timestamp = datetime.strptime(date, "%Y-%m-%d").timestamp() + 43200
+            for index in range(files_per_folder):
+                path = os.path.join(prompt_folder, f"{number:06d}_{index:02d}.png")
+                open(path, "wb").close()
+                os.utime(path, (timestamp, timestamp))
+
+        for template in ("{model}/{month}/{prompt}", "{model}/{prompt}", "{date}/{prompt}"):
+            start = time.perf_counter()
+            counts = relayout_project(project, template)
+            counts["elapsed_s"] = round(time.perf_counter() - start, 2)
+            result[template] = counts
+
+        start = time.perf_counter()
+        moved = 0
+        for current, _, names in os.walk(project):
+            if ".sd_organizer" in current:
+                continue
+            target = os.path.join(folder, "per_file", os.path.relpath(current, project))
+            os.makedirs(target, exist_ok=True)
+            for name in names:
+                safe_move_file(os.path.join(current, name), os.path.join(target, name))
+                moved += 1
+        result["per_file_moves"] = {"files": moved, "elapsed_s": round(time.perf_counter() - start, 2)}
+    return result
+
+
+def bench_polling(files=1000000, files_per_folder=100, repeat=5, changes=10):
+    """
+    Стоимость опроса дерева из files файлов наблюдателем ScandirPollingObserver:
+    процессорное время опроса без изменений и с changes новыми файлами
+    в разных папках. Для сравнения - снимок дерева, который строит
+    PollingObserver из watchdog на каждом опросе.
+    """
+    from watchdog.utils.dirsnapshot import DirectorySnapshot
+    from polling_observer import _PolledWatch
+
+    folders = files // files_per_folder
+    result = {"files": files, "folders": folders}
+    with tempfile.TemporaryDirectory() as folder:
+        root = os.path.join(folder, "output")
+        past = time.time() - 3600
+        for number in range(folders):
+            path = os.path.join(root, f"{number // 100:03d}", f"{number % 100:02d}")
+            os.makedirs(path)
+            for index in range(files_per_folder):
+                open(os.path.join(path, f"{index:04d}.png"), "wb").close()
+        # Папки, изменённые только что, перечитываются при каждом опросе
+        for current, _, _ in os.walk(root):
+            os.utime(current, (past, past))
+
+        watch = _PolledWatch(None, root, recursive=True)
+        start = time.process_time()
+        watch.poll(emit=False)
+        result["initial_snapshot_cpu_s"] = round(time.process_time() - start, 3)
+
+        timings = []
+        for _ in range(repeat):
+            start = time.process_time()
+            watch.poll()
+            timings.append(time.process_time() - start)
+        result["idle_poll_cpu_s"] = round(min(timings), 4)
+
+        rng = random.Random(0)
+        timings = []
+        detected = 0
+        for attempt in range(repeat):
+            for change in range(changes):
+                number = rng.randrange(folders)
+                path = os.path.join(root, f"{number // 100:03d}", f"{number % 100:02d}")
+                open(os.path.join(path, f"new_{attempt}_{change}.png"), "wb").close()
+            start = time.process_time()
+            detected += len(watch.poll())
+            timings.append(time.process_time() - start)
+        result["changed_poll_cpu_s"] = round(min(timings), 4)
+        result["detected"] = detected
+        result["expected"] = repeat * changes
+
+        start = time.process_time()
+        DirectorySnapshot(root, recursive=True)
+        result["watchdog_snapshot_cpu_s"] = round(time.process_time() - start, 3)
+    return result
+
+
+def bench_manifest(rows=1000000, prompts=50000, seed=0):
+    """
+    Столбцовый журнал из rows изображений: скорость записи, загрузка
+    (с проверкой повторных строк одного пути) и частые сочетания
+    модель/сэмплер/steps/CFG. Для сравнения - тот же
+    запрос GROUP BY к таблице SQLite с этими строками.
+    """
+    import sqlite3
+    from manifest import Manifest, load_manifest, top_combinations
+
+    rng = random.Random(seed)
+    data = [
+        (f"/project/{index}.png", rng.randrange(10 ** 6), rng.randrange(10 ** 18), f"prompt {rng.randrange(prompts)}",
+         "lowres",
+         rng.choice(_MODELS), None, rng.choice(_SAMPLERS), rng.choice((20, 25, 30, 40)),
+         rng.choice((5.0, 6.5, 7.0, 7.5)), rng.randrange(2 ** 32), 512, rng.choice((512, 768)))
+        + (None,) * 3
+        for index in range(rows)
+    ]
+    result = {"rows": rows}
+    with tempfile.TemporaryDirectory() as folder:
+        manifest = Manifest(folder, batch_size=10000)
+        start = time.perf_counter()
+        for row in data:
+            manifest.append(row)
+        manifest.close()
+        elapsed = time.perf_counter() - start
+        result["write_s"] = round(elapsed, 3)
+        result["write_rows_per_s"] = round(rows / elapsed)
+
+        start = time.perf_counter()
+        loaded = load_manifest(folder)
+        result["load_s"] = round(time.perf_counter() - start, 4)
+        start = time.perf_counter()
+        top = top_combinations(loaded, limit=10)
+        result["top_combinations_s"] = round(time.perf_counter() - start, 4)
+        result["top_count"] = top[0]["count"] if top else 0
+
+        connection = sqlite3.connect(os.path.join(folder, "images.sqlite"))
+        connection.execute("CREATE TABLE images (model TEXT, sampler TEXT, steps INTEGER, cfg_scale REAL)")
+        connection.executemany("INSERT INTO images VALUES (?, ?, ?, ?)",
+                               ((row[5], row[7], row[8], row[9]) for row in data))
+        connection.commit()
+        start = time.perf_counter()
+        connection.execute(
+            "SELECT model, sampler, steps, cfg_scale, COUNT(*) AS count FROM images "
+            "GROUP BY model, sampler, steps, cfg_scale ORDER BY count DESC LIMIT 10"
+        ).fetchall()
+        result["sqlite_group_by_s"] = round(time.perf_counter() - start, 4)
+        connection.close()
+    return result
+
+
+def make_generation_pngs(folder, count=24, size=(768, 768), seed=0):
+    """
+    PNG, похожие на генерации: плавные формы с лёгким шумом, параметры
+    A1111 в чанке parameters, сжатие Pillow по умолчанию (как у web UI)
+    """
+    from PIL import Image, ImageDraw, ImageFilter
+
+    rng = random.Random(seed)
+    os.makedirs(folder, exist_ok=True)
+    paths = []
+    for index in range(count):
+        image = Image.linear_gradient("L").resize(size).convert("RGB")
+        draw = ImageDraw.Draw(image)
+        for _ in range(40):
+            x, y, radius = rng.randrange(size[0]), rng.randrange(size[1]), rng.randrange(10, 120)
+            draw.ellipse((x, y, x + radius, y + radius), fill=tuple(rng.randrange(256) for _ in range(3)))
+        image = image.filter(ImageFilter.GaussianBlur(3))
+        image = Image.blend(image, Image.effect_noise(size, 8).convert("RGB"), 0.08)
+        path = os.path.join(folder, f"{index:05d}.png")
+        image.save(path, pnginfo=_png_info(SAMPLE_PARAMETERS.format(seed=index)))
+        paths.append(path)
+    return paths
+
+
+def bench_recompress(files=24, scale=2000):
+    """
+    Фоновое сжатие PNG: выигрыш и скорость сжатия files генераций всеми
+    ядрами, а также скорость упорядочивания корпуса из scale файлов без
+    сжатия и при сжатии (один процесс, бюджеты по умолчанию) с очередью
+    из тех же генераций.
+    """
+    import shutil
+    from organizer import process_all_files, recompress_project
+    from recompress import Recompressor
+
+    result = {}
+    with tempfile.TemporaryDirectory() as folder:
+        pngs = os.path.join(folder, "pngs")
+        make_generation_pngs(pngs, files)
+        project = os.path.join(folder, "project")
+        shutil.copytree(pngs, os.path.join(project, "backlog"))
+        report = recompress_project(project, workers=os.cpu_count() or 1, cpu_budget=1.0, io_budget=1 << 40)
+        result["recompress"] = {
+            "files": report["files"],
+            "recompressed": report["recompressed"],
+            "bytes_before": report["bytes_before"],
+            "bytes_saved": report["bytes_saved"],
+            "saved_percent": round(100 * report["bytes_saved"] / report["bytes_before"], 1)
+            if report["bytes_before"] else 0,
+            "elapsed_s": report["elapsed_s"],
+            "files_per_s": round(report["files"] / report["elapsed_s"], 2) if report["elapsed_s"] else None,
+        }
+
+        corpus = os.path.join(folder, "corpus")
+        make_sd_corpus(corpus, scale)
+        for name, with_recompressor in (("organize", False), ("organize_while_recompressing", True)):
+            output = os.path.join(folder, f"output_{name}")
+            project = os.path.join(folder, f"project_{name}")
+            shutil.copytree(corpus, output)
+            shutil.copytree(pngs, os.path.join(project, "backlog"))
+            recompressor = None
+            if with_recompressor:
+                recompressor = Recompressor(project)
+                for path in sorted(os.listdir(os.path.join(project, "backlog"))):
+                    recompressor.submit(os.path.join(project, "backlog", path))
+            start = time.perf_counter()
+            count = sum(1 for _ in process_all_files(output, project, recompressor=recompressor))
+            elapsed = time.perf_counter() - start
+            result[name] = {"files": count, "elapsed_s": round(elapsed, 3), "files_per_s": round(count / elapsed, 1)}
+            if recompressor is not None:
+                report = recompressor.close(wait=False)
+                result[name]["recompressed_meanwhile"] = report["files"]
+    return result
+
+
+def bench_move(files=40, size=4 * 1024 * 1024, source_root="/dev/shm", workers=4):
+    """
+    Перемещение между устройствами: files файлов по size байт из source_root
+    (по умолчанию tmpfs) во временную папку. MoveEngine сбрасывает каждую
+    копию на диск до удаления источника, shutil.move - нет, поэтому он
+    измеряется и без fsync, и с fsync каждого файла (та же надёжность).
+    MoveEngine - последовательно и из workers потоков, как в стадии move.
+    """
+    import shutil
+    from concurrent.futures import ThreadPoolExecutor
+    from move_engine import MoveEngine
+
+    def shutil_move_fsync(source, destination):
+        shutil.move(source, destination)
+        with open(destination, "rb") as f:
+            os.fsync(f.fileno())
+
+    engine = MoveEngine()
+    modes = (
+        ("shutil_move", shutil.move, 1),
+        ("shutil_move_fsync", shutil_move_fsync, 1),
+        ("engine", engine.move, 1),
+        ("engine_parallel", engine.move, workers),
+        ("shutil_move_fsync_parallel", shutil_move_fsync, workers),
+    )
+    result = {"files": files, "size": size}
+    with tempfile.TemporaryDirectory() as target_root, \
+            tempfile.TemporaryDirectory(dir=source_root if os.path.isdir(source_root) else None) as source_folder:
+        result["cross_device"] = os.stat(source_folder).st_dev != os.stat(target_root).st_dev
+        payload = os.urandom(size)
+        for name, move, threads in modes:
+            sources = []
+            for index in range(files):
+                path = os.path.join(source_folder, f"{name}_{index}.png")
+                with open(path, "wb") as f:
+                    f.write(payload)
+                sources.append(path)
+            target = os.path.join(target_root, name)
+            os.makedirs(target)
+            start = time.perf_counter()
+            with ThreadPoolExecutor(threads) as pool:
+                list(pool.map(lambda path: move(path, os.path.join(target, os.path.basename(path))), sources))
+            elapsed = time.perf_counter() - start
+            result[name] = {"elapsed_s": round(elapsed, 3), "mb_per_s": round(files * size / elapsed / 1e6, 1)}
+    return result
+
+
+def bench_mirror(files=2000, file_size=4 * 1024 * 1024, links=200):
+    """
+    Зеркальный режим: упорядочивание корпуса из files файлов перемещением
+    и ссылками, повторный запуск по уже отражённому output и сверка после
+    удаления десятой части источников. Отдельно - задержка на файл размером
+    file_size: ссылка против копии (на которую приходится отказ от ссылок).
+    """
+    import shutil
+    from mirror import Mirror
+    from organizer import move_engine, process_all_files, reconcile_mirror, scan_image_files
+
+    result = {}
+    with tempfile.TemporaryDirectory() as folder:
+        corpus = os.path.join(folder, "corpus")
+        make_sd_corpus(corpus, files)
+        for name, options in (("move", {}), ("mirror", {"mirror": True})):
+            output = os.path.join(folder, f"output_{name}")
+            project = os.path.join(folder, f"project_{name}")
+            shutil.copytree(corpus, output)
+            start = time.perf_counter()
+            count = sum(1 for _ in process_all_files(output, project, **options))
+            elapsed = time.perf_counter() - start
+            result[name] = {"files": count, "elapsed_s": round(elapsed, 3), "files_per_s": round(count / elapsed, 1)}
+
+        output = os.path.join(folder, "output_mirror")
+        project = os.path.join(folder, "project_mirror")
+        start = time.perf_counter()
+        count = sum(1 for _ in process_all_files(output, project, mirror=True))
+        result["mirror_rerun"] = {"files": count, "elapsed_s": round(time.perf_counter() - start, 3)}
+
+        paths = sorted(scan_image_files(output))
+        for path in paths[::10]:
+            os.remove(path)
+        start = time.perf_counter()
+        counts = reconcile_mirror(project)
+        result["reconcile"] = dict(counts, elapsed_s=round(time.perf_counter() - start, 3))
+
+        big = os.path.join(folder, "big")
+        os.makedirs(big)
+        with open(os.path.join(big, "source.png"), "wb") as f:
+            f.write(os.urandom(file_size))
+        latency = {}
+        mirror = Mirror(os.path.join(folder, "project_links"))
+        try:
+            for method in ("link", "copy"):
+                target = os.path.join(folder, f"target_{method}")
+                os.makedirs(target)
+                start = time.perf_counter()
+                for index in range(links):
+                    destination = os.path.join(target, f"{index}.png")
+                    if method == "link":
+                        mirror.link(os.path.join(big, "source.png"), destination)
+                    else:
+                        move_engine.copy(os.path.join(big, "source.png"), destination)
+                latency[f"{method}_ms"] = round((time.perf_counter() - start) / links * 1000, 3)
+        finally:
+            mirror.close()
+        latency["link_methods"] = {method: count for method, count in mirror.methods.items() if count}
+        latency["file_size"] = file_size
+        result["latency"] = latency
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарки SD Organizer")
+    parser.add_argument("--files", type=int, default=300)
+    parser.add_argument("--parameters", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--update-check", action="store_true",
+                        help="проверка обновлений и время до появления окна")
+    parser.add_argument("--update-download", action="store_true",
+                        help="загрузка обновления с обрывами соединения")
+    parser.add_argument("--suite", action="store_true",
+                        help="микробенчмарки разбора и имён, пакетный режим и режим слежения")
+    parser.add_argument("--scale", type=int, default=1000,
+                        help="размер синтетического корпуса для --suite (до 100000)")
+    parser.add_argument("--watch-files", type=int, default=200,
+                        help="сколько файлов подавать в режим слежения")
+    parser.add_argument("--rescan", action="store_true",
+                        help="повторный запуск по снимку дерева папок output")
+    parser.add_argument("--search", type=int, default=0, metavar="ROWS",
+                        help="поиск по индексу из ROWS изображений")
+    parser.add_argument("--thumbnails", action="store_true",
+                        help="создание и чтение миниатюр галереи")
+    parser.add_argument("--prompt-groups", type=int, default=0, metavar="PROMPTS",
+                        help="группировка PROMPTS похожих промптов")
+    parser.add_argument("--relayout", type=int, default=0, metavar="IMAGES",
+                        help="смена раскладки дерева проекта из IMAGES изображений")
+    parser.add_argument("--polling", type=int, default=0, metavar="FILES",
+                        help="стоимость опроса дерева из FILES файлов наблюдателем без inotify")
+    parser.add_argument("--manifest", type=int, default=0, metavar="ROWS",
+                        help="запись и запросы к столбцовому журналу из ROWS изображений")
+    parser.add_argument("--recompress", type=int, default=0, metavar="FILES",
+                        help="сжатие FILES генераций PNG и его влияние на упорядочивание")
+    parser.add_argument("--move", type=int, default=0, metavar="FILES",
+                        help="перемещение между устройствами (tmpfs -> временная папка)")
+    parser.add_argument("--mirror", type=int, default=0, metavar="FILES",
+                        help="зеркальный режим: ссылки против перемещения и копий, сверка")
+    parser.add_argument("--corpus", help="сохранить синтетический корпус в эту папку и выйти")
+    parser.add_argument("--output", help="записать результаты в JSON-файл")
+    parser.add_argument("--compare", help="сравнить с результатами из JSON-файла")
+    args = parser.parse_args(argv)
+
+    if args.corpus:
+        paths = make_sd_corpus(args.corpus, args.scale)
+        print(json.dumps({"corpus": args.corpus, "files": len(paths)}))
+        return
+
+    results = {}
+    with tempfile.TemporaryDirectory() as folder:
+        paths = make_metadata_corpus(folder, args.files)
+        results["metadata_reader"] = bench_metadata_reader(paths, args.repeat)
+    results["parameters_parser"] = bench_parameters_parser(
+        make_parameters_corpus(args.parameters), args.repeat
+    )
+    if args.suite:
+        with tempfile.TemporaryDirectory() as folder:
+            paths = make_sd_corpus(folder, args.scale)
+            results["parse_and_name"] = bench_parse_and_name(paths, args.repeat)
+            results["batch"] = bench_batch(folder)
+            results["batch_no_catalog"] = bench_batch(folder, use_catalog=False)
+            results["watch"] = bench_watch_latency(paths[:args.watch_files])
+    if args.rescan:
+        results["startup_rescan"] = bench_startup_rescan()
+    if args.search:
+        results["search"] = bench_search(args.search)
+    if args.thumbnails:
+        results["thumbnails"] = bench_thumbnails()
+    if args.prompt_groups:
+        results["prompt_groups"] = bench_prompt_groups(args.prompt_groups)
+    if args.relayout:
+        results["relayout"] = bench_relayout(args.relayout)
+    if args.polling:
+        results["polling"] = bench_polling(args.polling)
+    if args.manifest:
+        results["manifest"] = bench_manifest(args.manifest)
+    if args.recompress:
+        results["recompress"] = bench_recompress(args.recompress, args.scale)
+    if args.move:
+        results["move"] = bench_move(args.move)
+    if args.mirror:
+        results["mirror"] = bench_mirror(args.mirror)
+    if args.update_check:
+        results["update_check"] = bench_update_check()
+    if args.update_download:
+        results["update_download"] = bench_update_download()
+
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version.split()[0],
+        "platform": sys.platform,
+        "cpu_count": os.cpu_count(),
+        "arguments": vars(args),
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            report["comparison"] = compare_results(json.load(f), report)
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
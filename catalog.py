@@ -0,0 +1,226 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+
+# Служебная папка внутри папки проекта для каталога и других данных органайзера
+DATA_FOLDER_NAME = ".sd_organizer"
+CATALOG_FILE_NAME = "catalog.sqlite"
+
+# Сколько байт с начала и с конца файла участвуют в выборочном хеше (quick_hash)
+HASH_SAMPLE_SIZE = 64 * 1024
+
+CatalogEntry = namedtuple(
+    "CatalogEntry",
+    ["sample_hash", "size", "mtime_ns", "source", "destination",
+     "prompt", "negative_prompt", "model", "status"],
+)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    sample_hash TEXT,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    source TEXT NOT NULL,
+    destination TEXT,
+    prompt TEXT,
+    negative_prompt TEXT,
+    model TEXT,
+    status TEXT NOT NULL,
+    processed_at REAL NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS files_source ON files(source, size, mtime_ns);
+"""
+
+_COLUMNS = ", ".join(CatalogEntry._fields)
+
+
+def get_data_folder(project_folder):
+    """
+    Возвращает (и создаёт) служебную папку органайзера в папке проекта
+    """
+    folder = os.path.join(project_folder, DATA_FOLDER_NAME)
+    os.makedirs(folder, exist_ok=True)
+    return folder
+
+
+def file_key(path):
+    """
+    Возвращает (размер, mtime в наносекундах) файла
+    """
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def quick_hash(path, size=None):
+    """
+    Выборочный хеш: размер, начало и конец файла (не хеш всего содержимого).
+
+    Для изображений этого достаточно, чтобы отличать файлы, и не нужно
+    читать многомегабайтный файл целиком. Совпадение выборочного хеша -
+    только кандидат в дубликаты: dedup сверяет такие файлы побайтово.
+    """
+    if size is None:
+        size = os.path.getsize(path)
+    digest = hashlib.blake2b(str(size).encode(), digest_size=16)
+    with open(path, "rb") as f:
+        digest.update(f.read(HASH_SAMPLE_SIZE))
+        if size > 2 * HASH_SAMPLE_SIZE:
+            f.seek(-HASH_SAMPLE_SIZE, os.SEEK_END)
+            digest.update(f.read(HASH_SAMPLE_SIZE))
+        elif size > HASH_SAMPLE_SIZE:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+class Catalog:
+    """
+    Каталог обработанных файлов в SQLite внутри папки проекта.
+
+    Записи добавляются пакетами: каждая транзакция фиксирует сразу
+    batch_size записей (или всё накопленное за flush_interval секунд).
+    Журнал WAL гарантирует, что при аварийном завершении каталог остаётся
+    целым - теряются только незафиксированные записи последнего пакета.
+    """
+
+    def __init__(self, project_folder, batch_size=500, flush_interval=2.0):
+        self.path = os.path.join(get_data_folder(project_folder), CATALOG_FILE_NAME)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._pending = []
+        self._last_flush = time.monotonic()
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._migrate()
+        self._connection.executescript(_SCHEMA)
+
+    @staticmethod
+    def exists(project_folder):
+        """
+        Есть ли в проекте каталог (без создания файла)
+        """
+        return os.path.exists(os.path.join(get_data_folder(project_folder), CATALOG_FILE_NAME))
+
+    def _migrate(self):
+        # Каталоги прежних версий называли выборочный хеш content_hash
+        columns = [row[1] for row in self._connection.execute("PRAGMA table_info(files)")]
+        if "content_hash" in columns:
+            with self._connection:
+                self._connection.execute("ALTER TABLE files RENAME COLUMN content_hash TO sample_hash")
+                self._connection.execute("DROP INDEX IF EXISTS files_content")
+        # Индексы для поиска по хешу и промпту: запросов к ним больше нет
+        with self._connection:
+            self._connection.execute("DROP INDEX IF EXISTS files_sample_hash")
+            self._connection.execute("DROP INDEX IF EXISTS files_prompt")
+
+    def lookup(self, source, key=None):
+        """
+        Ищет файл по пути, размеру и времени изменения.
+
+        Returns:
+            CatalogEntry | None
+        """
+        try:
+            size, mtime_ns = key or file_key(source)
+        except OSError:
+            return None
+        with self._lock:
+            for row in reversed(self._pending):
+                if row[3] == source and row[1] == size and row[2] == mtime_ns:
+                    return CatalogEntry(*row[:9])
+            row = self._connection.execute(
+                f"SELECT {_COLUMNS} FROM files WHERE source = ? AND size = ? AND mtime_ns = ?",
+                (source, size, mtime_ns),
+            ).fetchone()
+        return CatalogEntry(*row) if row else None
+
+    def prompts_by_folder(self):
+        """
+        Промпты по папкам, в которые перемещались файлы: {абсолютный путь папки: (pos, neg, model)}
+        """
+        self.flush()
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT destination, prompt, negative_prompt, model FROM files "
+                "WHERE status = 'moved_to_prompt_folder' AND destination IS NOT NULL AND prompt IS NOT NULL "
+                "ORDER BY id"
+            ).fetchall()
+        return {os.path.abspath(os.path.dirname(row[0])): row[1:] for row in rows}
+
+    def relocate(self, moves):
+        """
+        Обновляет пути назначения после переноса файлов внутри проекта.
+        moves - список пар (прежний путь, новый путь).
+        """
+        self.flush()
+        with self._lock:
+            with self._connection:
+                # Один проход по таблице вместо поиска по неиндексированному столбцу для каждой пары
+                self._connection.execute(
+                    "CREATE TEMP TABLE IF NOT EXISTS moves (old TEXT PRIMARY KEY, new TEXT NOT NULL)"
+                )
+                self._connection.execute("DELETE FROM moves")
+                self._connection.executemany("INSERT OR REPLACE INTO moves (old, new) VALUES (?, ?)", moves)
+                self._connection.execute(
+                    "UPDATE files SET destination = (SELECT new FROM moves WHERE old = files.destination) "
+                    "WHERE destination IN (SELECT old FROM moves)"
+                )
+
+    def forget(self, destinations):
+        """
+        Удаляет записи файлов, которые больше не лежат в проекте (вернули отменой обработки)
+        """
+        self.flush()
+        with self._lock:
+            with self._connection:
+                self._connection.execute("CREATE TEMP TABLE IF NOT EXISTS forgotten (path TEXT PRIMARY KEY)")
+                self._connection.execute("DELETE FROM forgotten")
+                self._connection.executemany("INSERT OR IGNORE INTO forgotten (path) VALUES (?)",
+                                             [(path,) for path in destinations])
+                self._connection.execute("DELETE FROM files WHERE destination IN (SELECT path FROM forgotten)")
+
+    def record(self, source, key, result, metadata=None, sample_hash=None):
+        """
+        Добавляет результат обработки файла в очередь на запись
+        """
+        pos_prompt = neg_prompt = model = None
+        if metadata is not None:
+            pos_prompt, neg_prompt, model = metadata[:3]
+        size, mtime_ns = key
+        row = (sample_hash, size, mtime_ns, source, result.get("destination"),
+               pos_prompt, neg_prompt, model, result["status"], time.time())
+        with self._lock:
+            self._pending.append(row)
+            due = (
+                len(self._pending) >= self.batch_size
+                or time.monotonic() - self._last_flush >= self.flush_interval
+            )
+        if due:
+            self.flush()
+
+    def flush(self):
+        """
+        Записывает накопленные записи одной транзакцией
+        """
+        with self._lock:
+            self._last_flush = time.monotonic()
+            if not self._pending:
+                return
+            rows, self._pending = self._pending, []
+            with self._connection:
+                self._connection.executemany(
+                    f"INSERT OR REPLACE INTO files ({_COLUMNS}, processed_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    rows,
+                )
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,430 @@
+import argparse
+import json
+import os
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+
+
+# Модули органайзера загружаются внутри команд: запуск без дисплея не должен
+# тянуть PyQt5, проверку обновлений (requests) и наблюдатель watchdog без нужды.
+
+class JsonLinesWriter:
+    """
+    Потокобезопасный вывод событий в формате JSON Lines
+    """
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout
+        self._lock = threading.Lock()
+        self.statuses = Counter()
+
+    def write(self, event, **fields):
+        line = json.dumps(dict(event=event, **fields), ensure_ascii=False, default=str)
+        with self._lock:
+            self.stream.write(line + "\n")
+            self.stream.flush()
+
+    def result(self, result, **fields):
+        with self._lock:
+            self.statuses[result["status"]] += 1
+        self.write("result", **fields, **result)
+
+
+def _log_to_stderr(verbose):
+    if not verbose:
+        return None
+    return lambda message: print(message, file=sys.stderr, flush=True)
+
+
+def _start_recompressor(args):
+    if not args.recompress:
+        return None
+    from recompress import Recompressor
+
+    return Recompressor(
+        args.project,
+        workers=args.recompress_workers,
+        cpu_budget=args.recompress_cpu,
+        io_budget=args.recompress_io * 1024 * 1024,
+        log_callback=_log_to_stderr(args.verbose),
+    )
+
+
+def _run_batch(args, writer, recompressor=None):
+    from organizer import process_all_files
+
+    processed = 0
+    for processed, total, result in process_all_files(
+        args.output, args.project,
+        log_callback=_log_to_stderr(args.verbose),
+        use_catalog=not args.no_catalog,
+        duplicate_policy=args.duplicates,
+        group_prompts=args.group_prompts,
+        recompressor=recompressor,
+        mirror=args.mirror,
+        mirror_fallback=args.mirror_fallback,
+    ):
+        writer.result(result, processed=processed, total=total)
+    return processed
+
+
+def _start_stats(args):
+    # Статистика стадий включается только по запросу: без --stats замеров нет
+    if not args.stats:
+        return None
+    from organizer import stats
+    from stats import StatsDumper
+
+    stats.enable()
+    dumper = StatsDumper(stats, args.stats, args.stats_interval)
+    dumper.start()
+    return dumper
+
+
+def cmd_batch(args):
+    writer = JsonLinesWriter()
+    start = time.perf_counter()
+    dumper = _start_stats(args)
+    recompressor = _start_recompressor(args)
+    try:
+        processed = _run_batch(args, writer, recompressor)
+    finally:
+        if dumper is not None:
+            dumper.stop()
+        elapsed = round(time.perf_counter() - start, 3)
+        if recompressor is not None:
+            # Упорядочивание закончено - дожимаем очередь до выхода
+            writer.write("recompress", **recompressor.close())
+    writer.write(
+        "summary",
+        mode="batch",
+        processed=processed,
+        statuses=dict(writer.statuses),
+        elapsed=elapsed,
+    )
+    return 1 if writer.statuses.get("error") else 0
+
+
+def cmd_watch(args):
+    from organizer import OutputFolderHandler
+    from polling_observer import ScandirPollingObserver, start_observer
+
+    writer = JsonLinesWriter()
+    start = time.perf_counter()
+    stop = threading.Event()
+    # systemd останавливает службу через SIGTERM, из терминала - Ctrl+C
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+
+    dumper = _start_stats(args)
+    recompressor = _start_recompressor(args)
+    processed = 0
+    if not args.no_initial_scan:
+        processed = _run_batch(args, writer, recompressor)
+
+    log = _log_to_stderr(args.verbose) or (lambda message: None)
+    handler = OutputFolderHandler(
+        args.project,
+        log,
+        use_catalog=not args.no_catalog,
+        duplicate_policy=args.duplicates,
+        workers=args.workers,
+        result_callback=writer.result,
+        output_folder=args.output,
+        group_prompts=args.group_prompts,
+        recompressor=recompressor,
+        mirror=args.mirror,
+        mirror_fallback=args.mirror_fallback,
+    )
+    observer = start_observer(handler, args.output, mode=args.observer, log_callback=log)
+    writer.write(
+        "watching",
+        output=args.output,
+        project=args.project,
+        observer="polling" if isinstance(observer, ScandirPollingObserver) else "native",
+    )
+    try:
+        while not stop.is_set() and observer.is_alive():
+            stop.wait(1)
+    finally:
+        observer.stop()
+        observer.join()
+        metrics = handler.metrics()
+        handler.close()
+        if recompressor is not None:
+            # Очередь не дожимаем: оставшиеся файлы подхватит команда recompress
+            writer.write("recompress", **recompressor.close(wait=False))
+        if dumper is not None:
+            dumper.stop()
+
+    writer.write(
+        "summary",
+        mode="watch",
+        processed=processed + metrics["processed"],
+        statuses=dict(writer.statuses),
+        elapsed=round(time.perf_counter() - start, 3),
+        queue=metrics,
+    )
+    return 0
+
+
+def cmd_undo(args):
+    from journal import list_runs
+
+    writer = JsonLinesWriter()
+    if args.list:
+        for run, moves, ended, undone in list_runs(args.project):
+            writer.write("run", run=run, moves=moves, ended=ended, undone=undone)
+        return 0
+
+    from organizer import undo_run
+
+    start = time.perf_counter()
+    result = undo_run(args.project, args.run, log_callback=_log_to_stderr(args.verbose))
+    writer.write("summary", mode="undo", elapsed=round(time.perf_counter() - start, 3), **result)
+    return 1 if result["failed"] else 0
+
+
+def cmd_index(args):
+    from organizer import build_search_index
+
+    writer = JsonLinesWriter()
+    start = time.perf_counter()
+    counts = build_search_index(args.project, log_callback=_log_to_stderr(args.verbose))
+    writer.write("summary", mode="index", elapsed=round(time.perf_counter() - start, 3), **counts)
+    return 0
+
+
+def cmd_manifest(args):
+    from manifest import NUMBER_COLUMNS, STRING_COLUMNS, load_manifest, top_combinations
+    from organizer import build_manifest
+
+    writer = JsonLinesWriter()
+    start = time.perf_counter()
+    fields = tuple(field.strip() for field in args.by.split(",") if field.strip())
+    unknown = [field for field in fields if field not in NUMBER_COLUMNS and field not in STRING_COLUMNS]
+    if not fields or unknown:
+        print(f"ОШИБКА: Неизвестные поля: {', '.join(unknown) or args.by!r} "
+              f"(доступны: {', '.join((*STRING_COLUMNS, *NUMBER_COLUMNS))})", file=sys.stderr)
+        return 2
+    if args.rebuild:
+        counts = build_manifest(args.project, log_callback=_log_to_stderr(args.verbose))
+        writer.write("rebuilt", elapsed=round(time.perf_counter() - start, 3), **counts)
+    manifest = load_manifest(args.project)
+    for combination in top_combinations(manifest, fields, limit=args.top):
+        writer.write("combination", **combination)
+    writer.write("summary", mode="manifest", rows=manifest["rows"], elapsed=round(time.perf_counter() - start, 3))
+    return 0
+
+
+def cmd_recompress(args):
+    from organizer import recompress_project
+
+    writer = JsonLinesWriter()
+    report = recompress_project(
+        args.project,
+        log_callback=_log_to_stderr(args.verbose),
+        workers=args.workers,
+        cpu_budget=args.cpu_budget,
+        io_budget=args.io_budget * 1024 * 1024,
+        min_saving=args.min_saving,
+        level=args.level,
+    )
+    writer.write("summary", mode="recompress", **report)
+    return 1 if report["failed"] else 0
+
+
+def cmd_reconcile(args):
+    from organizer import reconcile_mirror
+
+    writer = JsonLinesWriter()
+    start = time.perf_counter()
+    counts = reconcile_mirror(args.project, dry_run=args.dry_run, force=args.force,
+                              log_callback=_log_to_stderr(args.verbose))
+    writer.write("summary", mode="reconcile", dry_run=args.dry_run,
+                 elapsed=round(time.perf_counter() - start, 3), **counts)
+    return 0
+
+
+def cmd_search(args):
+    from organizer import search_images
+
+    writer = JsonLinesWriter()
+    for result in search_images(args.project, args.query, limit=args.limit):
+        writer.write("image", **result)
+    return 0
+
+
+def cmd_group(args):
+    from organizer import build_search_index, group_prompt_folders
+
+    writer = JsonLinesWriter()
+    start = time.perf_counter()
+    log_callback = _log_to_stderr(args.verbose)
+    counts = group_prompt_folders(args.project, log_callback=log_callback, dry_run=args.dry_run,
+                                  threshold=args.threshold)
+    if counts["moved"]:
+        # Перемещённые изображения попадают в поиск под новыми путями
+        build_search_index(args.project, log_callback=log_callback)
+    writer.write("summary", mode="group", dry_run=args.dry_run,
+                 elapsed=round(time.perf_counter() - start, 3), **counts)
+    return 1 if counts["failed"] else 0
+
+
+def cmd_relayout(args):
+    from organizer import relayout_project
+
+    writer = JsonLinesWriter()
+    start = time.perf_counter()
+
+    def on_operation(operation, source, destination):
+        writer.write(operation, source=source, destination=destination)
+
+    try:
+        counts = relayout_project(
+            args.project, args.template, dry_run=args.dry_run,
+            log_callback=_log_to_stderr(args.verbose),
+            operation_callback=on_operation if args.dry_run or args.verbose else None,
+            use_catalog=not args.no_catalog,
+        )
+    except ValueError as e:
+        print(f"ОШИБКА: {e}", file=sys.stderr)
+        return 2
+    writer.write("summary", mode="relayout", template=args.template, dry_run=args.dry_run,
+                 elapsed=round(time.perf_counter() - start, 3), **counts)
+    return 1 if counts["failed"] else 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="sd-organizer",
+        description="Организатор генераций StableDiffusion без графического интерфейса. "
+                    "Результат по каждому файлу выводится в stdout в формате JSON Lines.",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def add_common(command):
+        command.add_argument("output", help="папка output")
+        command.add_argument("project", help="папка проекта")
+        command.add_argument("--no-catalog", action="store_true", help="не использовать каталог проекта")
+        command.add_argument("--duplicates", choices=("skip", "hardlink", "keep"), default="skip",
+                             help="что делать с побайтовыми дубликатами")
+        command.add_argument("--group-prompts", action="store_true",
+                             help="складывать изображения похожих промптов в одну папку")
+        command.add_argument("--mirror", action="store_true",
+                             help="не перемещать файлы, а собрать проект из ссылок на них (reflink или жёстких)")
+        command.add_argument("--mirror-fallback", choices=("symlink", "copy", "move"), default="symlink",
+                             help="что делать, если ссылку создать нельзя (папки на разных дисках)")
+        command.add_argument("--recompress", action="store_true",
+                             help="пережимать перемещённые PNG без потерь в фоне")
+        command.add_argument("--recompress-workers", type=int, default=1, help="процессов сжатия PNG")
+        command.add_argument("--recompress-cpu", type=float, default=0.25,
+                             help="доля процессора на процесс сжатия, от 0 до 1")
+        command.add_argument("--recompress-io", type=float, default=20.0,
+                             help="чтение и запись при сжатии, МБ/с")
+        command.add_argument("-v", "--verbose", action="store_true", help="выводить журнал в stderr")
+        command.add_argument("--stats", metavar="FILE",
+                             help="периодически записывать статистику стадий в FILE "
+                                  "(.prom/.txt - формат Prometheus, иначе JSON)")
+        command.add_argument("--stats-interval", type=float, default=10.0,
+                             help="период записи статистики в секундах")
+
+    batch = commands.add_parser("batch", help="упорядочить существующие файлы и выйти")
+    add_common(batch)
+    batch.set_defaults(handler=cmd_batch)
+
+    watch = commands.add_parser("watch", help="упорядочить существующие файлы и следить за новыми")
+    add_common(watch)
+    watch.add_argument("--workers", type=int, default=2, help="количество обработчиков новых файлов")
+    watch.add_argument("--no-initial-scan", action="store_true", help="не обрабатывать существующие файлы")
+    watch.add_argument(
+        "--observer", choices=["auto", "native", "polling"], default="auto",
+        help="системные события, опрос папок (для SMB/NFS) или выбор автоматически",
+    )
+    watch.set_defaults(handler=cmd_watch)
+
+    undo = commands.add_parser("undo", help="вернуть файлы, перемещённые запуском, на прежние места")
+    undo.add_argument("project", help="папка проекта")
+    undo.add_argument("--run", help="идентификатор запуска (по умолчанию последний)")
+    undo.add_argument("--list", action="store_true", help="показать запуски из журнала")
+    undo.add_argument("-v", "--verbose", action="store_true", help="выводить журнал в stderr")
+    undo.set_defaults(handler=cmd_undo)
+
+    index = commands.add_parser("index", help="добавить в поисковый индекс изображения из папки проекта")
+    index.add_argument("project", help="папка проекта")
+    index.add_argument("-v", "--verbose", action="store_true", help="выводить журнал в stderr")
+    index.set_defaults(handler=cmd_index)
+
+    search = commands.add_parser("search", help="найти изображения по промптам и параметрам")
+    search.add_argument("project", help="папка проекта")
+    search.add_argument("query", help='запрос, например: cyberpunk model:dreamshaper_8 -blurry')
+    search.add_argument("--limit", type=int, default=200, help="максимум результатов")
+    search.set_defaults(handler=cmd_search)
+
+    manifest = commands.add_parser("manifest", help="самые частые сочетания параметров генерации в проекте")
+    manifest.add_argument("project", help="папка проекта")
+    manifest.add_argument("--by", default="model,sampler,steps,cfg_scale",
+                          help="поля сочетания через запятую: model, sampler, prompt, negative_prompt, "
+                               "seed, steps, cfg_scale, width, height")
+    manifest.add_argument("--top", type=int, default=20, help="количество сочетаний")
+    manifest.add_argument("--rebuild", action="store_true",
+                          help="пересобрать журнал по изображениям, уже лежащим в папке проекта")
+    manifest.add_argument("-v", "--verbose", action="store_true", help="выводить журнал в stderr")
+    manifest.set_defaults(handler=cmd_manifest)
+
+    recompress = commands.add_parser("recompress", help="пережать без потерь PNG в папке проекта")
+    recompress.add_argument("project", help="папка проекта")
+    recompress.add_argument("--workers", type=int, default=max((os.cpu_count() or 2) // 2, 1),
+                            help="процессов сжатия")
+    recompress.add_argument("--cpu-budget", type=float, default=1.0,
+                            help="доля процессора на процесс сжатия, от 0 до 1")
+    recompress.add_argument("--io-budget", type=float, default=100.0, help="чтение и запись, МБ/с")
+    recompress.add_argument("--min-saving", type=float, default=0.01,
+                            help="минимальный выигрыш, доля размера файла (меньший не сохраняется)")
+    recompress.add_argument("--level", type=int, default=9, choices=range(1, 10), metavar="1-9",
+                            help="уровень сжатия zlib (9 - лучшее и самое медленное)")
+    recompress.add_argument("-v", "--verbose", action="store_true", help="выводить журнал в stderr")
+    recompress.set_defaults(handler=cmd_recompress)
+
+    reconcile = commands.add_parser("reconcile",
+                                    help="убрать из проекта ссылки зеркального режима на удалённые файлы")
+    reconcile.add_argument("project", help="папка проекта")
+    reconcile.add_argument("--dry-run", action="store_true", help="только посчитать, что будет удалено")
+    reconcile.add_argument("--force", action="store_true",
+                           help="удалять, даже если не найден ни один источник (папка output недоступна)")
+    reconcile.add_argument("-v", "--verbose", action="store_true", help="выводить журнал в stderr")
+    reconcile.set_defaults(handler=cmd_reconcile)
+
+    group = commands.add_parser("group", help="объединить папки похожих промптов в папке проекта")
+    group.add_argument("project", help="папка проекта")
+    group.add_argument("--dry-run", action="store_true", help="только показать, что будет объединено")
+    group.add_argument("--threshold", type=float, help="минимальное сходство промптов, от 0 до 1 (по умолчанию 0.7)")
+    group.add_argument("-v", "--verbose", action="store_true", help="выводить журнал в stderr")
+    group.set_defaults(handler=cmd_group)
+
+    relayout = commands.add_parser("relayout", help="разложить папку проекта по новому шаблону")
+    relayout.add_argument("project", help="папка проекта")
+    relayout.add_argument("template",
+                          help="шаблон папок, например {model}/{month}/{prompt}; поля: "
+                               "date, year, month, day, model, prompt (по умолчанию {date}/{prompt})")
+    relayout.add_argument("--dry-run", action="store_true", help="только вывести операции, ничего не перемещать")
+    relayout.add_argument("--no-catalog", action="store_true",
+                          help="не брать промпты из каталога для папок без prompt.txt")
+    relayout.add_argument("-v", "--verbose", action="store_true", help="выводить операции и журнал")
+    relayout.set_defaults(handler=cmd_relayout)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if hasattr(args, "output") and os.path.abspath(args.output) == os.path.abspath(args.project):
+        print("ОШИБКА: Папки 'project' и 'output' не должны совпадать.", file=sys.stderr)
+        return 2
+    return args.handler(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
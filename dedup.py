@@ -0,0 +1,154 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+from catalog import quick_hash
+
+
+# Что делать с входящим файлом, если в папке назначения уже есть точно такой же:
+#   skip     - удалить входящий файл, копия уже упорядочена
+#   hardlink - сохранить под своим именем как жёсткую ссылку на существующий файл
+#   keep     - сохранить отдельную копию с суффиксом _1, _2, ... (прежнее поведение)
+DUPLICATE_POLICIES = ("skip", "hardlink", "keep")
+
+FULL_HASH_CHUNK = 1024 * 1024
+
+
+def full_hash(path):
+    digest = hashlib.blake2b(digest_size=32)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(FULL_HASH_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class _FolderIndex:
+    # Файлы одной папки назначения: размер -> {путь: [частичный хеш, полный хеш]}
+
+    def __init__(self, folder):
+        self.lock = threading.Lock()
+        self.by_size = {}
+        try:
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_file(follow_symlinks=False):
+                            self.add(entry.path, entry.stat().st_size)
+                    except OSError:
+                        continue
+        except OSError:
+            pass
+
+    def add(self, path, size, partial=None, full=None):
+        self.by_size.setdefault(size, {})[path] = [partial, full]
+
+    def remove(self, path, size):
+        candidates = self.by_size.get(size)
+        if candidates is not None:
+            candidates.pop(path, None)
+
+
+class DuplicateIndex:
+    """
+    Поиск побайтовых дубликатов в папках назначения.
+
+    Сравнение идёт в три шага: размер, хеш начала и конца файла, полный хеш.
+    Хеши существующих файлов считаются лениво и только для кандидатов
+    с совпавшим размером. Индексы папок хранятся в памяти (не больше
+    max_folders последних использованных).
+    """
+
+    def __init__(self, policy="skip", max_folders=256):
+        if policy not in DUPLICATE_POLICIES:
+            raise ValueError(f"Неизвестная политика дубликатов: {policy}")
+        self.policy = policy
+        self.max_folders = max_folders
+        self._folders = OrderedDict()
+        self._lock = threading.Lock()
+        self.skipped = 0
+        self.linked = 0
+        self.bytes_saved = 0
+
+    def _folder(self, folder):
+        with self._lock:
+            index = self._folders.get(folder)
+            if index is not None:
+                self._folders.move_to_end(folder)
+                return index
+        index = _FolderIndex(folder)
+        with self._lock:
+            index = self._folders.setdefault(folder, index)
+            while len(self._folders) > self.max_folders:
+                self._folders.popitem(last=False)
+        return index
+
+    def _find(self, index, source, size):
+        # Возвращает путь к существующему дубликату source или None
+        candidates = index.by_size.get(size)
+        if not candidates:
+            return None
+        source_partial = quick_hash(source, size)
+        source_full = None
+        for path, hashes in list(candidates.items()):
+            try:
+                if hashes[0] is None:
+                    hashes[0] = quick_hash(path, size)
+                if hashes[0] != source_partial:
+                    continue
+                if hashes[1] is None:
+                    hashes[1] = full_hash(path)
+            except OSError:
+                # Файл удалили или заменили снаружи
+                index.remove(path, size)
+                continue
+            if source_full is None:
+                source_full = full_hash(source)
+            if hashes[1] == source_full:
+                return path
+        return None
+
+    def place(self, source, destination, move):
+        """
+        Перемещает source в destination, если в папке назначения нет такого же файла.
+
+        Args:
+            move: функция перемещения (source, destination) -> bool
+
+        Returns:
+            tuple: (путь к существующему дубликату или None, результат move или None)
+        """
+        folder = os.path.dirname(destination)
+        index = self._folder(folder)
+        size = os.path.getsize(source)
+        with index.lock:
+            duplicate = self._find(index, source, size)
+            if duplicate is None or self.policy == "keep":
+                moved = move(source, destination)
+                index.add(destination, size)
+                return None, moved
+
+            if self.policy == "hardlink":
+                try:
+                    os.link(duplicate, destination)
+                except OSError:
+                    # Файловая система не поддерживает ссылки - храним копию
+                    moved = move(source, destination)
+                    index.add(destination, size)
+                    return None, moved
+                os.remove(source)
+                index.add(destination, size, *index.by_size[size][duplicate])
+                with self._lock:
+                    self.linked += 1
+                    self.bytes_saved += size
+                return duplicate, None
+
+            os.remove(source)
+            with self._lock:
+                self.skipped += 1
+                self.bytes_saved += size
+            return duplicate, None
+
+    def stats(self):
+        with self._lock:
+            return {"skipped": self.skipped, "linked": self.linked, "bytes_saved": self.bytes_saved}
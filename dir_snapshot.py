@@ -0,0 +1,108 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+from catalog import get_data_folder
+
+
+# Папки, изменённые позже чем за столько секунд до сканирования, не запоминаются:
+# файл, появившийся в тот же момент, мог не изменить время изменения папки
+RACY_INTERVAL = 2.0
+
+
+def _snapshot_path(project_folder, output_folder):
+    # Свой снимок для каждой папки output, с которой работает проект
+    key = hashlib.md5(os.path.abspath(output_folder).encode("utf-8")).hexdigest()[:12]
+    return os.path.join(get_data_folder(project_folder), f"output_snapshot_{key}.json")
+
+
+class DirectorySnapshot:
+    """
+    Снимок дерева папок output: для каждой папки без изображений хранятся
+    inode, время изменения и список вложенных папок.
+
+    Если папка не изменилась с прошлого сканирования, её содержимое
+    не перечитывается - проверяются только вложенные папки. Так повторный
+    запуск обходится одним stat на папку вместо чтения всех оставшихся
+    в output файлов. Наблюдатель сбрасывает записи папок, в которых видел
+    события (invalidate), поэтому изменения во время слежения не теряются.
+    """
+
+    def __init__(self, project_folder, output_folder):
+        self.path = _snapshot_path(project_folder, output_folder)
+        self.root = os.path.abspath(output_folder)
+        self._lock = threading.Lock()
+        self._folders = {}
+        self._scanned = None
+        self.skipped = 0
+        self.listed = 0
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get("root") == self.root:
+            self._folders = {path: tuple(record) for path, record in data.get("folders", {}).items()}
+
+    def save(self):
+        with self._lock:
+            data = {"root": self.root, "folders": self._folders}
+            temp_path = f"{self.path}.tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(temp_path, self.path)
+
+    def _key(self, folder):
+        return os.path.relpath(folder, self.root)
+
+    def begin_scan(self):
+        """
+        Начинает полный обход: записи папок, которых больше нет, будут удалены
+        """
+        with self._lock:
+            self._scanned = {}
+            self.skipped = self.listed = 0
+
+    def end_scan(self):
+        with self._lock:
+            if self._scanned is not None:
+                self._folders, self._scanned = self._scanned, None
+
+    def unchanged(self, folder, stat):
+        """
+        Возвращает список вложенных папок, если папка не менялась, иначе None
+        """
+        key = self._key(folder)
+        with self._lock:
+            record = self._folders.get(key)
+            if record is None or record[0] != stat.st_ino or record[1] != stat.st_mtime_ns:
+                self.listed += 1
+                return None
+            if self._scanned is not None:
+                self._scanned[key] = record
+            self.skipped += 1
+            return record[2]
+
+    def record(self, folder, stat, subfolders, has_images):
+        """
+        Запоминает прочитанную папку. Папки с изображениями не запоминаются:
+        после перемещения файлов их время изменения всё равно поменяется.
+        """
+        if has_images or time.time() - stat.st_mtime < RACY_INTERVAL:
+            return
+        key = self._key(folder)
+        with self._lock:
+            target = self._scanned if self._scanned is not None else self._folders
+            target[key] = (stat.st_ino, stat.st_mtime_ns, list(subfolders))
+
+    def invalidate(self, folder):
+        key = self._key(folder)
+        with self._lock:
+            self._folders.pop(key, None)
+            if self._scanned is not None:
+                self._scanned.pop(key, None)
@@ -0,0 +1,191 @@
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+
+class _Pending:
+    __slots__ = ("signature", "next_check", "closed", "changed")
+
+    def __init__(self, now):
+        self.signature = None
+        self.next_check = now
+        self.closed = False
+        # Когда размер или время изменения файла менялись в последний раз
+        self.changed = now
+
+
+class DebouncedEventQueue:
+    """
+    Очередь событий файловой системы с объединением и ожиданием стабильности файла.
+
+    События по одному пути объединяются в одну задачу. Файл передаётся на обработку,
+    когда его размер и время изменения перестали меняться между двумя проверками
+    (или сразу после события закрытия файла). Обработку выполняет пул потоков,
+    поэтому поток наблюдателя watchdog никогда не ждёт.
+
+    Если ожидающих файлов больше max_pending, push() блокируется - так нагрузка
+    передаётся обратно источнику событий, а память остаётся ограниченной.
+
+    Пустой файл стабильным не считается (генератор мог создать его и ещё
+    не начать запись); если он остаётся пустым и неизменным max_wait секунд,
+    он отбрасывается, чтобы не висеть в ожидании вечно.
+    """
+
+    def __init__(self, process, workers=2, check_interval=0.2, max_pending=10000,
+                 on_result=None, latency_window=1000, max_wait=60.0):
+        self.process = process
+        self.on_result = on_result
+        self.workers = workers
+        self.check_interval = check_interval
+        self.max_pending = max_pending
+        self.max_wait = max_wait
+        self._pending = {}
+        self._condition = threading.Condition()
+        self._ready = queue.Queue(maxsize=max(1, workers * 4))
+        self._stop = threading.Event()
+        self._threads = []
+        self._in_progress = 0
+        self._processed = 0
+        self._dropped = 0
+        self._latencies = deque(maxlen=latency_window)
+
+    def start(self):
+        self._stop.clear()
+        self._threads = [threading.Thread(target=self._schedule, name="event-scheduler", daemon=True)]
+        for number in range(self.workers):
+            self._threads.append(
+                threading.Thread(target=self._work, name=f"event-worker-{number}", daemon=True)
+            )
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self, timeout=5.0):
+        """
+        Останавливает очередь; файлы, ещё ожидающие стабильности, отбрасываются
+        (их подберёт следующее сканирование папки)
+        """
+        self._stop.set()
+        with self._condition:
+            self._pending.clear()
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def push(self, path, closed=False):
+        with self._condition:
+            while len(self._pending) >= self.max_pending and path not in self._pending:
+                if self._stop.is_set():
+                    return
+                self._condition.wait(0.1)
+            pending = self._pending.get(path)
+            if pending is None:
+                pending = self._pending[path] = _Pending(time.monotonic())
+            if closed:
+                pending.closed = True
+                pending.next_check = time.monotonic()
+            self._condition.notify_all()
+
+    def discard(self, path):
+        with self._condition:
+            self._pending.pop(path, None)
+            self._condition.notify_all()
+
+    def _schedule(self):
+        while not self._stop.is_set():
+            with self._condition:
+                now = time.monotonic()
+                due = [(path, pending) for path, pending in self._pending.items() if pending.next_check <= now]
+                if not due:
+                    wait = min((p.next_check for p in self._pending.values()), default=now + 1.0) - now
+                    self._condition.wait(max(0.01, min(wait, 1.0)))
+                    continue
+
+            for path, pending in due:
+                try:
+                    stat = os.stat(path)
+                    signature = (stat.st_size, stat.st_mtime_ns)
+                except OSError:
+                    # Файл удалили или переименовали - событие перемещения добавит новый путь
+                    self.discard(path)
+                    continue
+
+                now = time.monotonic()
+                if signature != pending.signature:
+                    pending.changed = now
+                elif signature[0] == 0 and now - pending.changed >= self.max_wait:
+                    # Пустой файл так и не начали записывать
+                    with self._condition:
+                        if self._pending.get(path) is pending:
+                            del self._pending[path]
+                            self._dropped += 1
+                        self._condition.notify_all()
+                    continue
+
+                stable = signature[0] > 0 and (pending.closed or signature == pending.signature)
+                if stable:
+                    try:
+                        self._ready.put((path, stat.st_mtime), timeout=0.1)
+                    except queue.Full:
+                        # Обработчики заняты - проверим файл ещё раз позже
+                        pending.next_check = time.monotonic() + self.check_interval
+                        continue
+                    with self._condition:
+                        if self._pending.get(path) is pending:
+                            del self._pending[path]
+                        self._condition.notify_all()
+                else:
+                    pending.signature = signature
+                    pending.closed = False
+                    pending.next_check = time.monotonic() + self.check_interval
+
+    def _work(self):
+        while not self._stop.is_set():
+            try:
+                path, written_at = self._ready.get(timeout=0.2)
+            except queue.Empty:
+                continue
+            with self._condition:
+                self._in_progress += 1
+            try:
+                result = self.process(path)
+            except Exception as e:
+                result = {"status": "error", "message": f"Ошибка при обработке файла {path}: {e}"}
+            finally:
+                with self._condition:
+                    self._in_progress -= 1
+                    self._processed += 1
+                    # Задержка от записи файла (по его mtime) до окончания обработки
+                    self._latencies.append(max(0.0, time.time() - written_at))
+            if self.on_result is not None:
+                try:
+                    self.on_result(path, result)
+                except Exception as e:
+                    # Ошибка в обработчике GUI/CLI не должна останавливать поток очереди
+                    print(f"Ошибка в обработчике результата для {path}: {e}")
+
+    def is_idle(self):
+        with self._condition:
+            return not self._pending and self._ready.empty() and self._in_progress == 0
+
+    def metrics(self):
+        """
+        Возвращает глубину очереди и задержку "файл записан -> файл упорядочен"
+        """
+        with self._condition:
+            latencies = sorted(self._latencies)
+            metrics = {
+                "pending": len(self._pending),
+                "ready": self._ready.qsize(),
+                "in_progress": self._in_progress,
+                "processed": self._processed,
+                "dropped": self._dropped,
+            }
+        if latencies:
+            metrics["latency_avg"] = sum(latencies) / len(latencies)
+            metrics["latency_p50"] = latencies[len(latencies) // 2]
+            metrics["latency_p95"] = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+            metrics["latency_max"] = latencies[-1]
+        return metrics
@@ -0,0 +1,173 @@
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+
+
+class _FolderState:
+    __slots__ = ("names", "mtime_ns", "checked", "texts")
+
+    def __init__(self, names, mtime_ns):
+        self.names = names
+        self.mtime_ns = mtime_ns
+        self.checked = time.monotonic()
+        self.texts = {}
+
+
+class FolderCache:
+    """
+    Кеш состояния папок назначения: существование папки, имена файлов в ней
+    и содержимое служебных текстовых файлов (prompt.txt).
+
+    Повторные mkdir/stat/запись prompt.txt для уже известной папки не выполняются.
+    Раз в ttl секунд запись папки сверяется с диском по времени изменения папки:
+    если папку меняли (в том числе снаружи), список файлов перечитывается.
+    Хранится не больше max_folders последних использованных папок.
+    """
+
+    def __init__(self, max_folders=1024, ttl=5.0):
+        self.max_folders = max_folders
+        self.ttl = ttl
+        self._folders = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _load(self, folder):
+        # Читает папку с диска; None, если папки нет
+        try:
+            mtime_ns = os.stat(folder).st_mtime_ns
+            with os.scandir(folder) as entries:
+                names = {entry.name for entry in entries}
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+        return _FolderState(names, mtime_ns)
+
+    def _get(self, folder):
+        # Возвращает актуальную запись папки (вызывается под блокировкой)
+        state = self._folders.get(folder)
+        if state is not None:
+            self._folders.move_to_end(folder)
+            if time.monotonic() - state.checked < self.ttl:
+                return state
+            try:
+                mtime_ns = os.stat(folder).st_mtime_ns
+            except OSError:
+                mtime_ns = None
+            if mtime_ns == state.mtime_ns:
+                state.checked = time.monotonic()
+                return state
+            del self._folders[folder]
+
+        state = self._load(folder)
+        if state is not None:
+            self._folders[folder] = state
+            while len(self._folders) > self.max_folders:
+                self._folders.popitem(last=False)
+        return state
+
+    def ensure_folder(self, folder):
+        """
+        Создаёт папку, если её ещё нет
+        """
+        with self._lock:
+            if self._get(folder) is not None:
+                return
+        os.makedirs(folder, exist_ok=True)
+        with self._lock:
+            self._get(folder)
+            parent = self._folders.get(os.path.dirname(folder))
+            if parent is not None:
+                parent.names.add(os.path.basename(folder))
+
+    def exists(self, path):
+        """
+        Проверяет, есть ли файл с таким именем, по кешу списка файлов папки
+        """
+        folder, name = os.path.split(path)
+        with self._lock:
+            state = self._get(folder)
+            return state is not None and name in state.names
+
+    def add_file(self, path):
+        """
+        Отмечает, что файл появился в папке (после перемещения)
+        """
+        folder, name = os.path.split(path)
+        with self._lock:
+            state = self._folders.get(folder)
+            if state is not None:
+                state.names.add(name)
+
+    def write_text(self, folder, file_name, content):
+        """
+        Записывает текстовый файл, только если его содержимое изменилось
+        """
+        with self._lock:
+            state = self._get(folder)
+            if (
+                state is not None
+                and file_name in state.names
+                and state.texts.get(file_name) == content
+            ):
+                return False
+        with open(os.path.join(folder, file_name), "w", encoding="utf-8") as file:
+            file.write(content + "\n")
+        with self._lock:
+            state = self._get(folder)
+            if state is not None:
+                state.names.add(file_name)
+                state.texts[file_name] = content
+        return True
+
+    def invalidate(self, folder=None):
+        """
+        Сбрасывает запись папки (или весь кеш), например после ошибки перемещения
+        """
+        with self._lock:
+            if folder is None:
+                self._folders.clear()
+            else:
+                self._folders.pop(folder, None)
+
+
+class DiskSpaceBudget:
+    """
+    Проверка свободного места без вызова disk_usage на каждый файл.
+
+    Свободное место запрашивается у системы один раз, затем из него вычитаются
+    размеры перемещённых файлов. Реальный запрос повторяется, когда оценка
+    приближается к минимуму или прошло больше recheck_interval секунд.
+    """
+
+    def __init__(self, required_bytes=100 * 1024 * 1024, recheck_interval=30.0):
+        self.required_bytes = required_bytes
+        self.recheck_interval = recheck_interval
+        self._lock = threading.Lock()
+        self._free = {}
+
+    def reserve(self, path, size):
+        """
+        Учитывает size байт, которые будут записаны в path.
+
+        Returns:
+            bool: True, если после записи останется не меньше required_bytes
+        """
+        with self._lock:
+            free, checked = self._free.get(path, (None, 0.0))
+            now = time.monotonic()
+            if (
+                free is None
+                or now - checked >= self.recheck_interval
+                or free - size < 2 * self.required_bytes
+            ):
+                try:
+                    free = shutil.disk_usage(path).free
+                except OSError as e:
+                    print(f"Ошибка при проверке места на диске: {e}")
+                    return False
+                checked = now
+            if free - size < self.required_bytes:
+                self._free[path] = (free, checked)
+                return False
+            self._free[path] = (free - size, checked)
+            return True
@@ -0,0 +1,143 @@
+import os
+import threading
+
+from PyQt5.QtCore import Qt, QAbstractListModel, QModelIndex, QSize, QUrl, pyqtSignal
+from PyQt5.QtGui import QDesktopServices, QPixmap, QColor
+from PyQt5.QtWidgets import QListView, QLabel, QVBoxLayout, QWidget
+
+from catalog import DATA_FOLDER_NAME
+from organizer import scan_image_files
+from thumbnail_cache import ThumbnailCache, THUMBNAIL_SIZE
+
+
+class GalleryModel(QAbstractListModel):
+    """
+    Список изображений для QListView. Миниатюры запрашиваются только
+    у видимых элементов (QListView вызывает data() лишь для них) и
+    подставляются, когда фоновый поток их создаст.
+    """
+
+    thumbnail_ready = pyqtSignal(str)
+
+    def __init__(self, cache, parent=None):
+        super().__init__(parent)
+        self.cache = cache
+        self.paths = []
+        self.rows = {}
+        self.pixmaps = {}
+        self.placeholder = QPixmap(THUMBNAIL_SIZE, THUMBNAIL_SIZE)
+        self.placeholder.fill(QColor("#3c3c3c"))
+        self.thumbnail_ready.connect(self.on_thumbnail_ready)
+
+    def set_paths(self, paths):
+        self.beginResetModel()
+        self.paths = list(paths)
+        self.rows = {path: row for row, path in enumerate(self.paths)}
+        self.pixmaps.clear()
+        self.endResetModel()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.paths)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        path = self.paths[index.row()]
+        if role == Qt.DecorationRole:
+            pixmap = self.pixmaps.get(path)
+            if pixmap is not None:
+                return pixmap
+            data = self.cache.cached(path)
+            if data is None:
+                self.cache.request(path, self._on_generated)
+                return self.placeholder
+            return self._pixmap(path, data)
+        if role == Qt.ToolTipRole:
+            return path
+        if role == Qt.DisplayRole:
+            return os.path.basename(path)
+        return None
+
+    def _pixmap(self, path, data):
+        pixmap = QPixmap()
+        pixmap.loadFromData(data, "JPEG")
+        # Готовые QPixmap храним только для видимой области и немного вокруг
+        if len(self.pixmaps) >= self.cache.memory_items:
+            self.pixmaps.pop(next(iter(self.pixmaps)))
+        self.pixmaps[path] = pixmap
+        return pixmap
+
+    def _on_generated(self, path, data):
+        # Вызывается из потока кеша - передаём в поток интерфейса через сигнал
+        if data is not None:
+            self.thumbnail_ready.emit(path)
+
+    def on_thumbnail_ready(self, path):
+        row = self.rows.get(path)
+        if row is not None:
+            index = self.index(row)
+            self.dataChanged.emit(index, index, [Qt.DecorationRole])
+
+
+class GalleryWindow(QWidget):
+    """
+    Галерея изображений папки проекта (или переданного списка файлов)
+    """
+
+    paths_ready = pyqtSignal(list)
+
+    def __init__(self, project_folder, paths=None, parent=None):
+        super().__init__(parent, Qt.Window)
+        self.project_folder = project_folder
+        self.setWindowTitle(f"Галерея: {project_folder}")
+        self.setGeometry(150, 150, 1000, 700)
+        self.setStyleSheet("background-color: #2c2c2c; color: #d3d3d3;")
+
+        self.cache = ThumbnailCache(project_folder)
+        self.model = GalleryModel(self.cache, self)
+
+        view = QListView(self)
+        view.setViewMode(QListView.IconMode)
+        view.setResizeMode(QListView.Adjust)
+        view.setMovement(QListView.Static)
+        view.setUniformItemSizes(True)
+        # Раскладка порциями: окно открывается сразу даже для 100 тысяч файлов
+        view.setLayoutMode(QListView.Batched)
+        view.setBatchSize(500)
+        view.setIconSize(QSize(THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+        view.setGridSize(QSize(THUMBNAIL_SIZE + 20, THUMBNAIL_SIZE + 30))
+        view.setStyleSheet("background-color: #1c1c1c; color: #b3b3b3;")
+        view.setModel(self.model)
+        view.doubleClicked.connect(self.open_image)
+        self.view = view
+
+        self.status = QLabel("Загрузка списка файлов...", self)
+
+        layout = QVBoxLayout()
+        layout.addWidget(view)
+        layout.addWidget(self.status)
+        self.setLayout(layout)
+
+        self.paths_ready.connect(self.show_paths)
+        if paths is not None:
+            self.show_paths(list(paths))
+        else:
+            threading.Thread(target=self.scan_project, daemon=True).start()
+
+    def scan_project(self):
+        data_folder = os.path.join(self.project_folder, DATA_FOLDER_NAME)
+        paths = [path for path in scan_image_files(self.project_folder) if not path.startswith(data_folder)]
+        paths.sort(reverse=True)
+        self.paths_ready.emit(paths)
+
+    def show_paths(self, paths):
+        self.model.set_paths(paths)
+        self.status.setText(f"Изображений: {len(paths)}")
+
+    def open_image(self, index):
+        path = self.model.paths[index.row()]
+        QDesktopServices.openUrl(QUrl.fromLocalFile(path))
+
+    def closeEvent(self, event):
+        self.cache.close()
+        event.accept()
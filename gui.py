@@ -1,15 +1,19 @@
 import sys
 import os
 import threading
+from collections import deque
 from PyQt5.QtWidgets import (
     QApplication, QWidget, QLabel, QPushButton,
-    QLineEdit, QTextEdit, QFileDialog, QVBoxLayout,
-    QHBoxLayout, QProgressBar, QMessageBox, QProgressDialog
+    QLineEdit, QPlainTextEdit, QFileDialog, QVBoxLayout,
+    QHBoxLayout, QProgressBar, QMessageBox, QProgressDialog, QListWidget, QListWidgetItem
 )
-from PyQt5.QtCore import Qt, pyqtSignal, QObject
-from watchdog.observers import Observer
+from PyQt5.QtCore import Qt, pyqtSignal, QObject, QTimer, QUrl
+from PyQt5.QtGui import QDesktopServices
+from polling_observer import start_observer
 from watchdog.events import FileSystemEventHandler
-from organizer import process_all_files, OutputFolderHandler
+from organizer import process_all_files, OutputFolderHandler, stats
+from search_index import SearchIndex
+from gallery import GalleryWindow
 import PyQt5
 from update_checker import UpdateChecker
 
@@ -19,9 +23,22 @@ from PyQt5 import QtCore
 
 VERSION = "1.0.0"
 
+# Журнал: сообщения копятся в кольцевом буфере и выводятся пачкой по таймеру,
+# в окне хранится не больше LOG_MAX_LINES последних строк
+LOG_BUFFER_SIZE = 5000
+LOG_FLUSH_INTERVAL_MS = 200
+LOG_MAX_LINES = 10000
+
+# Период обновления панели статистики
+STATS_REFRESH_INTERVAL_MS = 1000
+
+# Поиск запускается после паузы в наборе текста
+SEARCH_DELAY_MS = 300
+SEARCH_LIMIT = 200
+
 class Communicate(QObject):
-    log_signal = pyqtSignal(str)
     progress_signal = pyqtSignal(int)
+    update_signal = pyqtSignal(dict)
     finished_signal = pyqtSignal()
 
 class SDOrganizerGUI(QWidget):
@@ -30,11 +47,30 @@ class SDOrganizerGUI(QWidget):
         self.version = VERSION
         self.init_ui()
         self.observer = None
+        self.event_handler = None
         self.thread = None
         self.c = Communicate()
-        self.c.log_signal.connect(self.update_log)
+        self.log_buffer = deque(maxlen=LOG_BUFFER_SIZE)
+        self.log_lock = threading.Lock()
+        self.log_dropped = 0
+        self.log_timer = QTimer(self)
+        self.log_timer.timeout.connect(self.flush_log)
+        self.log_timer.start(LOG_FLUSH_INTERVAL_MS)
+        stats.enable()
+        self.stats_timer = QTimer(self)
+        self.stats_timer.timeout.connect(self.refresh_stats)
+        self.stats_timer.start(STATS_REFRESH_INTERVAL_MS)
         self.c.progress_signal.connect(self.update_progress)
+        self.c.update_signal.connect(self.on_update_checked)
         self.c.finished_signal.connect(self.on_finished)
+        self.search_index = None
+        self.search_index_folder = None
+        self.gallery = None
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.timeout.connect(self.run_search)
+        self.search_entry.textChanged.connect(lambda: self.search_timer.start(SEARCH_DELAY_MS))
+        self.search_entry.returnPressed.connect(self.run_search)
         self.update_checker = UpdateChecker(self.version)
         self.check_for_updates()
 
@@ -115,9 +151,23 @@ class SDOrganizerGUI(QWidget):
         stop_button.setEnabled(False)
         self.stop_button = stop_button
 
+        gallery_button = QPushButton("Галерея", self)
+        gallery_button.setStyleSheet("""
+            QPushButton {
+                background-color: #3c3c3c;
+                color: #d3d3d3;
+                padding: 10px;
+            }
+            QPushButton:hover {
+                background-color: #5c5c5c;
+            }
+        """)
+        gallery_button.clicked.connect(self.open_gallery)
+
         buttons_layout = QHBoxLayout()
         buttons_layout.addWidget(start_button)
         buttons_layout.addWidget(stop_button)
+        buttons_layout.addWidget(gallery_button)
 
         # Шкала прогресса
         progress_bar = QProgressBar(self)
@@ -137,16 +187,38 @@ class SDOrganizerGUI(QWidget):
 
         # Поле логов
         log_label = QLabel("Логи:", self)
-        log_text = QTextEdit(self)
+        log_text = QPlainTextEdit(self)
         log_text.setReadOnly(True)
+        log_text.setMaximumBlockCount(LOG_MAX_LINES)
         log_text.setStyleSheet("""
-            QTextEdit {
+            QPlainTextEdit {
                 background-color: #1c1c1c;
                 color: #b3b3b3;
             }
         """)
         self.log_text = log_text
 
+        # Поиск по промптам и параметрам упорядоченных изображений проекта
+        search_label = QLabel("Поиск:", self)
+        self.search_entry = QLineEdit(self)
+        self.search_entry.setPlaceholderText('cyberpunk model:dreamshaper_8 -blurry "red hair" steps:30')
+        self.search_entry.setStyleSheet("background-color: #4c4c4c; color: #d3d3d3;")
+        search_layout = QHBoxLayout()
+        search_layout.addWidget(search_label)
+        search_layout.addWidget(self.search_entry)
+        self.search_results = QListWidget(self)
+        self.search_results.setStyleSheet("background-color: #1c1c1c; color: #b3b3b3;")
+        self.search_results.setMaximumHeight(150)
+        self.search_results.hide()
+        self.search_results.itemDoubleClicked.connect(self.open_search_result)
+
+        # Панель статистики: задержки стадий и счётчики результатов
+        stats_label = QLabel("Статистика:", self)
+        stats_text = QLabel("Нет данных", self)
+        stats_text.setStyleSheet("font-family: monospace; color: #b3b3b3;")
+        stats_text.setTextInteractionFlags(Qt.TextSelectableByMouse)
+        self.stats_text = stats_text
+
         # Размещение элементов
         layout = QVBoxLayout()
         layout.addWidget(title)
@@ -154,8 +226,12 @@ class SDOrganizerGUI(QWidget):
         layout.addLayout(project_layout)   # Потом project
         layout.addLayout(buttons_layout)
         layout.addWidget(progress_bar)
+        layout.addLayout(search_layout)
+        layout.addWidget(self.search_results)
         layout.addWidget(log_label)
         layout.addWidget(log_text)
+        layout.addWidget(stats_label)
+        layout.addWidget(stats_text)
 
         self.setLayout(layout)
 
@@ -188,48 +264,137 @@ class SDOrganizerGUI(QWidget):
             self.stop_flag = False
             
             # Обработка существующих файлов
-            self.c.log_signal.emit("Начинаем обработку существующих файлов...")
-            generator = process_all_files(output_folder, project_folder, log_callback=self.c.log_signal.emit)
+            self.log("Начинаем обработку существующих файлов...")
+            generator = process_all_files(output_folder, project_folder, log_callback=self.log)
 
-            total = 0
+            # Общее количество файлов растёт по мере сканирования, поэтому
+            # не даём шкале откатываться назад и держим её ниже 100% до конца
+            last_progress = 0
             for processed, total_files, result in generator:
-                if total_files > total:
-                    total = total_files
-                progress = int((processed / total) * 100) if total > 0 else 0
-                self.c.progress_signal.emit(progress)
+                progress = int((processed / total_files) * 100) if total_files > 0 else 0
+                progress = min(max(progress, last_progress), 99)
+                if progress != last_progress:
+                    last_progress = progress
+                    self.c.progress_signal.emit(progress)
+            self.c.progress_signal.emit(100)
 
-            self.c.log_signal.emit("Обработка существующих файлов завершена.")
+            self.log("Обработка существующих файлов завершена.")
 
             # Настройка слежения за новой папкой
-            self.c.log_signal.emit("Настраиваем слежение за новой папкой и её содержимым...")
-            event_handler = OutputFolderHandler(project_folder, self.c.log_signal.emit)
-            observer = Observer()
-            observer.schedule(event_handler, output_folder, recursive=True)
+            self.log("Настраиваем слежение за новой папкой и её содержимым...")
+            event_handler = OutputFolderHandler(project_folder, self.log, output_folder=output_folder)
+            self.event_handler = event_handler
+            # На сетевых дисках системные события не приходят - тогда опрос папок
+            observer = start_observer(event_handler, output_folder, log_callback=self.log)
             self.observer = observer
-            observer.start()
-            self.c.log_signal.emit(f"Слежение за папкой '{output_folder}' началось.")
+            self.log(f"Слежение за папкой '{output_folder}' началось.")
 
             # Бесконечный цикл до получения сигнала остановки
             while not getattr(self, 'stop_flag', False):
                 observer.join(timeout=1)
 
         except Exception as e:
-            self.c.log_signal.emit(f"Ошибка: {e}")
+            self.log(f"Ошибка: {e}")
         finally:
             if self.observer:
                 self.observer.stop()
                 self.observer.join()
                 self.observer = None  # Очищаем ссылку на observer
-            self.c.log_signal.emit("Слежение завершено.")
+            if self.event_handler:
+                self.event_handler.close()
+                self.event_handler = None
+            self.log("Слежение завершено.")
             self.c.finished_signal.emit()
 
     def stop_processing(self):
         self.stop_flag = True
-        self.c.log_signal.emit("Остановка слежения...")
+        self.log("Остановка слежения...")
         self.stop_button.setEnabled(False)
 
-    def update_log(self, message):
-        self.log_text.append(message)
+    def flush_log(self):
+        # Выводим всё накопленное одной вставкой, а не по строке на сообщение
+        with self.log_lock:
+            if not self.log_buffer and not self.log_dropped:
+                return
+            messages = list(self.log_buffer)
+            self.log_buffer.clear()
+            dropped, self.log_dropped = self.log_dropped, 0
+        if dropped:
+            messages.insert(0, f"... пропущено сообщений: {dropped}")
+        self.log_text.appendPlainText("\n".join(messages))
+
+    def refresh_stats(self):
+        snapshot = stats.snapshot()
+        if not snapshot["stages"] and not snapshot["statuses"]:
+            return
+        lines = []
+        for stage, values in snapshot["stages"].items():
+            lines.append(
+                f"{stage:<11} {values['count']:>7}  ср. {values['avg'] * 1000:8.2f} мс  "
+                f"p95 {values['p95'] * 1000:8.2f} мс  макс. {values['max'] * 1000:8.2f} мс"
+            )
+        statuses = ", ".join(f"{status}: {count}" for status, count in snapshot["statuses"].items())
+        counters = snapshot["counters"]
+        lines.append(f"Результаты: {statuses or '-'}")
+        lines.append(
+            f"Перемещено: {counters.get('bytes_moved', 0) / (1024 * 1024):.1f} МБ, "
+            f"повторов чтения: {counters.get('metadata_retries', 0)}, "
+            f"повторов перемещения: {counters.get('move_retries', 0)}"
+        )
+        self.stats_text.setText("\n".join(lines))
+
+    def run_search(self):
+        self.search_timer.stop()
+        query = self.search_entry.text().strip()
+        project_folder = self.project_entry.text().strip()
+        if not query or not project_folder or not os.path.isdir(project_folder):
+            self.search_results.clear()
+            self.search_results.hide()
+            return
+        # Индекс открывается один раз на папку проекта
+        if self.search_index is None or self.search_index_folder != project_folder:
+            if self.search_index is not None:
+                self.search_index.close()
+            self.search_index = SearchIndex(project_folder)
+            self.search_index_folder = project_folder
+        results = self.search_index.search(query, SEARCH_LIMIT)
+
+        self.search_results.clear()
+        for result in results:
+            item = QListWidgetItem(result["path"])
+            item.setToolTip(
+                f"Positive Prompt: {result['prompt'] or '-'}\n"
+                f"Negative Prompt: {result['negative_prompt'] or '-'}\n"
+                f"Model: {result['model'] or '-'}"
+            )
+            self.search_results.addItem(item)
+        if not results:
+            self.search_results.addItem("Ничего не найдено")
+        self.search_results.show()
+
+    def open_gallery(self):
+        project_folder = self.project_entry.text().strip()
+        if not project_folder or not os.path.isdir(project_folder):
+            self.log("ОШИБКА: Выберите папку проекта!")
+            return
+        # Если есть результаты поиска, галерея показывает их, иначе весь проект
+        paths = None
+        if self.search_entry.text().strip() and self.search_results.isVisible():
+            paths = [
+                self.search_results.item(row).text()
+                for row in range(self.search_results.count())
+                if os.path.isfile(self.search_results.item(row).text())
+            ]
+        # Одновременно открыта одна галерея: кеш миниатюр пишет в один файл
+        if self.gallery is not None:
+            self.gallery.close()
+        self.gallery = GalleryWindow(project_folder, paths)
+        self.gallery.show()
+
+    def open_search_result(self, item):
+        path = item.text()
+        if os.path.isfile(path):
+            QDesktopServices.openUrl(QUrl.fromLocalFile(os.path.dirname(path)))
 
     def update_progress(self, value):
         self.progress_bar.setValue(value)
@@ -238,16 +403,30 @@ class SDOrganizerGUI(QWidget):
         self.stop_button.setEnabled(False)
 
     def log(self, message):
-        self.c.log_signal.emit(message)
+        # Может вызываться из любого потока
+        with self.log_lock:
+            if len(self.log_buffer) == self.log_buffer.maxlen:
+                self.log_dropped += 1
+            self.log_buffer.append(message)
 
     def closeEvent(self, event):
         if self.observer:
             self.observer.stop()
             self.observer.join()
+        if self.search_index is not None:
+            self.search_index.close()
+            self.search_index = None
         event.accept()
 
     def check_for_updates(self):
-        update_info = self.update_checker.check_for_updates()
+        # Проверка идёт в фоне, чтобы окно появлялось сразу даже без сети
+        thread = threading.Thread(target=self.run_update_check, daemon=True)
+        thread.start()
+
+    def run_update_check(self):
+        self.c.update_signal.emit(self.update_checker.check_for_updates())
+
+    def on_update_checked(self, update_info):
         if update_info['available']:
             reply = QMessageBox.question(
                 self, 
@@ -259,16 +438,18 @@ class SDOrganizerGUI(QWidget):
             )
             
             if reply == QMessageBox.Yes:
-                self.download_update(update_info['download_url'])
+                self.download_update(update_info['download_url'], update_info.get('sha256_url'),
+                                     update_info.get('version'), update_info.get('download_size'))
 
-    def download_update(self, url):
+    def download_update(self, url, sha256_url=None, version=None, size=None):
         progress = QProgressDialog("Загрузка обновления...", "Отмена", 0, 100, self)
         progress.setWindowModality(Qt.WindowModal)
         
         def update_progress(percent):
             progress.setValue(int(percent))
         
-        temp_path = self.update_checker.download_update(url, update_progress)
+        temp_path = self.update_checker.download_update(url, update_progress, sha256_url=sha256_url,
+                                                        version=version, size=size)
         if temp_path:
             # Запускаем новую версию и закрываем текущую
             os.startfile(temp_path)
@@ -0,0 +1,326 @@
+import json
+import os
+import shutil
+import threading
+import time
+from collections import namedtuple
+
+from catalog import get_data_folder
+
+
+JOURNAL_FILE_NAME = "journal.jsonl"
+
+# Статусы, при которых файл действительно переместился (или был удалён как дубликат);
+# folder_renamed - папка промпта перенесена целиком при смене раскладки
+MOVE_STATUSES = frozenset([
+    "moved_to_root", "moved_to_prompt_folder", "duplicate_skipped", "duplicate_linked", "folder_renamed",
+])
+
+# Запланированное перемещение из прерванного запуска
+JournalEntry = namedtuple("JournalEntry", ["run", "source", "destination", "status", "metadata"])
+
+
+def read_journal(path):
+    """
+    Читает записи журнала по порядку. Недописанная последняя строка
+    (аварийное завершение во время записи) пропускается.
+    """
+    try:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+    except FileNotFoundError:
+        return
+
+
+def _summarize(records):
+    # Разбирает журнал по запускам: {run: {"ended", "undone", "plans", "done"}}
+    runs = {}
+    for record in records:
+        run = runs.setdefault(record["run"], {"ended": False, "undone": False, "plans": {}, "done": []})
+        op = record["op"]
+        if op == "plan":
+            run["plans"][record["source"]] = record
+        elif op == "done":
+            run["plans"].pop(record["source"], None)
+            run["done"].append(record)
+        elif op == "end":
+            run["ended"] = True
+        elif op == "undone":
+            run["undone"] = True
+    return runs
+
+
+class MoveJournal:
+    """
+    Журнал запланированных и выполненных перемещений в папке проекта.
+
+    Файл только дописывается; записи сбрасываются на диск (fsync) пакетами
+    по sync_every записей или раз в sync_interval секунд. При аварийном
+    завершении теряются только записи последнего пакета.
+
+    По журналу прерванный запуск продолжается без повторного чтения
+    метаданных (recover), а выполненные перемещения можно отменить (undo).
+    После завершения запуска журнал сжимается: остаются только выполненные
+    перемещения последних keep_runs запусков.
+    """
+
+    def __init__(self, project_folder, sync_every=100, sync_interval=1.0, keep_runs=20):
+        self.path = os.path.join(get_data_folder(project_folder), JOURNAL_FILE_NAME)
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.keep_runs = keep_runs
+        self.run = None
+        self._lock = threading.Lock()
+        self._buffer = []
+        self._last_sync = time.monotonic()
+        self._file = None
+
+    def recover(self):
+        """
+        Разбирает незавершённые запуски.
+
+        Перемещения, которые успели выполниться, но не были отмечены,
+        дописываются как выполненные. Остальные возвращаются для продолжения.
+
+        Returns:
+            dict: {путь источника: JournalEntry}
+        """
+        resumable = {}
+        for run_id, run in _summarize(read_journal(self.path)).items():
+            if run["ended"] or run["undone"]:
+                continue
+            for source, record in run["plans"].items():
+                entry = JournalEntry(run_id, source, record["destination"], record["status"],
+                                     tuple(record["metadata"]) if record.get("metadata") else None)
+                if os.path.exists(source):
+                    resumable[source] = entry
+                elif os.path.exists(entry.destination):
+                    self._append({"op": "done", "run": run_id, "source": source,
+                                  "destination": entry.destination, "status": entry.status})
+        self.sync()
+        return resumable
+
+    def begin(self):
+        """
+        Начинает новый запуск и возвращает его идентификатор
+        """
+        self.run = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{id(self):x}"
+        self._append({"op": "run", "run": self.run, "time": time.time()})
+        return self.run
+
+    def planned(self, source, destination, status, metadata=None):
+        record = {"op": "plan", "run": self.run, "source": source,
+                  "destination": destination, "status": status}
+        if metadata is not None:
+            record["metadata"] = list(metadata[:3])
+        self._append(record)
+
+    def completed(self, source, result):
+        if result["status"] not in MOVE_STATUSES:
+            return
+        record = {"op": "done", "run": self.run, "source": source,
+                  "destination": result.get("destination"), "status": result["status"]}
+        if result.get("duplicate_of"):
+            record["duplicate_of"] = result["duplicate_of"]
+        if result.get("link"):
+            record["link"] = result["link"]
+        self._append(record)
+
+    def removed(self, path, content):
+        """
+        Отмечает удалённый prompt.txt опустевшей папки, чтобы отмена его восстановила
+        """
+        self._append({"op": "done", "run": self.run, "source": path, "destination": None,
+                      "status": "text_removed", "content": content})
+
+    def mark_undone(self, run):
+        self._append({"op": "undone", "run": run})
+        self.sync()
+
+    def end(self, compact=True):
+        """
+        Отмечает запуск завершённым и сжимает журнал
+        """
+        if self.run is None:
+            return
+        self._append({"op": "end", "run": self.run})
+        self.sync()
+        self.run = None
+        if compact:
+            self.compact()
+
+    def _append(self, record):
+        line = json.dumps(record, ensure_ascii=False)
+        with self._lock:
+            self._buffer.append(line)
+            due = (
+                len(self._buffer) >= self.sync_every
+                or time.monotonic() - self._last_sync >= self.sync_interval
+            )
+        if due:
+            self.sync()
+
+    def sync(self):
+        """
+        Дописывает накопленные записи и сбрасывает файл на диск
+        """
+        with self._lock:
+            self._last_sync = time.monotonic()
+            if not self._buffer:
+                return
+            lines, self._buffer = self._buffer, []
+            if self._file is None:
+                self._file = open(self.path, "a", encoding="utf-8")
+            self._file.write("\n".join(lines) + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def compact(self):
+        """
+        Переписывает журнал: удаляет планы, отменённые запуски и запуски
+        старше keep_runs последних; выполненные перемещения сохраняются
+        """
+        with self._lock:
+            if self._buffer:
+                return
+            runs = _summarize(read_journal(self.path))
+            kept = [run_id for run_id, run in runs.items() if not run["undone"] and run["done"]]
+            lines = []
+            for run_id in kept[-self.keep_runs:]:
+                lines.append(json.dumps({"op": "run", "run": run_id}, ensure_ascii=False))
+                lines.extend(json.dumps(record, ensure_ascii=False) for record in runs[run_id]["done"])
+                lines.append(json.dumps({"op": "end", "run": run_id}, ensure_ascii=False))
+            temp_path = f"{self.path}.tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                f.write("".join(line + "\n" for line in lines))
+                f.flush()
+                os.fsync(f.fileno())
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            os.replace(temp_path, self.path)
+
+    def close(self):
+        self.end()
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def list_runs(project_folder):
+    """
+    Возвращает запуски из журнала: [(идентификатор, число перемещений, завершён, отменён)]
+    """
+    path = os.path.join(get_data_folder(project_folder), JOURNAL_FILE_NAME)
+    return [
+        (run_id, len(run["done"]), run["ended"], run["undone"])
+        for run_id, run in _summarize(read_journal(path)).items()
+    ]
+
+
+def _remove_empty_prompt_folder(folder, project_folder):
+    # Папка промпта, в которой после отмены остался только prompt.txt, и пустая папка даты
+    try:
+        names = os.listdir(folder)
+        if names == ["prompt.txt"]:
+            os.remove(os.path.join(folder, "prompt.txt"))
+            names = []
+        if not names and os.path.abspath(folder) != os.path.abspath(project_folder):
+            os.rmdir(folder)
+            parent = os.path.dirname(folder)
+            if os.path.abspath(parent) != os.path.abspath(project_folder) and not os.listdir(parent):
+                os.rmdir(parent)
+    except OSError:
+        pass
+
+
+def _restored_paths(destination, source, status):
+    # Пары (путь до отмены, путь после) для файлов, вернувшихся по записи журнала;
+    # папка, переименованная при смене раскладки, возвращается со всеми файлами
+    if status != "folder_renamed":
+        return [(destination, source)]
+    pairs = []
+    for folder, _, names in os.walk(source):
+        for name in names:
+            path = os.path.join(folder, name)
+            pairs.append((os.path.join(destination, os.path.relpath(path, source)), path))
+    return pairs
+
+
+def undo(project_folder, run=None, move=None, log_callback=None):
+    """
+    Отменяет перемещения запуска run (по умолчанию - последнего неотменённого),
+    проходя журнал в обратном порядке.
+
+    Файлы возвращаются на прежнее место; пропущенные дубликаты восстанавливаются
+    копией существующего файла, удалённые prompt.txt - записанным содержимым.
+    Ссылки зеркального режима удаляются (источник и так на месте); если источник
+    с тех пор удалён, на его место возвращается ссылка, кроме символической.
+    Папки промптов, оставшиеся пустыми, удаляются.
+
+    Каталог и индексы проекта здесь не обновляются - это делает
+    organizer.undo_run по возвращённым парам moves.
+
+    Args:
+        move: функция перемещения (source, destination), по умолчанию shutil.move
+
+    Returns:
+        dict: {"run", "restored", "failed", "moves"} - moves: пары
+        (путь файла в проекте до отмены, путь, куда он вернулся)
+    """
+    journal = MoveJournal(project_folder)
+    runs = _summarize(read_journal(journal.path))
+    if run is None:
+        candidates = [run_id for run_id, info in runs.items() if info["done"] and not info["undone"]]
+        if not candidates:
+            return {"run": None, "restored": 0, "failed": 0, "moves": []}
+        run = candidates[-1]
+    info = runs.get(run)
+    if info is None or info["undone"]:
+        return {"run": run, "restored": 0, "failed": 0, "moves": []}
+
+    move = move or shutil.move
+    restored = failed = 0
+    folders = set()
+    moves = []
+    for record in reversed(info["done"]):
+        source, destination = record["source"], record["destination"]
+        try:
+            if record.get("link") and os.path.exists(source):
+                os.remove(destination)
+                folders.add(os.path.dirname(destination))
+                moves.append((destination, source))
+                restored += 1
+                continue
+            if record.get("link") == "symlink":
+                raise FileNotFoundError(source)
+            os.makedirs(os.path.dirname(source), exist_ok=True)
+            if os.path.exists(source):
+                raise FileExistsError(source)
+            if record["status"] == "text_removed":
+                with open(source, "w", encoding="utf-8") as f:
+                    f.write(record["content"])
+            elif record["status"] == "duplicate_skipped":
+                shutil.copy2(record["duplicate_of"], source)
+            else:
+                move(destination, source)
+                folders.add(os.path.dirname(destination))
+                moves.extend(_restored_paths(destination, source, record["status"]))
+            restored += 1
+        except OSError as e:
+            failed += 1
+            if log_callback:
+                log_callback(f"Не удалось вернуть {destination} в {source}: {e}")
+
+    for folder in sorted(folders, reverse=True):
+        _remove_empty_prompt_folder(folder, project_folder)
+
+    journal.mark_undone(run)
+    journal.compact()
+    journal.close()
+    return {"run": run, "restored": restored, "failed": failed, "moves": moves}
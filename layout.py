@@ -0,0 +1,116 @@
+import json
+import os
+import re
+import string
+
+from catalog import get_data_folder
+
+
+LAYOUT_FILE_NAME = "layout.json"
+
+# Прежняя раскладка: <дата>/<ключевые слова промпта>_<хеш>
+DEFAULT_LAYOUT = "{date}/{prompt}"
+
+# Поля шаблона и вид их значений в пути (по нему же разбирается существующее дерево)
+LAYOUT_FIELDS = {
+    "date": r"\d{4}-\d{2}-\d{2}",
+    "year": r"\d{4}",
+    "month": r"\d{4}-\d{2}",
+    "day": r"\d{2}",
+    "model": r"[^/]+",
+    "prompt": r"[^/]+",
+}
+DATE_FIELDS = frozenset(["date", "year", "month", "day"])
+
+
+def date_fields(date):
+    """
+    Поля даты по строке вида 2024-01-31
+    """
+    return {"date": date, "year": date[:4], "month": date[:7], "day": date[8:10]}
+
+
+class Layout:
+    """
+    Шаблон раскладки папки проекта, например "{model}/{month}/{prompt}".
+
+    Шаблон разбирается один раз: проверяются поля, для каждой папки пути
+    готовится строка формата, а для разбора уже разложенного дерева -
+    регулярное выражение, которое извлекает поля из относительного пути.
+    """
+
+    def __init__(self, template):
+        self.template = template
+        self.components = template.replace("\\", "/").split("/")
+        if not template or any(component in ("", ".", "..") for component in self.components):
+            raise ValueError(f"Некорректный шаблон раскладки: {template!r}")
+        fields = []
+        pattern = []
+        for component in self.components:
+            regex = ""
+            for literal, field, spec, conversion in string.Formatter().parse(component):
+                regex += re.escape(literal)
+                if field is None:
+                    continue
+                if field not in LAYOUT_FIELDS or spec or conversion:
+                    raise ValueError(
+                        f"Неизвестное поле шаблона раскладки: {{{field}}} "
+                        f"(доступны: {', '.join(LAYOUT_FIELDS)})"
+                    )
+                # Повторное поле должно совпасть с первым вхождением
+                regex += f"(?P={field})" if field in fields else f"(?P<{field}>{LAYOUT_FIELDS[field]})"
+                fields.append(field)
+            pattern.append(regex)
+        if "prompt" not in fields:
+            raise ValueError("Шаблон раскладки должен содержать поле {prompt}")
+        self.fields = frozenset(fields)
+        self._pattern = re.compile("/".join(pattern))
+
+    def __eq__(self, other):
+        return isinstance(other, Layout) and other.template == self.template
+
+    def __hash__(self):
+        return hash(self.template)
+
+    def format(self, fields):
+        """
+        Имена папок пути (ещё не очищенные от недопустимых символов)
+        """
+        return [component.format_map(fields) for component in self.components]
+
+    def parse(self, relative_path):
+        """
+        Поля, извлечённые из относительного пути папки, или None,
+        если путь не соответствует шаблону
+        """
+        match = self._pattern.fullmatch(relative_path.replace(os.sep, "/"))
+        if match is None:
+            return None
+        fields = match.groupdict()
+        if "date" not in fields and "month" in fields and "day" in fields:
+            fields["date"] = f"{fields['month']}-{fields['day']}"
+        if "date" in fields:
+            fields.update(date_fields(fields["date"]))
+        elif "month" in fields:
+            fields.setdefault("year", fields["month"][:4])
+        return fields
+
+
+def load_layout(project_folder):
+    """
+    Раскладка проекта из layout.json (по умолчанию DEFAULT_LAYOUT)
+    """
+    path = os.path.join(get_data_folder(project_folder), LAYOUT_FILE_NAME)
+    try:
+        with open(path, encoding="utf-8") as f:
+            return Layout(json.load(f)["template"])
+    except (OSError, ValueError, KeyError, TypeError):
+        return Layout(DEFAULT_LAYOUT)
+
+
+def save_layout(project_folder, layout):
+    path = os.path.join(get_data_folder(project_folder), LAYOUT_FILE_NAME)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump({"template": layout.template}, f, ensure_ascii=False)
+    os.replace(temp_path, path)
@@ -0,0 +1,382 @@
+import hashlib
+import json
+import math
+import os
+import sys
+import threading
+import time
+from array import array
+
+from catalog import get_data_folder
+from search_index import row_from_metadata
+
+
+MANIFEST_FOLDER_NAME = "manifest"
+
+# Числовые столбцы: имя -> (код array, тип NumPy, значение для отсутствующего)
+NUMBER_COLUMNS = {
+    "seed": ("q", "<i8", -1),
+    "steps": ("i", "<i4", -1),
+    "cfg_scale": ("f", "<f4", math.nan),
+    "width": ("i", "<i4", -1),
+    "height": ("i", "<i4", -1),
+    "size": ("q", "<i8", -1),
+    "mtime": ("d", "<f8", math.nan),
+}
+# Строковые столбцы хранятся номерами строк в таблице <имя>.strings (-1 - нет значения)
+STRING_COLUMNS = ("model", "sampler", "prompt", "negative_prompt")
+# Служебные столбцы: хеш пути изображения (0 - путь неизвестен) и отметка удаления.
+# Из нескольких строк одного пути действует последняя
+KEY_COLUMNS = {
+    "path": ("q", "<i8", 0),
+    "removed": ("b", "<i1", 0),
+}
+_TYPED_COLUMNS = {**NUMBER_COLUMNS, **KEY_COLUMNS}
+_ALL_COLUMNS = (*NUMBER_COLUMNS, *STRING_COLUMNS, *KEY_COLUMNS)
+
+# Положение полей в строке поискового индекса (search_index._COLUMNS)
+_ROW_FIELDS = {
+    "size": 1, "mtime": 2, "prompt": 3, "negative_prompt": 4, "model": 5, "sampler": 7,
+    "steps": 8, "cfg_scale": 9, "seed": 10, "width": 11, "height": 12,
+}
+_BIG_ENDIAN = sys.byteorder == "big"
+
+
+_INTEGER_LIMITS = {"i": 2 ** 31, "q": 2 ** 63}
+
+
+def _number(value, code, missing):
+    # Значение, которое не помещается в тип столбца, считается отсутствующим:
+    # одна странная строка параметров не должна сорвать запись пакета
+    if value is None:
+        return missing
+    try:
+        value = float(value) if code in "fd" else int(value)
+    except (TypeError, ValueError, OverflowError):
+        return missing
+    limit = _INTEGER_LIMITS.get(code)
+    if limit is not None and not -limit <= value < limit:
+        return missing
+    return value
+
+
+def _column_path(folder, name):
+    return os.path.join(folder, f"{name}.bin")
+
+
+def _strings_path(folder, name):
+    return os.path.join(folder, f"{name}.strings")
+
+
+def _column_code(name):
+    return _TYPED_COLUMNS[name][0] if name in _TYPED_COLUMNS else "i"
+
+
+def _column_item_size(name):
+    return array(_column_code(name)).itemsize
+
+
+def _missing(name):
+    return _TYPED_COLUMNS[name][2] if name in _TYPED_COLUMNS else -1
+
+
+def _path_key(path):
+    # 64-битный хеш пути вместо таблицы строк: путей столько же, сколько строк
+    digest = hashlib.blake2b(os.path.normcase(path).encode("utf-8", "surrogatepass"), digest_size=8).digest()
+    return int.from_bytes(digest, "little", signed=True) or 1
+
+
+def _row_count(folder):
+    # Столбцы дописываются по очереди: после сбоя посреди записи пакета
+    # полными считаются только строки, которые есть во всех столбцах.
+    # Столбца, которого ещё нет (журнал прежней версии), это не касается
+    counts = []
+    for name in _ALL_COLUMNS:
+        try:
+            counts.append(os.path.getsize(_column_path(folder, name)) // _column_item_size(name))
+        except OSError:
+            continue
+    return min(counts) if counts else 0
+
+
+def _live_rows(paths, removed):
+    """
+    Маска действующих строк: последняя строка каждого пути, если она не отметка
+    удаления, и все строки без пути. None, если действуют все строки
+    """
+    import numpy as np
+
+    known = np.flatnonzero(paths != 0)
+    keys = paths[known]
+    if not removed.any():
+        # Быстрая проверка простой сортировкой: повторов обычно нет
+        ordered = np.sort(keys)
+        if not (ordered[1:] == ordered[:-1]).any():
+            return None
+    # np.unique по перевёрнутому массиву даёт последнее вхождение каждого пути
+    _, last = np.unique(keys[::-1], return_index=True)
+    live = paths == 0
+    live[known[len(keys) - 1 - last]] = True
+    live &= removed == 0
+    return live
+
+
+def _read_strings(path):
+    """
+    Строки таблицы и длина их записи в байтах; незаконченная последняя
+    строка (сбой при записи) отбрасывается
+    """
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except OSError:
+        return [], 0
+    end = data.rfind(b"\n") + 1
+    return [json.loads(line) for line in data[:end].splitlines()], end
+
+
+class _StringTables(dict):
+    # Таблица строк читается при первом обращении: для числовых запросов
+    # не нужно разбирать миллион промптов
+    def __init__(self, folder):
+        super().__init__()
+        self.folder = folder
+
+    def __missing__(self, name):
+        if name not in STRING_COLUMNS:
+            raise KeyError(name)
+        strings = self[name] = _read_strings(_strings_path(self.folder, name))[0]
+        return strings
+
+
+class Manifest:
+    """
+    Столбцовый журнал параметров генерации упорядоченных изображений
+    в папке проекта (.sd_organizer/manifest) для аналитики.
+
+    Каждое числовое поле (seed, steps, cfg_scale, размеры, размер файла,
+    время изменения) лежит в своём файле массивом фиксированной ширины,
+    строки (модель, сэмплер, промпты) - номерами в таблицах уникальных
+    строк. Файлы только дописываются пакетами, как записи Catalog, так что
+    запись строки не требует чтения прежних. Строка хранит хеш пути
+    изображения: повторно обработанный файл заменяет свою прежнюю строку,
+    а remove дописывает отметку удаления. load_manifest отображает
+    столбцы в память массивами NumPy.
+    """
+
+    def __init__(self, project_folder, batch_size=500, flush_interval=2.0):
+        self.folder = os.path.join(get_data_folder(project_folder), MANIFEST_FOLDER_NAME)
+        os.makedirs(self.folder, exist_ok=True)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._pending = []
+        self._last_flush = time.monotonic()
+        # Номера строк читаются при первой записи, а не при открытии
+        self._ids = None
+        self._repair()
+
+    @staticmethod
+    def exists(project_folder):
+        """
+        Есть ли в проекте манифест (без создания папки)
+        """
+        return os.path.exists(os.path.join(get_data_folder(project_folder), MANIFEST_FOLDER_NAME))
+
+    def _repair(self):
+        rows = _row_count(self.folder)
+        for name in _ALL_COLUMNS:
+            path = _column_path(self.folder, name)
+            size = rows * _column_item_size(name)
+            try:
+                if os.path.getsize(path) > size:
+                    os.truncate(path, size)
+            except FileNotFoundError:
+                # Столбец, которого не было в прежней версии: строки без значения
+                open(path, "wb").close()
+                self._write_column(name, array(_column_code(name), [_missing(name)]) * rows)
+
+    def _load_ids(self):
+        self._ids = {}
+        for name in STRING_COLUMNS:
+            path = _strings_path(self.folder, name)
+            strings, size = _read_strings(path)
+            # Обрезаем незаконченную строку, чтобы новые дописывались с начала строки
+            if os.path.exists(path) and os.path.getsize(path) != size:
+                os.truncate(path, size)
+            self._ids[name] = {value: number for number, value in enumerate(strings)}
+
+    def add(self, path, metadata, size=None, mtime_ns=None):
+        """
+        Добавляет изображение в очередь на запись
+        """
+        self.append(row_from_metadata(path, metadata, size, mtime_ns))
+
+    def remove(self, paths):
+        """
+        Отмечает изображения удалёнными: файлы только дописываются, поэтому
+        удаление - ещё одна строка с тем же путём
+        """
+        for path in paths:
+            self.append((os.path.abspath(path),))
+
+    def append(self, row):
+        """
+        Добавляет строку в формате поискового индекса (search_index.row_from_metadata);
+        строка из одного пути - отметка удаления
+        """
+        with self._lock:
+            self._pending.append(row)
+            due = (
+                len(self._pending) >= self.batch_size
+                or time.monotonic() - self._last_flush >= self.flush_interval
+            )
+        if due:
+            self.flush()
+
+    def flush(self):
+        """
+        Дописывает накопленные строки: сначала новые строки таблиц, затем столбцы
+        """
+        with self._lock:
+            self._last_flush = time.monotonic()
+            if not self._pending:
+                return
+            rows, self._pending = self._pending, []
+            if self._ids is None:
+                self._load_ids()
+
+            for name in STRING_COLUMNS:
+                ids = self._ids[name]
+                position = _ROW_FIELDS[name]
+                column = array("i")
+                added = []
+                for row in rows:
+                    value = row[position] if len(row) > position else None
+                    if value is None:
+                        column.append(-1)
+                        continue
+                    number = ids.get(value)
+                    if number is None:
+                        number = ids[value] = len(ids)
+                        added.append(json.dumps(value, ensure_ascii=False) + "\n")
+                    column.append(number)
+                if added:
+                    with open(_strings_path(self.folder, name), "a", encoding="utf-8", newline="\n") as f:
+                        f.write("".join(added))
+                self._write_column(name, column)
+
+            for name, (code, _, missing) in NUMBER_COLUMNS.items():
+                position = _ROW_FIELDS[name]
+                values = [row[position] if len(row) > position else None for row in rows]
+                if name == "mtime":
+                    values = [value / 1e9 if value is not None else None for value in values]
+                column = array(code, (_number(value, code, missing) for value in values))
+                self._write_column(name, column)
+
+            self._write_column("path", array("q", (_path_key(row[0]) if row[0] else 0 for row in rows)))
+            self._write_column("removed", array("b", (1 if len(row) == 1 else 0 for row in rows)))
+
+    def _write_column(self, name, column):
+        if _BIG_ENDIAN:
+            column.byteswap()
+        with open(_column_path(self.folder, name), "ab") as f:
+            column.tofile(f)
+
+    def reset(self):
+        """
+        Удаляет все строки (перед полной пересборкой)
+        """
+        with self._lock:
+            self._pending = []
+            self._ids = {name: {} for name in STRING_COLUMNS}
+            for name in _ALL_COLUMNS:
+                open(_column_path(self.folder, name), "wb").close()
+            for name in STRING_COLUMNS:
+                open(_strings_path(self.folder, name), "wb").close()
+
+    def close(self):
+        self.flush()
+
+
+def load_manifest(project_folder):
+    """
+    Столбцы журнала проекта как массивы NumPy, отображённые в память
+    (файлы не читаются целиком). Если у какого-то изображения несколько
+    строк или оно отмечено удалённым, столбцы - копии только с действующими
+    строками.
+
+    Returns:
+        dict: {"rows": количество строк,
+               "columns": {имя: массив} - числовые значения (-1 или NaN для
+               отсутствующих) и номера строк для model, sampler, prompt,
+               negative_prompt,
+               "strings": {имя: список строк по номерам} - читаются при обращении}
+    """
+    import numpy as np
+
+    folder = os.path.join(get_data_folder(project_folder), MANIFEST_FOLDER_NAME)
+    rows = _row_count(folder)
+    columns = {}
+    for name in _ALL_COLUMNS:
+        dtype = np.dtype(_TYPED_COLUMNS[name][1] if name in _TYPED_COLUMNS else "<i4")
+        path = _column_path(folder, name)
+        if rows and os.path.exists(path):
+            columns[name] = np.memmap(path, dtype=dtype, mode="r", shape=(rows,))
+        else:
+            # Пустой файл отобразить в память нельзя; столбца может не быть в журнале прежней версии
+            columns[name] = np.full(rows, _missing(name), dtype=dtype)
+    live = _live_rows(columns.pop("path"), columns.pop("removed"))
+    if live is not None:
+        columns = {name: column[live] for name, column in columns.items()}
+        rows = int(live.sum())
+    return {"rows": rows, "columns": columns, "strings": _StringTables(folder)}
+
+
+def _value(manifest, name, value):
+    if name in STRING_COLUMNS:
+        strings = manifest["strings"][name]
+        return strings[value] if 0 <= value < len(strings) else None
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    if name in NUMBER_COLUMNS and NUMBER_COLUMNS[name][1][1] == "i":
+        return None if value == -1 else int(value)
+    return round(float(value), 4)
+
+
+def top_combinations(manifest, fields=("model", "sampler", "steps", "cfg_scale"), limit=20):
+    """
+    Самые частые сочетания значений полей, например модель + сэмплер + CFG.
+
+    Returns:
+        list: словари {поле: значение, ..., "count": количество изображений}
+              по убыванию количества
+    """
+    import numpy as np
+
+    if not manifest["rows"]:
+        return []
+    uniques = []
+    key = np.zeros(manifest["rows"], dtype=np.int64)
+    radix = 1
+    for name in fields:
+        values, inverse = np.unique(manifest["columns"][name], return_inverse=True)
+        uniques.append(values)
+        radix *= len(values)
+        if radix >= 2 ** 62:
+            raise ValueError("Слишком много сочетаний значений для группировки")
+        key = key * len(values) + inverse.reshape(-1)
+    keys, counts = np.unique(key, return_counts=True)
+    order = np.argsort(-counts, kind="stable")[:limit]
+
+    result = []
+    for index in order:
+        combined = int(keys[index])
+        item = {}
+        for name, values in zip(reversed(fields), reversed(uniques)):
+            combined, position = divmod(combined, len(values))
+            item[name] = _value(manifest, name, values[position].item())
+        item = {name: item[name] for name in fields}
+        item["count"] = int(counts[index])
+        result.append(item)
+    return result
@@ -0,0 +1,215 @@
+import html
+import re
+import struct
+import zlib
+
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+PARAMETERS_KEY = b"parameters"
+
+# Не читаем в память текстовые блоки больше этого размера
+MAX_TEXT_CHUNK = 16 * 1024 * 1024
+
+EXIF_IFD_POINTER = 0x8769
+USER_COMMENT_TAG = 0x9286
+
+_XMP_PATTERNS = [
+    re.compile(r"<exif:UserComment>.*?<rdf:li[^>]*>(.*?)</rdf:li>", re.DOTALL),
+    re.compile(r"<sd:parameters>(.*?)</sd:parameters>", re.DOTALL),
+    re.compile(r'\bsd:parameters="(.*?)"', re.DOTALL),
+]
+
+
+def read_parameters(image_path):
+    """
+    Читает текст генерации ("parameters") из заголовков изображения без декодирования.
+
+    PNG, JPEG и WebP разбираются напрямую по блокам контейнера, чтение
+    прекращается, как только найден нужный блок. Для остальных форматов
+    используется PIL.
+
+    Returns:
+        str | None: текст параметров или None, если его нет
+    """
+    with open(image_path, "rb") as f:
+        header = f.read(12)
+        f.seek(0)
+        if header.startswith(PNG_SIGNATURE):
+            return _read_png(f)
+        if header.startswith(b"\xff\xd8"):
+            return _read_jpeg(f)
+        if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+            return _read_webp(f)
+    return _read_with_pil(image_path)
+
+
+def _read_with_pil(image_path):
+    # PIL загружаем только для форматов, которые не умеем разбирать сами
+    from PIL import Image
+
+    with Image.open(image_path) as img:
+        return img.info.get("parameters") or None
+
+
+def _read_png(f):
+    f.seek(len(PNG_SIGNATURE))
+    while True:
+        header = f.read(8)
+        if len(header) < 8:
+            return None
+        length, chunk_type = struct.unpack(">I4s", header)
+        # Текстовые блоки после IDAT PIL при открытии тоже не читает
+        if chunk_type in (b"IDAT", b"IEND"):
+            return None
+        if chunk_type in (b"tEXt", b"zTXt", b"iTXt") and length <= MAX_TEXT_CHUNK:
+            data = f.read(length)
+            f.seek(4, 1)  # CRC
+            text = _decode_png_text(chunk_type, data)
+            if text is not None:
+                return text
+        else:
+            f.seek(length + 4, 1)
+
+
+def _decode_png_text(chunk_type, data):
+    keyword, sep, rest = data.partition(b"\0")
+    if not sep or keyword != PARAMETERS_KEY:
+        return None
+    if chunk_type == b"tEXt":
+        return rest.decode("latin-1")
+    if chunk_type == b"zTXt":
+        return zlib.decompress(rest[1:]).decode("latin-1")
+    # iTXt: флаг сжатия, метод сжатия, язык\0, переведённое ключевое слово\0, текст
+    compressed = rest[0]
+    rest = rest[2:]
+    _, _, rest = rest.partition(b"\0")
+    _, _, text = rest.partition(b"\0")
+    if compressed:
+        text = zlib.decompress(text)
+    return text.decode("utf-8")
+
+
+def _read_jpeg(f):
+    f.seek(2)
+    while True:
+        byte = f.read(1)
+        if not byte:
+            return None
+        if byte != b"\xff":
+            continue
+        marker = f.read(1)
+        while marker == b"\xff":
+            marker = f.read(1)
+        if not marker:
+            return None
+        code = marker[0]
+        # SOS - дальше идут данные изображения, EOI - конец файла
+        if code in (0xDA, 0xD9):
+            return None
+        if code == 0x01 or 0xD0 <= code <= 0xD7:
+            continue
+        length_bytes = f.read(2)
+        if len(length_bytes) < 2:
+            return None
+        length = struct.unpack(">H", length_bytes)[0] - 2
+        if code == 0xE1:
+            data = f.read(length)
+            if data.startswith(b"Exif\0\0"):
+                text = _user_comment_from_tiff(data[6:])
+                if text:
+                    return text
+        else:
+            f.seek(length, 1)
+
+
+def _read_webp(f):
+    f.seek(12)
+    while True:
+        header = f.read(8)
+        if len(header) < 8:
+            return None
+        fourcc, size = struct.unpack("<4sI", header)
+        padded = size + (size & 1)
+        if fourcc in (b"EXIF", b"XMP ") and size <= MAX_TEXT_CHUNK:
+            data = f.read(padded)[:size]
+            if fourcc == b"EXIF":
+                if data.startswith(b"Exif\0\0"):
+                    data = data[6:]
+                text = _user_comment_from_tiff(data)
+            else:
+                text = _parameters_from_xmp(data)
+            if text:
+                return text
+        else:
+            f.seek(padded, 1)
+
+
+def _user_comment_from_tiff(data):
+    """
+    Достаёт UserComment из блока EXIF (TIFF-структура)
+    """
+    if len(data) < 8:
+        return None
+    if data[:2] == b"II":
+        order = "<"
+    elif data[:2] == b"MM":
+        order = ">"
+    else:
+        return None
+
+    ifd0 = struct.unpack(order + "I", data[4:8])[0]
+    entries = _read_ifd(data, ifd0, order)
+    # Некоторые программы пишут UserComment прямо в IFD0
+    value = entries.get(USER_COMMENT_TAG)
+    if value is None and EXIF_IFD_POINTER in entries:
+        exif_offset = struct.unpack(order + "I", entries[EXIF_IFD_POINTER][:4])[0]
+        value = _read_ifd(data, exif_offset, order).get(USER_COMMENT_TAG)
+    if value is None:
+        return None
+    return _decode_user_comment(value)
+
+
+def _read_ifd(data, offset, order):
+    # Возвращает {тег: сырые байты значения} для одного каталога IFD
+    result = {}
+    if offset + 2 > len(data):
+        return result
+    count = struct.unpack(order + "H", data[offset:offset + 2])[0]
+    position = offset + 2
+    for _ in range(count):
+        entry = data[position:position + 12]
+        if len(entry) < 12:
+            break
+        tag, value_type, value_count = struct.unpack(order + "HHI", entry[:8])
+        position += 12
+        if tag not in (USER_COMMENT_TAG, EXIF_IFD_POINTER):
+            continue
+        # Для UNDEFINED/BYTE/ASCII размер элемента 1 байт, для LONG - 4 байта
+        size = value_count * (4 if value_type == 4 else 1)
+        if size <= 4:
+            result[tag] = entry[8:8 + size] if tag == USER_COMMENT_TAG else entry[8:12]
+        else:
+            value_offset = struct.unpack(order + "I", entry[8:12])[0]
+            result[tag] = data[value_offset:value_offset + size]
+    return result
+
+
+def _decode_user_comment(value):
+    prefix, body = value[:8], value[8:]
+    if prefix == b"UNICODE\0":
+        if body[:2] in (b"\xff\xfe", b"\xfe\xff"):
+            return body.decode("utf-16").rstrip("\0")
+        # A1111 (piexif) записывает текст в UTF-16 BE независимо от порядка байт TIFF
+        return body.decode("utf-16-be", errors="ignore").rstrip("\0")
+    if prefix in (b"ASCII\0\0\0", b"\0" * 8):
+        return body.decode("utf-8", errors="ignore").rstrip("\0")
+    return value.decode("utf-8", errors="ignore").rstrip("\0")
+
+
+def _parameters_from_xmp(data):
+    text = data.decode("utf-8", errors="ignore")
+    for pattern in _XMP_PATTERNS:
+        match = pattern.search(text)
+        if match:
+            return html.unescape(match.group(1))
+    return None
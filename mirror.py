@@ -0,0 +1,258 @@
+import errno
+import os
+import shutil
+import sqlite3
+import sys
+import threading
+import time
+
+from catalog import get_data_folder
+
+
+MIRROR_FILE_NAME = "mirror.sqlite"
+
+# Что делать, если ни ссылку, ни reflink создать нельзя (другое устройство):
+#   symlink - символическая ссылка (если и она недоступна - копия)
+#   copy    - копия файла
+#   move    - переместить файл, как без зеркального режима
+MIRROR_FALLBACKS = ("symlink", "copy", "move")
+
+# ioctl FICLONE (linux/fs.h): общий набор блоков на btrfs, XFS, bcachefs
+_FICLONE = 0x40049409
+
+# Ошибки, означающие, что способ не поддерживается для этой пары устройств
+_UNSUPPORTED_ERRNOS = frozenset(
+    code for code in (
+        errno.EXDEV, errno.EPERM, errno.EINVAL, errno.ENOTTY, errno.ENOSYS, errno.ENOTSUP,
+        errno.EOPNOTSUPP, getattr(errno, "EBADF", None),
+    ) if code is not None
+)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS links (
+    source TEXT PRIMARY KEY,
+    destination TEXT NOT NULL,
+    method TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    inode INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS links_destination ON links(destination);
+"""
+
+
+def reflink(source, destination):
+    """
+    Копия файла с общими блоками данных (copy-on-write): btrfs и XFS
+    в Linux, APFS в macOS. Данные не копируются, а изменение одной копии
+    не затрагивает другую.
+    """
+    if sys.platform.startswith("linux"):
+        import fcntl
+
+        with open(source, "rb") as src:
+            fd = os.open(destination, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+            try:
+                fcntl.ioctl(fd, _FICLONE, src.fileno())
+            except OSError:
+                os.close(fd)
+                os.remove(destination)
+                raise
+            os.close(fd)
+        shutil.copystat(source, destination)
+    elif sys.platform == "darwin":
+        import ctypes
+
+        libc = ctypes.CDLL(None, use_errno=True)
+        if libc.clonefile(os.fsencode(source), os.fsencode(destination), 0) != 0:
+            code = ctypes.get_errno()
+            raise OSError(code, os.strerror(code), destination)
+    else:
+        raise OSError(errno.ENOTSUP, "reflink не поддерживается", destination)
+
+
+def owns_link(row):
+    """
+    True, если destination всё ещё та ссылка, которую создал зеркальный режим
+    (а не файл, который пользователь положил или изменил на её месте)
+    """
+    source, destination, method, size, mtime_ns, inode = row
+    try:
+        if method == "symlink":
+            return os.readlink(destination) == source
+        stat = os.stat(destination, follow_symlinks=False)
+    except OSError:
+        return False
+    if method == "hardlink":
+        return stat.st_ino == inode
+    return (stat.st_size, stat.st_mtime_ns) == (size, mtime_ns)
+
+
+class Mirror:
+    """
+    Зеркальный режим: файлы остаются в папке output, а в папке проекта
+    появляются ссылки на них - reflink на файловых системах с
+    copy-on-write, иначе жёсткие ссылки. Данные не копируются.
+
+    Если источник и папка проекта на разных устройствах, ссылки
+    невозможны, и используется fallback (см. MIRROR_FALLBACKS).
+    Неудачный способ запоминается для пары устройств, так что
+    неподдерживаемый reflink пробуется один раз.
+
+    Созданные ссылки записываются в mirror.sqlite (пакетами, как в
+    PromptGroups): по записи повторный запуск пропускает уже отражённые
+    файлы, а сверка (reconcile) находит ссылки, источник которых удалён.
+    """
+
+    def __init__(self, project_folder, fallback="symlink", copy=None, batch_size=500, flush_interval=2.0):
+        if fallback not in MIRROR_FALLBACKS:
+            raise ValueError(f"Неизвестный запасной способ зеркального режима: {fallback}")
+        self.path = os.path.join(get_data_folder(project_folder), MIRROR_FILE_NAME)
+        self.fallback = fallback
+        self._copy = copy or shutil.copy2
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._last_flush = time.monotonic()
+        self._devices = {}
+        self._unsupported = set()
+        self.methods = dict.fromkeys(("reflink", "hardlink", "symlink", "copy"), 0)
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript(_SCHEMA)
+
+    @staticmethod
+    def exists(project_folder):
+        """
+        Есть ли в проекте записи зеркального режима (без создания файла)
+        """
+        return os.path.exists(os.path.join(get_data_folder(project_folder), MIRROR_FILE_NAME))
+
+    def _device(self, folder):
+        device = self._devices.get(folder)
+        if device is None:
+            device = self._devices[folder] = os.stat(folder).st_dev
+            if len(self._devices) > 1024:
+                self._devices.pop(next(iter(self._devices)))
+        return device
+
+    def _methods(self, source_device, destination_device):
+        methods = []
+        if source_device == destination_device:
+            methods += ["reflink", "hardlink"]
+        if self.fallback == "symlink":
+            methods += ["symlink", "copy"]
+        elif self.fallback == "copy":
+            methods.append("copy")
+        return [method for method in methods
+                if (method, source_device, destination_device) not in self._unsupported]
+
+    def link(self, source, destination):
+        """
+        Создаёт destination как ссылку на source.
+
+        Returns:
+            str: способ ("reflink", "hardlink", "symlink", "copy") или None,
+                 если ссылку создать нельзя и fallback - "move"
+        """
+        source = os.path.abspath(source)
+        stat = os.stat(source)
+        destination_device = self._device(os.path.dirname(os.path.abspath(destination)))
+        for method in self._methods(stat.st_dev, destination_device):
+            try:
+                if method == "reflink":
+                    reflink(source, destination)
+                elif method == "hardlink":
+                    os.link(source, destination)
+                elif method == "symlink":
+                    os.symlink(source, destination)
+                else:
+                    self._copy(source, destination)
+            except (FileNotFoundError, FileExistsError):
+                raise
+            except OSError as e:
+                if method == "copy":
+                    raise
+                if method == "symlink" or e.errno in _UNSUPPORTED_ERRNOS:
+                    # Символические ссылки в Windows требуют прав - их отсутствие не временное
+                    self._unsupported.add((method, stat.st_dev, destination_device))
+                continue
+            self._record(source, destination, method, stat)
+            return method
+        return None
+
+    def _record(self, source, destination, method, stat):
+        with self._lock:
+            self.methods[method] += 1
+            self._connection.execute(
+                "INSERT OR REPLACE INTO links (source, destination, method, size, mtime_ns, inode) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (source, os.path.abspath(destination), method, stat.st_size, stat.st_mtime_ns, stat.st_ino),
+            )
+            self._pending += 1
+            due = (
+                self._pending >= self.batch_size
+                or time.monotonic() - self._last_flush >= self.flush_interval
+            )
+        if due:
+            self.flush()
+
+    def lookup(self, source):
+        """
+        Запись о ссылке на source: (source, destination, method, size, mtime_ns, inode) или None
+        """
+        with self._lock:
+            return self._connection.execute(
+                "SELECT source, destination, method, size, mtime_ns, inode FROM links WHERE source = ?",
+                (os.path.abspath(source),),
+            ).fetchone()
+
+    def rows(self, folder=None):
+        """
+        Все записи или записи источников внутри папки folder
+        """
+        query = "SELECT source, destination, method, size, mtime_ns, inode FROM links"
+        params = ()
+        if folder is not None:
+            prefix = os.path.join(os.path.abspath(folder), "")
+            # Диапазон вместо LIKE: в путях бывают % и _
+            query += " WHERE source >= ? AND source < ?"
+            params = (prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1))
+        with self._lock:
+            return self._connection.execute(query, params).fetchall()
+
+    def destinations(self):
+        with self._lock:
+            return {row[0] for row in self._connection.execute("SELECT destination FROM links")}
+
+    def forget(self, sources):
+        with self._lock:
+            self._connection.executemany("DELETE FROM links WHERE source = ?", [(source,) for source in sources])
+            self._pending += 1
+
+    def relocate(self, moves):
+        """
+        Обновляет пути ссылок после переноса файлов внутри проекта: moves - пары (прежний путь, новый)
+        """
+        with self._lock:
+            self._connection.executemany(
+                "UPDATE links SET destination = ? WHERE destination = ?",
+                [(os.path.abspath(new), os.path.abspath(old)) for old, new in moves],
+            )
+            self._pending += 1
+        self.flush()
+
+    def flush(self):
+        with self._lock:
+            self._last_flush = time.monotonic()
+            if not self._pending:
+                return
+            self._pending = 0
+            self._connection.commit()
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            self._connection.close()
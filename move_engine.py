@@ -0,0 +1,235 @@
+import errno
+import os
+import random
+import shutil
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+
+# Ошибки, после которых перемещение стоит повторить: файл ещё открыт генератором
+# (Windows), сетевой диск временно не отвечает
+_TRANSIENT_ERRNOS = frozenset(
+    code for code in (
+        errno.EACCES, errno.EPERM, errno.EBUSY, errno.EAGAIN, errno.EINTR,
+        getattr(errno, "ETIMEDOUT", None), getattr(errno, "ETXTBSY", None),
+    ) if code is not None
+)
+
+# Ошибки link(), означающие, что файловая система не поддерживает жёсткие ссылки
+_NO_LINK_ERRNOS = frozenset(
+    code for code in (
+        errno.EPERM, errno.EXDEV, errno.EMLINK, errno.ENOTSUP, errno.EOPNOTSUPP, errno.ENOSYS,
+    ) if code is not None
+)
+
+COPY_CHUNK = 8 * 1024 * 1024
+TEMP_PREFIX = ".sd_organizer_"
+TEMP_SUFFIX = ".tmp"
+
+
+def _kernel_copy(source_fd, destination_fd, size):
+    # Копирование внутри ядра без передачи данных через Python:
+    # copy_file_range (Linux, в том числе между файловыми системами с ядра 5.3),
+    # затем sendfile; False - ни один способ недоступен, нужно копировать самим
+    copied = 0
+    for method in ("copy_file_range", "sendfile"):
+        func = getattr(os, method, None)
+        if func is None:
+            continue
+        try:
+            while copied < size:
+                if method == "copy_file_range":
+                    sent = func(source_fd, destination_fd, min(COPY_CHUNK, size - copied))
+                else:
+                    sent = func(destination_fd, source_fd, copied, min(COPY_CHUNK, size - copied))
+                if sent == 0:
+                    break
+                copied += sent
+            return True
+        except OSError as e:
+            if copied or e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.ENOTSUP,
+                                         errno.EBADF, errno.EOPNOTSUPP):
+                raise
+    return False
+
+
+_RENAME_NOREPLACE = 1
+_AT_FDCWD = -100
+_renameat2 = None
+if sys.platform.startswith("linux"):
+    try:
+        import ctypes
+
+        _renameat2 = ctypes.CDLL(None, use_errno=True).renameat2
+    except (AttributeError, OSError):
+        # glibc старше 2.28 или другая libc без renameat2
+        _renameat2 = None
+
+
+def rename_noreplace(source, destination):
+    """
+    Переименовывает source в destination, не заменяя существующий файл:
+    если destination уже есть, вызывает FileExistsError.
+
+    Windows так переименовывает и сама, в Linux используется
+    renameat2(RENAME_NOREPLACE), иначе - жёсткая ссылка и удаление
+    прежнего имени (link тоже не заменяет существующий файл).
+    """
+    if sys.platform == "win32":
+        os.rename(source, destination)
+        return
+    if _renameat2 is not None:
+        if _renameat2(_AT_FDCWD, os.fsencode(source), _AT_FDCWD, os.fsencode(destination), _RENAME_NOREPLACE) == 0:
+            return
+        code = ctypes.get_errno()
+        if code == errno.EEXIST:
+            raise FileExistsError(code, os.strerror(code), destination)
+        if code not in (errno.EINVAL, errno.ENOSYS, errno.ENOTSUP, errno.EOPNOTSUPP):
+            raise OSError(code, os.strerror(code), source)
+        # Файловая система не поддерживает флаг - пробуем через ссылку
+    try:
+        os.link(source, destination, follow_symlinks=False)
+    except FileExistsError:
+        raise
+    except OSError as e:
+        if e.errno not in _NO_LINK_ERRNOS:
+            raise
+        # Ни флага, ни ссылок (FAT, часть сетевых дисков): остаётся проверка
+        # перед переименованием, между ними имя может занять другой процесс
+        if os.path.lexists(destination):
+            raise FileExistsError(errno.EEXIST, os.strerror(errno.EEXIST), destination)
+        os.rename(source, destination)
+        return
+    os.unlink(source)
+
+
+class MoveEngine:
+    """
+    Перемещение файлов с учётом устройств источника и назначения.
+
+    На одном устройстве файл переименовывается (атомарно). Между устройствами
+    он копируется средствами ядра во временный файл рядом с назначением,
+    сбрасывается на диск и только потом переименовывается в итоговое имя и
+    удаляется из источника - после сбоя в папке проекта не остаётся
+    недописанных изображений. Существующий файл назначения никогда не
+    заменяется (rename_noreplace): вызывающий получает FileExistsError
+    и выбирает другое имя. Устройство папки назначения запоминается,
+    поэтому stat папки выполняется один раз.
+
+    Параллельность копирования задаёт вызывающий код (стадия move конвейера,
+    пул очереди событий); одновременных копирований не больше max_transfers.
+    Повторные попытки выполняются с экспоненциальной задержкой со случайным разбросом.
+    """
+
+    def __init__(self, max_attempts=4, base_delay=0.1, max_delay=2.0, max_transfers=4,
+                 max_folders=1024, on_retry=None):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_folders = max_folders
+        self.on_retry = on_retry
+        self._transfers = threading.BoundedSemaphore(max_transfers)
+        self._devices = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _device(self, folder):
+        with self._lock:
+            device = self._devices.get(folder)
+            if device is not None:
+                self._devices.move_to_end(folder)
+                return device
+        device = os.stat(folder).st_dev
+        with self._lock:
+            self._devices[folder] = device
+            while len(self._devices) > self.max_folders:
+                self._devices.popitem(last=False)
+        return device
+
+    def forget(self, folder=None):
+        """
+        Сбрасывает запомненное устройство папки (или всех папок)
+        """
+        with self._lock:
+            if folder is None:
+                self._devices.clear()
+            else:
+                self._devices.pop(folder, None)
+
+    def _copy(self, source, destination, size, remove_source=True):
+        # Имя уникально для потока: один поток копирует один файл за раз
+        temp_path = os.path.join(
+            os.path.dirname(destination),
+            f"{TEMP_PREFIX}{os.getpid()}_{threading.get_ident()}{TEMP_SUFFIX}",
+        )
+        if os.path.lexists(destination):
+            # Не копируем зря: итоговое переименование всё равно откажет
+            raise FileExistsError(errno.EEXIST, os.strerror(errno.EEXIST), destination)
+        try:
+            with self._transfers:
+                with open(source, "rb") as src, open(temp_path, "wb") as dst:
+                    if not _kernel_copy(src.fileno(), dst.fileno(), size):
+                        shutil.copyfileobj(src, dst, COPY_CHUNK)
+                    dst.flush()
+                    os.fsync(dst.fileno())
+            shutil.copystat(source, temp_path)
+            rename_noreplace(temp_path, destination)
+        except BaseException:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+        if remove_source:
+            os.remove(source)
+
+    def _move_once(self, source, destination):
+        stat = os.stat(source)
+        if stat.st_dev == self._device(os.path.dirname(destination) or "."):
+            try:
+                rename_noreplace(source, destination)
+                return
+            except OSError as e:
+                # Разные файловые системы на одном st_dev (bind mount, overlayfs)
+                if e.errno != errno.EXDEV:
+                    raise
+        self._copy(source, destination, stat.st_size)
+
+    def move(self, source, destination):
+        """
+        Перемещает source в destination с повторными попытками.
+
+        Returns:
+            bool: True, если файл перемещён
+        """
+        return self._retry(self._move_once, source, destination)
+
+    def copy(self, source, destination):
+        """
+        Копирует source в destination (через временный файл) с повторными попытками.
+
+        Returns:
+            bool: True, если файл скопирован
+        """
+        def copy_once(source, destination):
+            self._copy(source, destination, os.path.getsize(source), remove_source=False)
+
+        return self._retry(copy_once, source, destination)
+
+    def _retry(self, operation, source, destination):
+        for attempt in range(self.max_attempts):
+            try:
+                operation(source, destination)
+                return True
+            except FileNotFoundError:
+                # Источник или папка назначения пропали - повтор не поможет
+                raise
+            except OSError as e:
+                if e.errno not in _TRANSIENT_ERRNOS or attempt == self.max_attempts - 1:
+                    raise
+                if self.on_retry is not None:
+                    self.on_retry()
+                delay = min(self.max_delay, self.base_delay * 2 ** attempt)
+                time.sleep(delay * random.uniform(0.5, 1.0))
+        return False
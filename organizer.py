@@ -2,10 +2,28 @@ import os
 import shutil
 import hashlib
 from datetime import datetime
-from PIL import Image
 import re
 from watchdog.events import FileSystemEventHandler
 import time
+import threading
+from functools import partial
+from pipeline import Pipeline, Stage, StageConfig
+from metadata_reader import read_parameters
+from sd_parameters import GenerationParameters
+from catalog import Catalog, DATA_FOLDER_NAME, file_key, quick_hash
+from dedup import DuplicateIndex
+from folder_cache import FolderCache, DiskSpaceBudget
+from event_queue import DebouncedEventQueue
+from stats import Stats
+from move_engine import MoveEngine
+from journal import MoveJournal, undo
+from dir_snapshot import DirectorySnapshot
+from search_index import SearchIndex
+from manifest import Manifest
+from recompress import RECOMPRESS_TEMP_SUFFIX, Recompressor
+from mirror import Mirror, owns_link
+from prompt_groups import PromptGroups
+from layout import DEFAULT_LAYOUT, Layout, date_fields, load_layout, save_layout
 
 
 def sanitize_folder_name(name, max_length=150):
@@ -44,10 +62,56 @@ def create_or_update_text_file(folder_name, file_name, content):
     with open(file_path, "w", encoding="utf-8") as file:
         file.write(content + "\n")
 
+IMAGE_EXTENSIONS = frozenset([".jpg", ".jpeg", ".png", ".webp", ".bmp", ".gif"])
+
 def is_image_file(file_path):
-    valid_extensions = [".jpg", ".jpeg", ".png", ".bmp", ".gif"]
     _, extension = os.path.splitext(file_path)
-    return extension.lower() in valid_extensions
+    return extension.lower() in IMAGE_EXTENSIONS
+
+def scan_image_files(folder, snapshot=None):
+    """
+    Потоково обходит дерево папок через os.scandir и выдаёт пути к изображениям.
+
+    Обход идёт в глубину по стеку папок, поэтому память не зависит
+    от количества файлов в дереве. Недоступные папки пропускаются, как в os.walk.
+    Если передан DirectorySnapshot, папки, не изменившиеся с прошлого обхода,
+    не перечитываются.
+    """
+    if snapshot is not None:
+        snapshot.begin_scan()
+    stack = [folder]
+    while stack:
+        current = stack.pop()
+        stat = None
+        if snapshot is not None:
+            try:
+                stat = os.stat(current)
+            except OSError:
+                continue
+            subfolders = snapshot.unchanged(current, stat)
+            if subfolders is not None:
+                stack.extend(os.path.join(current, name) for name in subfolders)
+                continue
+        subfolders = []
+        has_images = False
+        try:
+            with os.scandir(current) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                            subfolders.append(entry.name)
+                        elif is_image_file(entry.name) and entry.is_file():
+                            has_images = True
+                            yield entry.path
+                    except OSError:
+                        continue
+        except OSError:
+            continue
+        if stat is not None:
+            snapshot.record(current, stat, subfolders, has_images)
+    if snapshot is not None:
+        snapshot.end_scan()
 
 def find_substring(text, start_tag, end_tag):
     lower_text = text.lower()
@@ -66,258 +130,1454 @@ def find_substring(text, start_tag, end_tag):
     return text[start_idx:end_idx].strip()
 
 def extract_prompt_from_metadata(image_path):
+    """
+    Извлекает промпты и модель из метаданных изображения.
+
+    Returns:
+        tuple | None: (позитивный промпт, негативный промпт, модель, GenerationParameters)
+        или None, если параметров генерации нет
+    """
     try:
-        with Image.open(image_path) as img:
-            metadata = img.info
-            parameters = metadata.get("parameters", "")
-            if not parameters:
-                return None
-            
-            # Инициализируем значения по умолчанию
-            pos_prompt = "unknown"
-            neg_prompt = "unknown"
-            model = "unknown"
-            
-            # Очищаем параметры от "Parameters:" в начале
-            if parameters.startswith("Parameters:"):
-                parameters = parameters[len("Parameters:"):].strip()
-            
-            # Ищем границы промптов и параметров
-            steps_marker = "Steps:"
-            model_marker = "Model:"
-            denoising_marker = "Denoising strength:"
-            
-            # Ищем негативный промпт
-            neg_markers = ["Negative prompt:", "Negative Prompt:"]
-            neg_start = -1
-            used_marker = None
-            
-            for marker in neg_markers:
-                pos = parameters.find(marker)
-                if pos != -1:
-                    neg_start = pos
-                    used_marker = marker
-                    break
-            
-            # Извлекаем позитивный промпт
-            if neg_start != -1:
-                pos_prompt = parameters[:neg_start].strip()
-                # Ищем конец негативного промпта
-                neg_text = parameters[neg_start + len(used_marker):]
-                steps_pos = neg_text.find(steps_marker)
-                if steps_pos != -1:
-                    neg_prompt = neg_text[:steps_pos].strip()
-                else:
-                    neg_prompt = neg_text.strip()
-            else:
-                # Если нет негативного промпта, ищем конец позитивного
-                steps_pos = parameters.find(steps_marker)
-                if steps_pos != -1:
-                    pos_prompt = parameters[:steps_pos].strip()
-                else:
-                    pos_prompt = parameters.strip()
-            
-            # Улучшенное извлечение модели
-            model = "unknown"
-            
-            # Ищем основную модель
-            model_patterns = [
-                # Паттерн 1: Стандартный формат
-                {
-                    'start': "Model: ",
-                    'end': ["Clip skip:", ", Clip", "ControlNet", "Style Selector", "Version:", "Denoising strength:"],
-                    'exclude_if_before': ["ControlNet", "Module:"]  # Не извлекаем, если перед Model: есть эти слова
-                },
-                # Паттерн 2: Формат с хешем
-                {
-                    'start': "Model hash: ",
-                    'end': ["Model:", "Denoising strength:"],
-                    'exclude_if_before': ["ControlNet", "Module:"]
-                }
-            ]
-            
-            for pattern in model_patterns:
-                start_marker = pattern['start']
-                # Проверяем все вхождения start_marker
-                start_pos = 0
-                while True:
-                    start_idx = parameters.find(start_marker, start_pos)
-                    if start_idx == -1:
-                        break
-                        
-                    # Проверяем, нет ли исключающих слов перед маркером
-                    text_before = parameters[max(0, start_idx-50):start_idx]
-                    if any(excl in text_before for excl in pattern['exclude_if_before']):
-                        start_pos = start_idx + 1
-                        continue
-                    
-                    start_idx += len(start_marker)
-                    end_idx = float('inf')
-                    
-                    # Ищем ближайший конец
-                    for end_marker in pattern['end']:
-                        marker_idx = parameters.find(end_marker, start_idx)
-                        if marker_idx != -1 and marker_idx < end_idx:
-                            end_idx = marker_idx
-                    
-                    if end_idx != float('inf'):
-                        model_text = parameters[start_idx:end_idx].strip()
-                        if model_text:
-                            model = model_text.strip().rstrip(',')
-                            # Если нашли основную модель, прерываем поиск
-                            break
-                    
-                    start_pos = start_idx
-                
-                if model != "unknown":
-                    break
-            
-            # Очистка модели от лишних данных
-            if ',' in model:
-                # Берем первую часть, если есть запятая
-                model = model.split(',')[0].strip()
-            
-            # Проверяем и устанавливаем значения по умолчанию для пустых полей
-            if not pos_prompt or pos_prompt.isspace():
-                pos_prompt = "unknown"
-            if not neg_prompt or neg_prompt.isspace():
-                neg_prompt = "unknown"
-            if not model or model.isspace():
-                model = "unknown"
-            
-            return (pos_prompt, neg_prompt, model)
+        parameters = read_parameters(image_path)
+        if not parameters:
+            return None
+
+        generation = GenerationParameters(parameters)
+
+        # Проверяем и устанавливаем значения по умолчанию для пустых полей
+        pos_prompt = generation.prompt or "unknown"
+        neg_prompt = generation.negative_prompt or "unknown"
+        model = generation.model or "unknown"
+
+        return (pos_prompt, neg_prompt, model, generation)
             
     except Exception as e:
         print(f"Ошибка при извлечении метаданных из {image_path}: {e}")
         return None
     
+# Кеш состояния папок назначения и учёт свободного места, общие для всех обработчиков
+folder_cache = FolderCache()
+disk_space = DiskSpaceBudget()
+
+# Задержки стадий и счётчики; по умолчанию выключены (stats.enable())
+stats = Stats()
+
+# Перемещение rename внутри устройства и копированием ядром между устройствами
+move_engine = MoveEngine(on_retry=partial(stats.increment, "move_retries"))
+
+# Имена файлов, уже назначенные для перемещения, но ещё не перемещённые.
+# Нужны, чтобы параллельные перемещения не выбрали одно и то же имя.
+_reserved_destinations = set()
+_reserved_lock = threading.Lock()
+
+# Последний выданный суффикс для каждого имени, чтобы не перебирать _1, _2, ... заново
+_suffix_hints = {}
+MAX_SUFFIX_HINTS = 10000
+
 def handle_duplicate(destination_path):
     base, extension = os.path.splitext(destination_path)
-    counter = 1
+    counter = _suffix_hints.get(destination_path, 1)
     new_destination = f"{base}_{counter}{extension}"
-    while os.path.exists(new_destination):
+    while folder_cache.exists(new_destination) or new_destination in _reserved_destinations:
         counter += 1
         new_destination = f"{base}_{counter}{extension}"
+    if len(_suffix_hints) >= MAX_SUFFIX_HINTS:
+        _suffix_hints.clear()
+    _suffix_hints[destination_path] = counter
     return new_destination
 
-def process_file(source_path, project_folder):
-    # Проверяем свободное место перед обработкой
-    if not check_disk_space(project_folder):
-        return {
-            "status": "error", 
-            "message": "Недостаточно места на диске (требуется минимум 100MB)"
-        }
-    
+def reserve_destination(destination_path):
+    """
+    Подбирает свободное имя файла и резервирует его до окончания перемещения.
+    Имя свободно по кешу папки; занято ли оно на самом деле, решает само
+    перемещение (см. move_to_destination)
+    """
+    with _reserved_lock:
+        if folder_cache.exists(destination_path) or destination_path in _reserved_destinations:
+            destination_path = handle_duplicate(destination_path)
+        _reserved_destinations.add(destination_path)
+    return destination_path
+
+def release_destination(destination_path):
+    with _reserved_lock:
+        _reserved_destinations.discard(destination_path)
+
+def cached_metadata(entry):
+    """
+    Возвращает (известно ли, метаданные) для записи каталога
+    """
+    if entry is None:
+        return False, None
+    if entry.prompt is not None:
+        return True, (entry.prompt, entry.negative_prompt, entry.model)
+    # Файл без параметров генерации - повторно читать его нет смысла
+    return entry.status == "moved_to_root", None
+
+def with_parameters(source_path, metadata):
+    """
+    Дополняет метаданные из каталога или журнала - (pos, neg, model) без
+    GenerationParameters - параметрами генерации, заново прочитанными из файла.
+    Промпты и модель остаются прежними: по ним уже выбрана папка.
+    """
+    if metadata is None or len(metadata) > 3:
+        return metadata
+    try:
+        with stats.time("metadata"):
+            parameters = read_parameters(source_path)
+    except Exception:
+        return metadata
+    if not parameters:
+        return metadata
+    return tuple(metadata[:3]) + (GenerationParameters(parameters),)
+
+def read_metadata(source_path, project_folder, entry=None, resumed=None, parameters=False):
+    """
+    Стадия чтения метаданных: проверки и извлечение промпта с повторными попытками.
+    Если файл уже есть в каталоге (entry) или его перемещение было запланировано
+    прерванным запуском (resumed - запись журнала), метаданные берутся оттуда.
+
+    Args:
+        parameters: метаданные из каталога или журнала дополнить параметрами
+            генерации из файла (они нужны поисковому индексу и Manifest)
+
+    Returns:
+        tuple: (metadata, result) - result не None, если файл дальше обрабатывать не нужно
+    """
     if not os.path.isfile(source_path):
-        return {"status": "not_a_file"}
-    
+        return None, {"status": "not_a_file"}
+
+    if resumed is not None:
+        known, metadata = True, resumed.metadata
+    else:
+        known, metadata = cached_metadata(entry)
+    if known:
+        if parameters:
+            metadata = with_parameters(source_path, metadata)
+        return metadata, None
+
     # Добавляем задержку и повторные попытки для занятых файлов
     max_attempts = 3
     attempt = 0
     while attempt < max_attempts:
         try:
-            result = extract_prompt_from_metadata(source_path)
-            break
+            with stats.time("metadata"):
+                return extract_prompt_from_metadata(source_path), None
         except PermissionError:
             attempt += 1
+            stats.increment("metadata_retries")
             if attempt == max_attempts:
-                return {
+                return None, {
                     "status": "error",
                     "message": f"Файл {source_path} занят другим процессом. Попробуйте позже."
                 }
             time.sleep(1)  # Ждем секунду перед следующей попыткой
-    
-    if result is None:
+
+def check_free_space(source_path, project_folder):
+    """
+    Проверяет, хватит ли места в папке проекта для файла (с учётом уже перемещённых)
+
+    Returns:
+        dict | None: результат с ошибкой или None, если места достаточно
+    """
+    try:
+        size = os.path.getsize(source_path)
+    except OSError:
+        return {"status": "not_a_file"}
+    with stats.time("disk_space"):
+        enough = disk_space.reserve(project_folder, size)
+    if not enough:
+        return {
+            "status": "error", 
+            "message": "Недостаточно места на диске (требуется минимум 100MB)"
+        }
+    return None
+
+_default_layout = Layout(DEFAULT_LAYOUT)
+
+def prompt_file_content(pos_prompt, neg_prompt, model):
+    return f"Positive Prompt: {pos_prompt}\nNegative Prompt: {neg_prompt}\nModel: {model}"
+
+def read_prompt_file(folder):
+    """
+    Читает prompt.txt папки промпта
+
+    Returns:
+        tuple: (pos_prompt, neg_prompt, model) или None, если файла нет или формат другой
+    """
+    try:
+        with open(os.path.join(folder, "prompt.txt"), encoding="utf-8") as file:
+            content = file.read().rstrip("\n")
+    except OSError:
+        return None
+    pos_tag, neg_tag, model_tag = "Positive Prompt: ", "\nNegative Prompt: ", "\nModel: "
+    neg_at = content.rfind(neg_tag)
+    model_at = content.rfind(model_tag)
+    if not content.startswith(pos_tag) or neg_at < 0 or model_at < neg_at:
+        return None
+    return (content[len(pos_tag):neg_at], content[neg_at + len(neg_tag):model_at],
+            content[model_at + len(model_tag):])
+
+def layout_folder(project_folder, layout, fields):
+    """
+    Папка изображения по шаблону раскладки (имена папок очищены)
+    """
+    return os.path.join(project_folder, *(sanitize_folder_name(name) for name in layout.format(fields)))
+
+def plan_destination(source_path, project_folder, metadata, prompt_groups=None, layout=None):
+    """
+    Стадия планирования: создаёт папки по шаблону раскладки (по умолчанию
+    дата/промпт) и резервирует имя файла.
+    Если передан PromptGroups, файл попадает в папку похожего промпта.
+
+    Returns:
+        tuple: (destination_path, status) - статус, который получит файл после перемещения
+    """
+    if metadata is None:
         dest_path = os.path.join(project_folder, os.path.basename(source_path))
-        if os.path.exists(dest_path):
-            dest_path = handle_duplicate(dest_path)
-        try:
-            if safe_move_file(source_path, dest_path):
-                return {"status": "moved_to_root", "destination": dest_path}
-            else:
-                return {
-                    "status": "error", 
-                    "message": f"Не удалось переместить файл {source_path} в {dest_path}"
-                }
-        except Exception as e:
-            return {"status": "error", "message": f"Ошибка при перемещении файла {source_path} в {dest_path}: {e}"}
+        return reserve_destination(dest_path), "moved_to_root"
     
     # Извлекаем данные из результата
-    if len(result) == 4:
-        pos_prompt, neg_prompt, model, metadata_content = result
+    if len(metadata) == 4:
+        pos_prompt, neg_prompt, model, metadata_content = metadata
     else:
-        pos_prompt, neg_prompt, model = result
+        pos_prompt, neg_prompt, model = metadata
         metadata_content = None
     
     # Создаем структуру папок
     date_folder_name = get_file_date(source_path)
-    date_folder = os.path.join(project_folder, date_folder_name)
-    create_folder(date_folder)
 
     # Используем новую функцию для создания имени папки
-    folder_name = create_folder_name(pos_prompt, neg_prompt, model)
-    folder_name = sanitize_folder_name(folder_name)
-    prompt_folder = os.path.join(date_folder, folder_name)
-    create_folder(prompt_folder)
+    with stats.time("naming"):
+        folder_name = create_folder_name(pos_prompt, neg_prompt, model)
+        folder_name = sanitize_folder_name(folder_name)
+        if prompt_groups is not None:
+            folder_name, (pos_prompt, neg_prompt, model) = prompt_groups.assign(
+                pos_prompt, neg_prompt, model, folder_name
+            )
+    fields = dict(date_fields(date_folder_name), model=model, prompt=folder_name)
+    prompt_folder = layout_folder(project_folder, layout or _default_layout, fields)
+    with stats.time("mkdir"):
+        folder_cache.ensure_folder(os.path.dirname(prompt_folder))
+        folder_cache.ensure_folder(prompt_folder)
 
     # Сохраняем только основные метаданные
-    prompt_content = f"Positive Prompt: {pos_prompt}\nNegative Prompt: {neg_prompt}\nModel: {model}"
-    create_or_update_text_file(prompt_folder, "prompt.txt", prompt_content)
+    with stats.time("prompt_txt"):
+        folder_cache.write_text(prompt_folder, "prompt.txt", prompt_file_content(pos_prompt, neg_prompt, model))
 
-    # Используем безопасное перемещение
     destination_path = os.path.join(prompt_folder, os.path.basename(source_path))
-    if os.path.exists(destination_path):
-        destination_path = handle_duplicate(destination_path)
+    return reserve_destination(destination_path), "moved_to_prompt_folder"
+
+def _move_into_folder(source_path, destination_path):
+    try:
+        return safe_move_file(source_path, destination_path)
+    except FileNotFoundError:
+        if not os.path.isfile(source_path):
+            raise
+        # Папку назначения удалили снаружи, а кеш об этом ещё не знает
+        folder = os.path.dirname(destination_path)
+        folder_cache.invalidate(folder)
+        folder_cache.ensure_folder(folder)
+        return safe_move_file(source_path, destination_path)
+
+def _mirror_into_folder(mirror, source_path, destination_path):
+    try:
+        return mirror.link(source_path, destination_path)
+    except FileNotFoundError:
+        if not os.path.isfile(source_path):
+            raise
+        folder = os.path.dirname(destination_path)
+        folder_cache.invalidate(folder)
+        folder_cache.ensure_folder(folder)
+        return mirror.link(source_path, destination_path)
+
+# Сколько раз подбирать новое имя, если выбранное заняли снаружи
+MAX_NAME_COLLISIONS = 20
 
+def _place_file(source_path, destination_path, status, duplicates=None, mirror=None):
+    size = os.path.getsize(source_path) if stats.enabled else 0
+    if mirror is not None:
+        with stats.time("move"):
+            method = _mirror_into_folder(mirror, source_path, destination_path)
+        if method is not None:
+            folder_cache.add_file(destination_path)
+            if method == "copy":
+                stats.increment("bytes_moved", size)
+            return {"status": status, "destination": destination_path, "link": method}
+    if duplicates is not None:
+        with stats.time("move"):
+            duplicate, moved = duplicates.place(source_path, destination_path, _move_into_folder)
+        if duplicate is not None:
+            if duplicates.policy == "hardlink":
+                return {"status": "duplicate_linked", "destination": destination_path, "duplicate_of": duplicate}
+            return {"status": "duplicate_skipped", "destination": duplicate, "duplicate_of": duplicate}
+    else:
+        # Используем безопасное перемещение
+        with stats.time("move"):
+            moved = _move_into_folder(source_path, destination_path)
+    if status == "moved_to_root" and not moved:
+        folder_cache.invalidate(os.path.dirname(destination_path))
+        return {
+            "status": "error", 
+            "message": f"Не удалось переместить файл {source_path} в {destination_path}"
+        }
+    folder_cache.add_file(destination_path)
+    stats.increment("bytes_moved", size)
+    return {"status": status, "destination": destination_path}
+
+def move_to_destination(source_path, destination_path, status, duplicates=None, mirror=None):
+    """
+    Стадия перемещения: безопасно перемещает файл в запланированное место.
+    Если передан DuplicateIndex, побайтовые дубликаты обрабатываются по его политике.
+    Если передан Mirror, файл остаётся на месте, а в папке проекта создаётся
+    ссылка на него; перемещение - только при fallback "move" между устройствами.
+
+    Имя, выбранное по кешу папки, может оказаться занятым (файл появился
+    снаружи после чтения папки): перемещение не заменяет существующие файлы,
+    поэтому папка перечитывается и берётся следующий свободный суффикс.
+    Итоговый путь - в result["destination"].
+    """
+    planned_path = destination_path
     try:
-        safe_move_file(source_path, destination_path)
-        return {"status": "moved_to_prompt_folder", "destination": destination_path}
+        for _ in range(MAX_NAME_COLLISIONS):
+            try:
+                return _place_file(source_path, destination_path, status, duplicates, mirror)
+            except FileExistsError:
+                folder_cache.invalidate(os.path.dirname(destination_path))
+                release_destination(destination_path)
+                destination_path = reserve_destination(planned_path)
+        return {"status": "error",
+                "message": f"Не удалось подобрать свободное имя для {source_path} в {os.path.dirname(planned_path)}"}
     except Exception as e:
+        # Папку могли изменить снаружи - перечитаем её при следующем обращении
+        folder_cache.invalidate(os.path.dirname(destination_path))
         return {"status": "error", "message": f"Ошибка при перемещении файла {source_path} в {destination_path}: {e}"}
-    
-def process_all_files(output_folder, project_folder, log_callback=None):
-    total_files = 0
+    finally:
+        release_destination(destination_path)
+
+# Статусы, после которых изображение лежит в папке проекта под именем destination
+INDEXED_STATUSES = frozenset(["moved_to_root", "moved_to_prompt_folder", "duplicate_linked"])
+
+def index_result(search_index, result, metadata, key=None):
+    """
+    Добавляет перемещённое изображение с параметрами генерации в поисковый индекс
+    (или в столбцовый журнал Manifest - у него такой же метод add). Метаданные
+    без GenerationParameters (см. with_parameters) не добавляются: строка
+    заменила бы прежнюю пустыми сэмплером, steps и seed.
+    """
+    if (search_index is None or metadata is None or len(metadata) < 4
+            or result["status"] not in INDEXED_STATUSES):
+        return
+    size, mtime_ns = key or (None, None)
+    search_index.add(result["destination"], metadata, size, mtime_ns)
+
+def recompress_result(recompressor, result):
+    """
+    Ставит перемещённый PNG в очередь фонового сжатия
+    """
+    # Жёсткие ссылки на дубликаты и ссылки зеркального режима не пережимаются:
+    # замена файла разорвала бы ссылку
+    if (recompressor is not None and result["status"] in ("moved_to_root", "moved_to_prompt_folder")
+            and "link" not in result):
+        recompressor.submit(result["destination"])
+
+def unmirror(mirror, rows, project_folder, search_index=None):
+    """
+    Удаляет из проекта ссылки зеркального режима (строки Mirror.rows) и опустевшие
+    папки. Файл, который пользователь положил или изменил на месте ссылки, остаётся.
+
+    Returns:
+        int: количество удалённых ссылок
+    """
+    removed = 0
+    removed_paths = []
+    for row in rows:
+        destination = row[1]
+        if owns_link(row):
+            try:
+                os.remove(destination)
+            except FileNotFoundError:
+                pass
+            except OSError:
+                continue
+            removed += 1
+            removed_paths.append(destination)
+            folder = os.path.dirname(destination)
+            folder_cache.invalidate(folder)
+            _remove_empty_folders(folder, project_folder)
+    mirror.forget([row[0] for row in rows])
+    if search_index is not None and removed_paths:
+        search_index.remove(removed_paths)
+    return removed
+
+def check_mirrored(mirror, source_path, project_folder, key=None, search_index=None):
+    """
+    Проверяет, отражён ли файл в проекте прежним запуском. Ссылка на прежнюю
+    версию файла (размер или время изменения другие) или пропавшая из проекта
+    ссылка забываются, и файл отражается заново.
+
+    Returns:
+        dict | None: результат already_mirrored или None, если файл нужно обработать
+    """
+    row = mirror.lookup(source_path)
+    if row is None:
+        return None
+    if key is None:
+        try:
+            key = file_key(source_path)
+        except OSError:
+            return {"status": "not_a_file"}
+    destination, method = row[1], row[2]
+    if (row[3], row[4]) == tuple(key) and os.path.lexists(destination):
+        return {"status": "already_mirrored", "destination": destination, "link": method}
+    unmirror(mirror, [row], project_folder, search_index)
+    return None
+
+def process_file(source_path, project_folder, catalog=None, duplicates=None, journal=None,
+                 search_index=None, prompt_groups=None, layout=None, manifest=None, mirror=None):
+    key = entry = None
+    if catalog is not None:
+        try:
+            key = file_key(source_path)
+        except OSError:
+            return {"status": "not_a_file"}
+        entry = catalog.lookup(source_path, key)
+
+    metadata = result = new_hash = None
+    if mirror is not None:
+        result = check_mirrored(mirror, source_path, project_folder, key, search_index)
+    if result is None:
+        metadata, result = read_metadata(source_path, project_folder, entry,
+                                         parameters=search_index is not None or manifest is not None)
+        if key is not None and entry is None and result is None:
+            # Как в конвейере (_metadata_stage): хеш считается до перемещения
+            try:
+                new_hash = quick_hash(source_path, key[0])
+            except OSError:
+                pass
+    if result is None:
+        result = check_free_space(source_path, project_folder)
+    if result is None:
+        destination_path, status = plan_destination(
+            source_path, project_folder, metadata, prompt_groups, layout
+        )
+        if journal is not None:
+            journal.planned(source_path, destination_path, status, metadata)
+        result = move_to_destination(source_path, destination_path, status, duplicates, mirror)
+        if journal is not None:
+            journal.completed(source_path, result)
+        index_result(search_index, result, metadata, key)
+        index_result(manifest, result, metadata, key)
+
+    if catalog is not None and result["status"] not in ("not_a_file", "already_mirrored"):
+        sample_hash = entry.sample_hash if entry else new_hash
+        catalog.record(source_path, key, result, metadata, sample_hash)
+    result.setdefault("source", source_path)
+    stats.record_result(result)
+    return result
+
+# Количество обработчиков на каждой стадии по умолчанию
+DEFAULT_PIPELINE_CONFIG = {
+    "metadata": StageConfig(workers=4),
+    "plan": StageConfig(workers=1),
+    "move": StageConfig(workers=4),
+}
+
+def _metadata_stage(task, parameters=False):
+    if task.get("result") is not None:
+        # Уже отражённый файл (см. check_mirrored)
+        return task
+    entry = task.get("entry")
+    task["metadata"], task["result"] = read_metadata(
+        task["source"], task["project"], entry, task.get("resumed"), parameters
+    )
+    if task.get("key") and entry is None and task["result"] is None:
+        try:
+            task["hash"] = quick_hash(task["source"], task["key"][0])
+        except OSError:
+            pass
+    return task
+
+def _plan_stage(task, journal=None, prompt_groups=None, layout=None):
+    if task.get("result") is None and "error" not in task:
+        task["result"] = check_free_space(task["source"], task["project"])
+    if task.get("result") is None and "error" not in task:
+        task["destination"], task["status"] = plan_destination(
+            task["source"], task["project"], task["metadata"], prompt_groups, layout
+        )
+        if journal is not None:
+            journal.planned(task["source"], task["destination"], task["status"], task["metadata"])
+    return task
+
+def _move_stage(task, duplicates=None, mirror=None):
+    if task.get("result") is None and "error" not in task:
+        task["result"] = move_to_destination(
+            task["source"], task["destination"], task["status"], duplicates, mirror
+        )
+    return task
+
+# Как в журнале называется способ, которым файл отражён в проект
+_LINK_NAMES = {"reflink": "reflink", "hardlink": "жёсткая ссылка", "symlink": "символическая ссылка",
+               "copy": "копия"}
+
+def log_result(log_callback, result):
+    link = result.get("link")
+    if link is not None and result["status"] in ("moved_to_root", "moved_to_prompt_folder"):
+        log_callback(f"Отражён в проект ({_LINK_NAMES[link]}): {result['destination']}")
+    elif result["status"] == "moved_to_root":
+        log_callback(f"Перемещён в корневую папку: {result['destination']}")
+    elif result["status"] == "moved_to_prompt_folder":
+        log_callback(f"Перемещён в папку промпта: {result['destination']}")
+    elif result["status"] == "duplicate_skipped":
+        log_callback(f"Дубликат пропущен, копия уже есть: {result['duplicate_of']}")
+    elif result["status"] == "duplicate_linked":
+        log_callback(f"Дубликат сохранён как ссылка: {result['destination']}")
+    elif result["status"] == "error":
+        log_callback(result["message"])
+
+def _task_result(task):
+    if "error" in task:
+        if task.get("destination"):
+            release_destination(task["destination"])
+        source = task.get("source", "")
+        if not source:
+            # Ошибка источника задач (обхода папки output)
+            return {"status": "error", "source": source,
+                    "message": f"Ошибка при обходе папки output: {task['error']}"}
+        return {"status": "error", "source": source,
+                "message": f"Ошибка при обработке файла {source}: {task['error']}"}
+    result = task["result"]
+    result.setdefault("source", task["source"])
+    return result
+
+def process_all_files(output_folder, project_folder, log_callback=None, config=None, use_catalog=True,
+                      duplicate_policy="skip", use_journal=True, use_snapshot=True, use_search_index=True,
+                      group_prompts=False, use_manifest=True, recompressor=None, mirror=False,
+                      mirror_fallback="symlink"):
+    """
+    Обрабатывает все изображения в папке output конвейером из стадий
+    scan -> metadata -> plan -> move.
+
+    Сканирование идёт за один проход одновременно с обработкой, поэтому
+    total - это количество найденных на данный момент файлов, и оно может расти.
+
+    Args:
+        config: словарь {имя стадии: StageConfig}, переопределяющий DEFAULT_PIPELINE_CONFIG
+        use_catalog: пропускать чтение метаданных для файлов, уже известных каталогу
+            проекта, и записывать в него результаты
+        duplicate_policy: что делать с побайтовыми дубликатами (см. dedup.DUPLICATE_POLICIES)
+        use_journal: записывать перемещения в журнал проекта (для продолжения после
+            аварийного завершения и отмены) и продолжить прерванный запуск
+        use_snapshot: не перечитывать папки output, не изменившиеся с прошлого запуска
+            (снимок дерева хранится в папке проекта)
+        use_search_index: добавлять перемещённые изображения в поисковый индекс проекта
+        group_prompts: складывать изображения похожих промптов в одну папку
+            (см. prompt_groups.PromptGroups)
+        use_manifest: дописывать параметры генерации в столбцовый журнал проекта
+            для аналитики (см. manifest.load_manifest)
+        recompressor: recompress.Recompressor для фонового сжатия перемещённых PNG;
+            пока идёт упорядочивание, новые файлы в сжатие не отдаются
+        mirror: зеркальный режим - файлы остаются в output, а проект собирается
+            из ссылок на них (см. mirror.Mirror); уже отражённые файлы пропускаются
+        mirror_fallback: что делать, если ссылку создать нельзя (см. mirror.MIRROR_FALLBACKS)
+
+    Папки создаются по шаблону раскладки проекта (см. layout.load_layout).
+
+    Yields:
+        tuple: (processed, total, result) для каждого обработанного файла
+    """
+    stage_config = dict(DEFAULT_PIPELINE_CONFIG)
+    if config:
+        stage_config.update(config)
+    # Резервирование имён и индекс дубликатов общие для процесса,
+    # поэтому планирование и перемещение выполняются только в потоках
+    for name in ("plan", "move"):
+        stage_config[name] = stage_config[name]._replace(processes=False)
+
+    duplicates = DuplicateIndex(duplicate_policy)
+
+    # Общее количество уточняется по ходу сканирования
+    counter = {"total": 0}
     processed_files = 0
 
-    for root, dirs, files in os.walk(output_folder):
-        for file_name in files:
-            file_path = os.path.join(root, file_name)
-            if is_image_file(file_path):
-                total_files += 1
-
-    for root, dirs, files in os.walk(output_folder):
-        for file_name in files:
-            file_path = os.path.join(root, file_name)
-            if is_image_file(file_path):
-                result = process_file(file_path, project_folder)
-                processed_files += 1
-                if log_callback:
-                    if result["status"] == "moved_to_root":
-                        log_callback(f"Перемещён в корневую папку: {result['destination']}")
-                    elif result["status"] == "moved_to_prompt_folder":
-                        log_callback(f"Перемещён в папку промпта: {result['destination']}")
-                    elif result["status"] == "error":
-                        log_callback(result["message"])
-                yield processed_files, total_files, result
+    catalog = Catalog(project_folder) if use_catalog else None
+    search_index = SearchIndex(project_folder) if use_search_index else None
+    prompt_groups = PromptGroups(project_folder) if group_prompts else None
+    manifest = Manifest(project_folder) if use_manifest else None
+    mirror = Mirror(project_folder, mirror_fallback, copy=move_engine.copy) if mirror else None
+    layout = load_layout(project_folder)
+
+    journal = resumable = None
+    if use_journal:
+        journal = MoveJournal(project_folder)
+        resumable = journal.recover()
+        if log_callback and resumable:
+            log_callback(f"Продолжаем прерванную обработку: {len(resumable)} файлов")
+        journal.begin()
+
+    snapshot = DirectorySnapshot(project_folder, output_folder) if use_snapshot else None
+
+    def scan():
+        for file_path in scan_image_files(output_folder, snapshot):
+            counter["total"] += 1
+            task = {"source": file_path, "project": project_folder}
+            if resumable and file_path in resumable:
+                task["resumed"] = resumable[file_path]
+            if catalog is not None:
+                try:
+                    task["key"] = file_key(file_path)
+                except OSError:
+                    pass
+                else:
+                    task["entry"] = catalog.lookup(file_path, task["key"])
+            if mirror is not None:
+                task["result"] = check_mirrored(mirror, file_path, project_folder, task.get("key"), search_index)
+            yield task
+
+    pipeline = Pipeline(scan, [
+        Stage("metadata", partial(_metadata_stage, parameters=use_search_index or use_manifest),
+              stage_config["metadata"]),
+        Stage("plan", partial(_plan_stage, journal=journal, prompt_groups=prompt_groups, layout=layout), stage_config["plan"]),
+        Stage("move", partial(_move_stage, duplicates=duplicates, mirror=mirror), stage_config["move"]),
+    ])
+
+    if recompressor is not None:
+        recompressor.pause()
+    try:
+        for task in pipeline.run():
+            result = _task_result(task)
+            stats.record_result(result)
+            if journal is not None and task.get("source"):
+                journal.completed(task["source"], result)
+            index_result(search_index, result, task.get("metadata"), task.get("key"))
+            index_result(manifest, result, task.get("metadata"), task.get("key"))
+            recompress_result(recompressor, result)
+            processed_files += 1
+            if catalog is not None and task.get("key") and result["status"] not in ("not_a_file", "already_mirrored"):
+                entry = task.get("entry")
+                sample_hash = entry.sample_hash if entry else task.get("hash")
+                catalog.record(task["source"], task["key"], result, task.get("metadata"), sample_hash)
+            if log_callback:
+                log_result(log_callback, result)
+            yield processed_files, max(counter["total"], processed_files), result
+    finally:
+        if catalog is not None:
+            catalog.close()
+        if journal is not None:
+            journal.close()
+        if search_index is not None:
+            search_index.close()
+        if prompt_groups is not None:
+            prompt_groups.close()
+        if manifest is not None:
+            manifest.close()
+        if mirror is not None:
+            mirror.close()
+        if recompressor is not None:
+            recompressor.resume()
+
+    # Снимок сохраняется только после полного обхода
+    if snapshot is not None:
+        snapshot.save()
+        if log_callback and snapshot.skipped:
+            log_callback(f"Папок без изменений пропущено: {snapshot.skipped}, прочитано: {snapshot.listed}")
+
+    if log_callback and mirror is not None and any(mirror.methods.values()):
+        log_callback("Отражено в проект: " + ", ".join(
+            f"{_LINK_NAMES[method]} {count}" for method, count in mirror.methods.items() if count
+        ))
+
+    duplicate_stats = duplicates.stats()
+    if log_callback and (duplicate_stats["skipped"] or duplicate_stats["linked"]):
+        log_callback(
+            f"Дубликатов: пропущено {duplicate_stats['skipped']}, ссылок {duplicate_stats['linked']}, "
+            f"сэкономлено {duplicate_stats['bytes_saved'] / (1024 * 1024):.1f} МБ"
+        )
+
+def _index_stage(task):
+    try:
+        task["key"] = file_key(task["source"])
+        task["metadata"] = extract_prompt_from_metadata(task["source"])
+    except OSError:
+        task["metadata"] = None
+    return task
+
+def build_search_index(project_folder, log_callback=None, config=None):
+    """
+    Добавляет в поисковый индекс изображения, уже лежащие в папке проекта.
+    Файлы, не изменившиеся с прошлой индексации, повторно не читаются,
+    записи удалённых файлов удаляются.
+
+    Returns:
+        dict: {"indexed", "unchanged", "removed"}
+    """
+    project_folder = os.path.abspath(project_folder)
+    search_index = SearchIndex(project_folder)
+    known = search_index.known()
+    seen = set()
+    counts = {"indexed": 0, "unchanged": 0, "removed": 0}
+
+    def scan():
+        for file_path in scan_image_files(project_folder):
+            seen.add(file_path)
+            key = known.get(file_path)
+            if key is not None:
+                try:
+                    if file_key(file_path) == key:
+                        counts["unchanged"] += 1
+                        continue
+                except OSError:
+                    continue
+            yield {"source": file_path}
+
+    stage_config = (config or {}).get("metadata", DEFAULT_PIPELINE_CONFIG["metadata"])
+    try:
+        for task in Pipeline(scan, [Stage("metadata", _index_stage, stage_config)]).run():
+            if task.get("metadata") is not None:
+                search_index.add(task["source"], task["metadata"], *task["key"])
+                counts["indexed"] += 1
+        removed = [path for path in known if path not in seen]
+        if removed:
+            search_index.remove(removed)
+        counts["removed"] = len(removed)
+    finally:
+        search_index.close()
+    if log_callback:
+        log_callback(
+            f"Поисковый индекс: добавлено {counts['indexed']}, без изменений {counts['unchanged']}, "
+            f"удалено {counts['removed']}"
+        )
+    return counts
+
+def build_manifest(project_folder, log_callback=None):
+    """
+    Пересобирает столбцовый журнал проекта по поисковому индексу, который
+    сначала дополняется изображениями, уже лежащими в папке проекта.
+    Нужен для проектов, упорядоченных до появления журнала.
+
+    Returns:
+        dict: {"rows"} и счётчики build_search_index
+    """
+    counts = build_search_index(project_folder, log_callback)
+    search_index = SearchIndex(project_folder)
+    manifest = Manifest(project_folder, batch_size=10000)
+    rows = 0
+    try:
+        manifest.reset()
+        for row in search_index.rows():
+            manifest.append(row)
+            rows += 1
+    finally:
+        manifest.close()
+        search_index.close()
+    if log_callback:
+        log_callback(f"Столбцовый журнал пересобран: {rows} изображений")
+    counts["rows"] = rows
+    return counts
+
+def search_images(project_folder, query, limit=200, offset=0):
+    """
+    Ищет упорядоченные изображения проекта по промптам и параметрам генерации.
+
+    Примеры запросов: "cyberpunk model:dreamshaper_8", "\"red hair\" -blurry",
+    "lora:style_1 steps:30" (синтаксис - search_index.parse_query).
+
+    Returns:
+        list: словари с путём к файлу и параметрами генерации
+    """
+    search_index = SearchIndex(project_folder)
+    try:
+        return search_index.search(query, limit, offset)
+    finally:
+        search_index.close()
+
+def _walk_project(project_folder):
+    # Папки проекта по порядку имён, без служебной: (путь, вложенные папки, файлы)
+    for current, folder_names, file_names in os.walk(project_folder):
+        if current == project_folder:
+            folder_names[:] = [name for name in folder_names if name != DATA_FOLDER_NAME]
+        folder_names.sort()
+        yield current, folder_names, file_names
+
+def recompress_project(project_folder, log_callback=None, **options):
+    """
+    Пережимает без потерь PNG, уже лежащие в папке проекта (параметры
+    Recompressor - в options). Файлы, обработанные прежними запусками
+    и с тех пор не изменившиеся, пропускаются.
+
+    Returns:
+        dict: отчёт Recompressor.report() с сэкономленными байтами
+    """
+    project_folder = os.path.abspath(project_folder)
+    links = set()
+    if Mirror.exists(project_folder):
+        # Ссылки зеркального режима не пережимаются, как и в recompress_result
+        mirror = Mirror(project_folder)
+        try:
+            links = mirror.destinations()
+        finally:
+            mirror.close()
+    recompressor = Recompressor(project_folder, log_callback=log_callback, **options)
+    try:
+        for current, _, file_names in _walk_project(project_folder):
+            for name in file_names:
+                path = os.path.join(current, name)
+                if path in links:
+                    continue
+                if name.endswith(RECOMPRESS_TEMP_SUFFIX):
+                    # Остаток запуска, прерванного до подмены файла
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+                else:
+                    recompressor.submit(path)
+    finally:
+        report = recompressor.close()
+    return report
+
+def reconcile_mirror(project_folder, dry_run=False, force=False, log_callback=None):
+    """
+    Сверка зеркального режима: ссылки, источник которых удалён из output,
+    убираются из проекта вместе с опустевшими папками и записями поискового
+    индекса. Файлы, которые пользователь положил или изменил на месте ссылки,
+    не удаляются, а только забываются.
+
+    Если не найден ни один источник, скорее всего папка output недоступна
+    (например, не подключён сетевой диск), и без force ничего не удаляется.
+
+    Returns:
+        dict: {"links", "kept", "missing", "removed", "foreign"}
+    """
+    project_folder = os.path.abspath(project_folder)
+    counts = dict.fromkeys(("links", "kept", "missing", "removed", "foreign"), 0)
+    if not Mirror.exists(project_folder):
+        return counts
+    mirror = Mirror(project_folder)
+    search_index = None
+    try:
+        rows = mirror.rows()
+        missing = [row for row in rows if not os.path.exists(row[0])]
+        counts["links"] = len(rows)
+        counts["kept"] = len(rows) - len(missing)
+        counts["missing"] = len(missing)
+        if missing and not counts["kept"] and not force:
+            if log_callback:
+                log_callback(f"Не найден ни один из {len(rows)} источников: папка output недоступна? "
+                             "Ссылки не удалены")
+            return counts
+        if dry_run:
+            counts["removed"] = sum(1 for row in missing if owns_link(row))
+        elif missing:
+            search_index = SearchIndex(project_folder)
+            counts["removed"] = unmirror(mirror, missing, project_folder, search_index)
+        counts["foreign"] = counts["missing"] - counts["removed"]
+    finally:
+        if search_index is not None:
+            search_index.close()
+        mirror.close()
+    if log_callback:
+        log_callback(
+            f"Ссылок: {counts['links']}, источник удалён у {counts['missing']}, "
+            f"{'будет удалено' if dry_run else 'удалено'} {counts['removed']}"
+        )
+    return counts
+
+def _remove_empty_folders(folder, project_folder, journal=None):
+    # Удаляет папку, в которой остался только prompt.txt, и опустевшие родительские папки.
+    # Удалённый prompt.txt записывается в журнал, чтобы отмена вернула его
+    project_folder = os.path.abspath(project_folder)
+    while os.path.abspath(folder) != project_folder:
+        try:
+            names = os.listdir(folder)
+            if names == ["prompt.txt"]:
+                prompt_path = os.path.join(folder, "prompt.txt")
+                if journal is not None:
+                    with open(prompt_path, encoding="utf-8") as file:
+                        journal.removed(prompt_path, file.read())
+                os.remove(prompt_path)
+                names = []
+            if names:
+                return
+            os.rmdir(folder)
+        except FileNotFoundError:
+            pass
+        except OSError:
+            return
+        folder_cache.invalidate(folder)
+        parent = os.path.dirname(folder)
+        if parent == folder:
+            return
+        folder = parent
+
+def _relocate_mirror(project_folder, moves):
+    # Перенос ссылок зеркального режима внутри проекта
+    if not moves or not Mirror.exists(project_folder):
+        return
+    mirror = Mirror(project_folder)
+    try:
+        mirror.relocate(moves)
+    finally:
+        mirror.close()
+
+
+def _relocate_indexes(project_folder, moves, catalog=None):
+    # Перенос файлов внутри проекта: пути в каталоге, поисковом индексе, манифесте и зеркале
+    if not moves:
+        return
+    if catalog is not None:
+        catalog.relocate(moves)
+    elif Catalog.exists(project_folder):
+        catalog = Catalog(project_folder)
+        try:
+            catalog.relocate(moves)
+        finally:
+            catalog.close()
+    rows = []
+    if SearchIndex.exists(project_folder):
+        search_index = SearchIndex(project_folder)
+        try:
+            search_index.relocate(moves)
+            if Manifest.exists(project_folder):
+                rows = search_index.lookup(new for _, new in moves)
+        finally:
+            search_index.close()
+    if rows:
+        # Манифест только дописывается: прежняя строка отмечается удалённой,
+        # строка с новым путём берётся из поискового индекса
+        found = {row[0] for row in rows}
+        manifest = Manifest(project_folder)
+        try:
+            manifest.remove(old for old, new in moves if os.path.abspath(new) in found)
+            for row in rows:
+                manifest.append(row)
+        finally:
+            manifest.close()
+    _relocate_mirror(project_folder, moves)
+
+
+def _forget_indexes(project_folder, moves, catalog=None):
+    # Файлы ушли из проекта: убираем их записи из каталога, поискового индекса, манифеста и зеркала
+    if not moves:
+        return
+    if catalog is not None:
+        catalog.forget(old for old, _ in moves)
+    if SearchIndex.exists(project_folder):
+        search_index = SearchIndex(project_folder)
+        try:
+            search_index.remove(old for old, _ in moves)
+        finally:
+            search_index.close()
+    if Manifest.exists(project_folder):
+        manifest = Manifest(project_folder)
+        try:
+            manifest.remove(old for old, _ in moves)
+        finally:
+            manifest.close()
+    if Mirror.exists(project_folder):
+        mirror = Mirror(project_folder)
+        try:
+            mirror.forget(os.path.abspath(new) for _, new in moves)
+        finally:
+            mirror.close()
+
+
+def _inside_folder(path, folder):
+    try:
+        folder = os.path.abspath(folder)
+        return os.path.commonpath([os.path.abspath(path), folder]) == folder
+    except ValueError:
+        # Разные диски в Windows
+        return False
+
+
+def undo_run(project_folder, run=None, log_callback=None):
+    """
+    Отменяет запуск обработки (journal.undo) и обновляет служебные данные
+    проекта: файлы, вернувшиеся в папки проекта, получают в каталоге,
+    поисковом индексе, манифесте и зеркале новые пути, а вернувшиеся
+    в папку output убираются из них.
+
+    Returns:
+        dict: {"run", "restored", "failed", "relocated", "forgotten"}
+    """
+    result = undo(project_folder, run, move=safe_move_file, log_callback=log_callback)
+    relocated, forgotten = [], []
+    for old, new in result.pop("moves"):
+        (relocated if _inside_folder(new, project_folder) else forgotten).append((old, new))
+    catalog = Catalog(project_folder) if Catalog.exists(project_folder) else None
+    try:
+        _relocate_indexes(project_folder, relocated, catalog)
+        _forget_indexes(project_folder, forgotten, catalog)
+    finally:
+        if catalog is not None:
+            catalog.close()
+    result.update(relocated=len(relocated), forgotten=len(forgotten))
+    return result
+
+def _merge_prompt_folder(folder, target, prompt, journal, relocated):
+    # Переносит файлы папки промпта в папку группы; пустая папка удаляется
+    folder_cache.ensure_folder(target)
+    if not folder_cache.exists(os.path.join(target, "prompt.txt")):
+        folder_cache.write_text(target, "prompt.txt", prompt_file_content(*prompt))
+    moved = failed = 0
+    with os.scandir(folder) as entries:
+        files = [entry.path for entry in entries if entry.is_file() and entry.name != "prompt.txt"]
+    for source_path in files:
+        destination_path = reserve_destination(os.path.join(target, os.path.basename(source_path)))
+        journal.planned(source_path, destination_path, "moved_to_prompt_folder")
+        result = move_to_destination(source_path, destination_path, "moved_to_prompt_folder")
+        result.setdefault("source", source_path)
+        journal.completed(source_path, result)
+        if result["status"] == "error":
+            failed += 1
+        else:
+            moved += 1
+            relocated.append((source_path, result["destination"]))
+    _remove_empty_folders(folder, os.path.dirname(folder), journal)
+    return moved, failed
+
+def group_prompt_folders(project_folder, log_callback=None, dry_run=False, threshold=None):
+    """
+    Однократная группировка уже упорядоченного проекта: папки похожих промптов
+    внутри одной родительской папки (при раскладке по умолчанию - папки даты)
+    объединяются в папку группы (первого по порядку имён похожего промпта),
+    а индекс групп заполняется для режима group_prompts.
+    Перемещения записываются в журнал и отменяются командой undo.
+
+    Args:
+        dry_run: только посчитать и вывести в журнал, какие папки будут объединены
+        threshold: минимальное сходство промптов (по умолчанию prompt_groups.DEFAULT_THRESHOLD)
+
+    Returns:
+        dict: {"folders", "groups", "merged", "moved", "failed"}
+    """
+    options = {} if threshold is None else {"threshold": threshold}
+    prompt_groups = PromptGroups(project_folder, dry_run=dry_run, **options)
+    journal = None
+    if not dry_run:
+        journal = MoveJournal(project_folder)
+        journal.begin()
+    counts = dict.fromkeys(("folders", "merged", "moved", "failed"), 0)
+    groups = set()
+    relocated = []
+
+    folders = [folder for folder, _, file_names in _walk_project(project_folder) if "prompt.txt" in file_names]
+    try:
+        for folder in folders:
+            prompt = read_prompt_file(folder)
+            if prompt is None:
+                continue
+            counts["folders"] += 1
+            parent, name = os.path.split(folder)
+            group_name, group_prompt = prompt_groups.assign(*prompt, name)
+            groups.add((parent, group_name))
+            if group_name == name:
+                continue
+            counts["merged"] += 1
+            target = os.path.join(parent, group_name)
+            if log_callback:
+                log_callback(f"Папка {folder} объединяется с {target}")
+            if not dry_run:
+                moved, failed = _merge_prompt_folder(folder, target, group_prompt, journal, relocated)
+                counts["moved"] += moved
+                counts["failed"] += failed
+    finally:
+        prompt_groups.close()
+        if journal is not None:
+            journal.close()
+        _relocate_indexes(project_folder, relocated)
+    counts["groups"] = len(groups)
+    if log_callback:
+        log_callback(
+            f"Папок промптов: {counts['folders']}, групп: {counts['groups']}, "
+            f"объединено папок: {counts['merged']}, перемещено файлов: {counts['moved']}"
+        )
+    return counts
+
+# Временное имя папки, цель которой при переносе ещё занята другой переносимой папкой
+RELAYOUT_TEMP_SUFFIX = ".sd_organizer_relayout"
+
+def plan_relayout(project_folder, layout, current_layout=None, catalog=None):
+    """
+    Планирует перенос упорядоченного дерева проекта в раскладку layout без
+    чтения изображений: поля берутся из пути папки (по текущей раскладке),
+    из prompt.txt или, если его нет, из каталога. Время изменения файлов
+    читается, только если новой раскладке нужна дата, которой нет в пути.
+
+    Returns:
+        dict: {"folders": {папка: целевая папка} - папки, которые переносятся целиком,
+               "files": {файл: целевая папка} - папки, которые приходится разделить,
+               "images": {папка: [файлы]}, "prompts": {целевая папка: (pos, neg, model)}}
+    """
+    current_layout = current_layout or load_layout(project_folder)
+    catalog_prompts = None
+    plan = {"folders": {}, "files": {}, "images": {}, "prompts": {}}
+    for folder, folder_names, file_names in _walk_project(project_folder):
+        if folder == project_folder:
+            continue
+        if "prompt.txt" in file_names:
+            prompt = read_prompt_file(folder)
+        elif catalog is not None and file_names:
+            if catalog_prompts is None:
+                catalog_prompts = catalog.prompts_by_folder()
+            prompt = catalog_prompts.get(os.path.abspath(folder))
+        else:
+            prompt = None
+        if prompt is None:
+            continue
+
+        fields = current_layout.parse(os.path.relpath(folder, project_folder)) or {}
+        fields["model"] = prompt[2]
+        fields.setdefault("prompt", os.path.basename(folder))
+        images = [os.path.join(folder, name) for name in sorted(file_names) if name != "prompt.txt"]
+        targets = None
+        if layout.fields - fields.keys():
+            # Даты в пути нет - берём её у каждого файла
+            targets = {}
+            for path in images:
+                try:
+                    targets[path] = layout_folder(project_folder, layout,
+                                                  dict(fields, **date_fields(get_file_date(path))))
+                except OSError:
+                    continue
+            if len(set(targets.values())) == 1 and not folder_names:
+                target, targets = next(iter(targets.values())), None
+        else:
+            target = layout_folder(project_folder, layout, fields)
+            if folder_names:
+                # Вложенные папки не должны переехать вместе с папкой
+                targets = dict.fromkeys(images, target)
+
+        if targets is None:
+            plan["folders"][folder] = target
+            plan["images"][folder] = images
+            plan["prompts"].setdefault(target, prompt)
+        else:
+            plan["files"].update(targets)
+            for target in targets.values():
+                plan["prompts"].setdefault(target, prompt)
+    return plan
+
+def _relayout_operations(plan):
+    """
+    Превращает план в операции: одно переименование папки на каждую целевую
+    папку, а перемещения отдельных файлов - только для папок, которые
+    объединяются с другими или разделяются.
+
+    Returns:
+        tuple: ([(папка, целевая папка, цель пока занята другой переносимой папкой)],
+                [(файл, целевая папка)], число папок без изменений)
+    """
+    sources = {folder for folder, target in plan["folders"].items() if folder != target}
+    by_target = {}
+    unchanged = 0
+    for folder, target in sorted(plan["folders"].items()):
+        if folder == target:
+            unchanged += 1
+        else:
+            by_target.setdefault(target, []).append(folder)
+    renames, moves = [], []
+    for target, folders in by_target.items():
+        head = folders[0]
+        nested = target.startswith(head + os.sep) or head.startswith(target + os.sep)
+        exists = os.path.exists(target)
+        if nested or (exists and target not in sources):
+            merged = folders
+        else:
+            renames.append((head, target, exists))
+            merged = folders[1:]
+        for folder in merged:
+            moves.extend((path, target) for path in plan["images"][folder])
+    moves.extend(sorted(plan["files"].items()))
+    return renames, moves, unchanged
+
+def _relayout_move(path, target, prompt, journal, relocated, original=None):
+    # Перемещает один файл в целевую папку; original - путь файла до переноса (для журнала)
+    original = original or path
+    folder_cache.ensure_folder(target)
+    if not folder_cache.exists(os.path.join(target, "prompt.txt")):
+        folder_cache.write_text(target, "prompt.txt", prompt_file_content(*prompt))
+    destination_path = reserve_destination(os.path.join(target, os.path.basename(path)))
+    journal.planned(original, destination_path, "moved_to_prompt_folder")
+    result = move_to_destination(path, destination_path, "moved_to_prompt_folder")
+    journal.completed(original, result)
+    if result["status"] == "error":
+        return result["message"]
+    relocated.append((original, result["destination"]))
+    return None
+
+def _relayout_rename(original, current, target, prompt, journal, relocated):
+    # Переименовывает папку целиком; если цель уже есть или переименовать нельзя -
+    # переносит файлы по одному. Возвращает (перенесено файлов, ошибки)
+    with os.scandir(current) as entries:
+        entries = list(entries)
+    names = [entry.name for entry in entries]
+    if not os.path.exists(target) and not any(entry.is_dir(follow_symlinks=False) for entry in entries):
+        # Одна запись журнала на папку: отмена переименует её обратно
+        journal.planned(original, target, "folder_renamed")
+        try:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.rename(current, target)
+        except OSError:
+            pass
+        else:
+            folder_cache.invalidate(current)
+            folder_cache.invalidate(target)
+            journal.completed(original, {"status": "folder_renamed", "destination": target})
+            relocated.extend((os.path.join(original, name), os.path.join(target, name)) for name in names)
+            return len(names), []
+    errors = []
+    for entry in entries:
+        # Символические ссылки зеркального режима переносятся вместе с файлами
+        if entry.name != "prompt.txt" and entry.is_file():
+            error = _relayout_move(entry.path, target, prompt, journal, relocated,
+                                   os.path.join(original, entry.name))
+            if error:
+                errors.append(error)
+    return 0, errors
+
+def relayout_project(project_folder, template, dry_run=False, log_callback=None, operation_callback=None,
+                     use_catalog=True):
+    """
+    Переносит упорядоченное дерево проекта в раскладку по шаблону template
+    (см. layout.Layout) и сохраняет шаблон: следующие запуски раскладывают
+    новые файлы так же.
+
+    Папка, которая целиком переходит в новую папку, переименовывается одним
+    вызовом; отдельные файлы перемещаются только там, где папки объединяются
+    или разделяются. Перемещения записываются в журнал и отменяются командой
+    undo, пути в каталоге и поисковом индексе обновляются.
+
+    Args:
+        dry_run: только составить план (operation_callback получает все операции)
+        operation_callback: функция (операция, откуда, куда); операция - "rename"
+            (папка целиком) или "move" (файл в папку)
+
+    Returns:
+        dict: {"folders", "unchanged", "renamed", "moved", "renamed_files", "failed", "plan_s", "apply_s"}
+    """
+    layout = Layout(template)
+    catalog = Catalog(project_folder) if use_catalog else None
+    try:
+        start = time.perf_counter()
+        plan = plan_relayout(project_folder, layout, catalog=catalog)
+        renames, moves, unchanged = _relayout_operations(plan)
+        counts = {
+            "folders": len(plan["folders"]) + len({os.path.dirname(path) for path in plan["files"]}),
+            "unchanged": unchanged, "renamed": len(renames), "moved": len(moves),
+            "renamed_files": 0, "failed": 0, "plan_s": round(time.perf_counter() - start, 3),
+        }
+        if operation_callback:
+            for folder, target, _ in renames:
+                operation_callback("rename", folder, target)
+            for path, target in moves:
+                operation_callback("move", path, target)
+        if dry_run:
+            return counts
+
+        start = time.perf_counter()
+        journal = MoveJournal(project_folder)
+        journal.begin()
+        relocated = []
+        errors = []
+        staged = []
+        try:
+            # Цель занята папкой, которая сама переносится: сначала временное имя
+            for folder, target, blocked in renames:
+                if blocked:
+                    temp = folder + RELAYOUT_TEMP_SUFFIX
+                    try:
+                        os.rename(folder, temp)
+                        folder_cache.invalidate(folder)
+                    except OSError:
+                        temp = folder
+                    staged.append((folder, temp, target))
+            for folder, target, blocked in renames:
+                if not blocked:
+                    carried, failed = _relayout_rename(folder, folder, target, plan["prompts"][target],
+                                                       journal, relocated)
+                    counts["renamed_files"] += carried
+                    errors.extend(failed)
+            for path, target in moves:
+                error = _relayout_move(path, target, plan["prompts"][target], journal, relocated)
+                if error:
+                    errors.append(error)
+            for folder in sorted(set(plan["folders"]) | {os.path.dirname(path) for path in plan["files"]},
+                                 reverse=True):
+                _remove_empty_folders(folder, project_folder, journal)
+            for folder, temp, target in staged:
+                carried, failed = _relayout_rename(folder, temp, target, plan["prompts"][target],
+                                                   journal, relocated)
+                counts["renamed_files"] += carried
+                errors.extend(failed)
+                _remove_empty_folders(temp, project_folder, journal)
+                _remove_empty_folders(folder, project_folder, journal)
+        finally:
+            journal.close()
+            _relocate_indexes(project_folder, relocated, catalog)
+        save_layout(project_folder, layout)
+        counts["failed"] = len(errors)
+        counts["apply_s"] = round(time.perf_counter() - start, 3)
+    finally:
+        if catalog is not None:
+            catalog.close()
+
+    if log_callback:
+        for error in errors:
+            log_callback(error)
+        log_callback(
+            f"Раскладка {layout.template}: папок переименовано {counts['renamed']} "
+            f"({counts['renamed_files']} файлов), файлов перемещено {counts['moved']}, ошибок {counts['failed']}"
+        )
+    return counts
 
 class OutputFolderHandler(FileSystemEventHandler):
+    """
+    Обработчик событий папки output.
+
+    События только ставятся в DebouncedEventQueue, поэтому поток наблюдателя
+    не блокируется. Файл обрабатывается пулом потоков, когда его размер
+    и время изменения перестали меняться.
+    """
 
-    def __init__(self, project_folder, log_callback):
+    def __init__(self, project_folder, log_callback, use_catalog=True, duplicate_policy="skip",
+                 workers=2, check_interval=0.2, result_callback=None, use_journal=True,
+                 output_folder=None, use_search_index=True, group_prompts=False, use_manifest=True,
+                 recompressor=None, mirror=False, mirror_fallback="symlink"):
         self.project_folder = project_folder
         self.log = log_callback
+        self.result_callback = result_callback
+        self.catalog = Catalog(project_folder) if use_catalog else None
+        self.journal = None
+        if use_journal:
+            self.journal = MoveJournal(project_folder)
+            self.journal.begin()
+        self.search_index = SearchIndex(project_folder) if use_search_index else None
+        self.prompt_groups = PromptGroups(project_folder) if group_prompts else None
+        self.manifest = Manifest(project_folder) if use_manifest else None
+        self.mirror = Mirror(project_folder, mirror_fallback, copy=move_engine.copy) if mirror else None
+        # Сжатие PNG принадлежит вызывающему: он же его и закрывает
+        self.recompressor = recompressor
+        self.layout = load_layout(project_folder)
+        # Снимок дерева output: папки с событиями перечитаются при следующем запуске
+        self.snapshot = DirectorySnapshot(project_folder, output_folder) if output_folder else None
+        self.duplicates = DuplicateIndex(duplicate_policy)
+        self.events = DebouncedEventQueue(
+            self._process, workers=workers, check_interval=check_interval, on_result=self._on_result
+        )
+        self.events.start()
+
+    def close(self):
+        self.events.stop()
+        if self.catalog is not None:
+            self.catalog.close()
+            self.catalog = None
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+        if self.snapshot is not None:
+            self.snapshot.save()
+            self.snapshot = None
+        if self.search_index is not None:
+            self.search_index.close()
+            self.search_index = None
+        if self.prompt_groups is not None:
+            self.prompt_groups.close()
+            self.prompt_groups = None
+        if self.manifest is not None:
+            self.manifest.close()
+            self.manifest = None
+        if self.mirror is not None:
+            self.mirror.close()
+            self.mirror = None
+
+    def metrics(self):
+        return self.events.metrics()
+
+    def _process(self, path):
+        if self.recompressor is not None:
+            self.recompressor.pause()
+        try:
+            return self._process_file(path)
+        finally:
+            if self.recompressor is not None:
+                self.recompressor.resume()
+
+    def _process_file(self, path):
+        return process_file(path, self.project_folder, self.catalog, self.duplicates, self.journal,
+                            self.search_index, self.prompt_groups, self.layout, self.manifest, self.mirror)
+
+    def _on_result(self, path, result):
+        log_result(self.log, result)
+        recompress_result(self.recompressor, result)
+        if self.result_callback is not None:
+            self.result_callback(result)
+        # Пока новых файлов нет, сразу фиксируем накопленные записи каталога и журнала
+        if self.events.is_idle():
+            if self.catalog is not None:
+                self.catalog.flush()
+            if self.journal is not None:
+                self.journal.sync()
+            if self.search_index is not None:
+                self.search_index.flush()
+            if self.prompt_groups is not None:
+                self.prompt_groups.flush()
+            if self.manifest is not None:
+                self.manifest.flush()
+            if self.mirror is not None:
+                self.mirror.flush()
+
+    def on_any_event(self, event):
+        snapshot = self.snapshot
+        if snapshot is None:
+            return
+        snapshot.invalidate(os.path.dirname(event.src_path))
+        if event.is_directory:
+            snapshot.invalidate(event.src_path)
+        dest_path = getattr(event, "dest_path", "")
+        if dest_path:
+            snapshot.invalidate(os.path.dirname(dest_path))
 
     def on_created(self, event):
         if not event.is_directory and is_image_file(event.src_path):
             self.log(f"Новый файл обнаружен: {event.src_path}")
-            # Добавляем небольшую задержку, чтобы файл успел освободиться
-            time.sleep(0.5)
-            result = process_file(event.src_path, self.project_folder)
-            if result["status"] == "moved_to_root":
-                self.log(f"Перемещён в корневую папку: {result['destination']}")
-            elif result["status"] == "moved_to_prompt_folder":
-                self.log(f"Перемещён в папку промпта: {result['destination']}")
-            elif result["status"] == "error":
-                self.log(result["message"])
+            self.events.push(event.src_path)
+
+    def on_modified(self, event):
+        if not event.is_directory and is_image_file(event.src_path):
+            self.events.push(event.src_path)
+
+    def on_closed(self, event):
+        if not event.is_directory and is_image_file(event.src_path):
+            self.events.push(event.src_path, closed=True)
+
+    def on_deleted(self, event):
+        self._unmirror(event.src_path, event.is_directory)
+
+    def _unmirror(self, path, is_directory=False):
+        # В зеркальном режиме удаление файла из output убирает и его ссылку из проекта
+        mirror = self.mirror
+        if mirror is None:
+            return
+        if is_directory:
+            rows = mirror.rows(path)
+        else:
+            row = mirror.lookup(path)
+            rows = [row] if row is not None else []
+        if rows:
+            self.events.discard(path)
+            removed = unmirror(mirror, rows, self.project_folder, self.search_index)
+            if removed:
+                self.log(f"Источник удалён, ссылок убрано из проекта: {removed}")
+
+    def on_moved(self, event):
+        self._unmirror(event.src_path, event.is_directory)
+        if event.is_directory:
+            return
+        self.events.discard(event.src_path)
+        if is_image_file(event.dest_path):
+            self.log(f"Новый файл обнаружен: {event.dest_path}")
+            self.events.push(event.dest_path)
 
 def check_disk_space(path, required_space_mb=100):
     """
@@ -344,23 +1604,7 @@ def safe_move_file(source, destination):
     """
     Безопасное перемещение файла с повторными попытками
     """
-    max_attempts = 3
-    for attempt in range(max_attempts):
-        try:
-            # Сначала пробуем просто переместить
-            shutil.move(source, destination)
-            return True
-        except PermissionError:
-            try:
-                # Если не получается, пробуем копировать и удалить
-                shutil.copy2(source, destination)
-                os.remove(source)
-                return True
-            except Exception:
-                if attempt == max_attempts - 1:
-                    raise
-                time.sleep(1)
-    return False
+    return move_engine.move(source, destination)
 
 def create_folder_name(pos_prompt, neg_prompt, model):
     """
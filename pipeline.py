@@ -0,0 +1,164 @@
+import queue
+import threading
+from collections import namedtuple
+
+
+# Настройки одной стадии конвейера:
+#   workers    - количество параллельных обработчиков
+#   processes  - выполнять функцию стадии в пуле процессов вместо потоков
+#   queue_size - размер входной очереди стадии (ограничивает потребление памяти)
+StageConfig = namedtuple("StageConfig", ["workers", "processes", "queue_size"])
+StageConfig.__new__.__defaults__ = (1, False, 256)
+
+_SENTINEL = object()
+
+
+class Stage:
+    """
+    Стадия конвейера: функция, которая получает задачу и возвращает её дальше
+    """
+
+    def __init__(self, name, func, config=None):
+        self.name = name
+        self.func = func
+        self.config = config or StageConfig()
+
+
+class Pipeline:
+    """
+    Многостадийный конвейер с ограниченными очередями между стадиями.
+
+    Источник (producer) выдаёт задачи в очередь первой стадии, каждая стадия
+    обрабатывает задачи своим пулом потоков (или процессов) и передаёт их
+    в очередь следующей. Готовые задачи выдаются итератором run(). Задача-словарь
+    с ключом "error" (ошибка стадии или источника) проходит оставшиеся стадии
+    без изменений.
+    """
+
+    def __init__(self, producer, stages):
+        self.producer = producer
+        self.stages = list(stages)
+        self._stop = threading.Event()
+
+    def _put(self, q, item):
+        # Кладём в очередь с таймаутом, чтобы не зависнуть при остановке
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _produce(self, out_queue, workers):
+        try:
+            for item in self.producer():
+                if not self._put(out_queue, item):
+                    return
+        except Exception as e:
+            self._put(out_queue, {"error": e})
+        finally:
+            for _ in range(workers):
+                self._put(out_queue, _SENTINEL)
+
+    def _work(self, stage, executor, in_queue, out_queue, state):
+        while True:
+            try:
+                item = in_queue.get(timeout=0.1)
+            except queue.Empty:
+                if self._stop.is_set():
+                    return
+                continue
+            if item is _SENTINEL:
+                break
+            if self._stop.is_set():
+                return
+            if isinstance(item, dict) and "error" in item:
+                # Задача с ошибкой (в том числе ошибка источника без "source")
+                # проходит дальше без изменений, чтобы ошибка не подменилась
+                self._put(out_queue, item)
+                continue
+            try:
+                if executor is not None:
+                    item = executor.submit(stage.func, item).result()
+                else:
+                    item = stage.func(item)
+            except Exception as e:
+                item = dict(item, error=e) if isinstance(item, dict) else {"error": e}
+            self._put(out_queue, item)
+
+        # Последний завершившийся обработчик передаёт сигнал завершения дальше
+        with state["lock"]:
+            state["alive"] -= 1
+            last = state["alive"] == 0
+        if last:
+            for _ in range(state["next_workers"]):
+                self._put(out_queue, _SENTINEL)
+
+    def run(self):
+        queues = [queue.Queue(maxsize=max(1, s.config.queue_size)) for s in self.stages]
+        results = queue.Queue(maxsize=max(1, self.stages[-1].config.queue_size))
+        queues.append(results)
+
+        executors = []
+        threads = []
+        try:
+            for index, stage in enumerate(self.stages):
+                executor = None
+                if stage.config.processes:
+                    # Пул процессов загружаем только когда он действительно нужен
+                    from concurrent.futures import ProcessPoolExecutor
+
+                    executor = ProcessPoolExecutor(max_workers=stage.config.workers)
+                    executors.append(executor)
+
+                next_workers = (
+                    self.stages[index + 1].config.workers
+                    if index + 1 < len(self.stages) else 1
+                )
+                state = {
+                    "lock": threading.Lock(),
+                    "alive": stage.config.workers,
+                    "next_workers": next_workers,
+                }
+                for number in range(stage.config.workers):
+                    thread = threading.Thread(
+                        target=self._work,
+                        args=(stage, executor, queues[index], queues[index + 1], state),
+                        name=f"{stage.name}-{number}",
+                        daemon=True,
+                    )
+                    threads.append(thread)
+                    thread.start()
+
+            producer = threading.Thread(
+                target=self._produce,
+                args=(queues[0], self.stages[0].config.workers),
+                name="scan",
+                daemon=True,
+            )
+            threads.append(producer)
+            producer.start()
+
+            while True:
+                item = results.get()
+                if item is _SENTINEL:
+                    break
+                yield item
+        finally:
+            # Останавливаем все стадии, если потребитель прекратил итерацию
+            self._stop.set()
+            for q in queues:
+                _drain(q)
+            for thread in threads:
+                thread.join(timeout=1)
+            for executor in executors:
+                executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _drain(q):
+    try:
+        while True:
+            q.get_nowait()
+    except queue.Empty:
+        pass
@@ -0,0 +1,323 @@
+import os
+import sys
+import threading
+import time
+import uuid
+
+from watchdog.events import (
+    DirCreatedEvent,
+    DirDeletedEvent,
+    FileCreatedEvent,
+    FileDeletedEvent,
+    FileSystemEventHandler,
+)
+
+
+# Сетевые и виртуальные файловые системы, на которых inotify не видит
+# изменений, сделанных с другой машины (или с хоста для WSL)
+NETWORK_FILESYSTEMS = frozenset([
+    "nfs", "nfs4", "cifs", "smb3", "smbfs", "9p", "afs", "ceph", "glusterfs", "fuse.glusterfs",
+    "fuse.sshfs", "fuse.rclone", "fuse.s3fs", "davfs", "vboxsf", "drvfs",
+])
+
+# Папка, изменённая позже чем за столько секунд до её чтения, перечитывается
+# и при следующем опросе: файл, появившийся в ту же единицу времени, мог
+# не изменить время изменения папки
+RACY_INTERVAL = 2.0
+
+OBSERVER_MODES = ("auto", "native", "polling")
+
+
+def filesystem_type(path):
+    """
+    Тип файловой системы, на которой лежит папка ("remote" для сетевого
+    диска Windows), или None, если его не удалось определить
+    """
+    path = os.path.realpath(path)
+    if sys.platform.startswith("linux"):
+        best_mount, best_type = "", None
+        try:
+            with open("/proc/mounts", encoding="utf-8") as f:
+                lines = f.readlines()
+        except OSError:
+            return None
+        for line in lines:
+            parts = line.split()
+            if len(parts) < 3:
+                continue
+            mount = parts[1].replace("\\040", " ")
+            inside = path == mount or path.startswith(mount.rstrip("/") + "/")
+            if inside and len(mount) >= len(best_mount):
+                best_mount, best_type = mount, parts[2]
+        return best_type
+    if sys.platform == "win32":
+        drive = os.path.splitdrive(path)[0]
+        if drive.startswith("\\\\"):
+            return "remote"
+        import ctypes
+
+        drive_remote = 4
+        if drive and ctypes.windll.kernel32.GetDriveTypeW(drive + "\\") == drive_remote:
+            return "remote"
+    return None
+
+
+def needs_polling(path):
+    """
+    True, если системные события об изменениях в папке заведомо не приходят
+    """
+    fs_type = filesystem_type(path)
+    return fs_type == "remote" or fs_type in NETWORK_FILESYSTEMS
+
+
+class _Folder:
+    __slots__ = ("mtime_ns", "racy", "files", "folders")
+
+    def __init__(self, mtime_ns, racy, files, folders):
+        self.mtime_ns = mtime_ns
+        self.racy = racy
+        self.files = files
+        self.folders = folders
+
+
+class _PolledWatch:
+    """
+    Снимок одного отслеживаемого дерева: для каждой папки хранятся время
+    изменения, имена файлов и вложенных папок
+    """
+
+    def __init__(self, handler, path, recursive):
+        self.handler = handler
+        self.path = os.path.abspath(path)
+        self.is_recursive = recursive
+        self.folders = {}
+        self.files = 0
+
+    def _read(self, path, stat, now):
+        files, folders = set(), set()
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    is_dir = entry.is_dir(follow_symlinks=False)
+                except OSError:
+                    continue
+                (folders if is_dir else files).add(entry.name)
+        racy = now - stat.st_mtime_ns / 1e9 < RACY_INTERVAL
+        return _Folder(stat.st_mtime_ns, racy, files, folders)
+
+    def _forget(self, path):
+        folder = self.folders.pop(path, None)
+        if folder is None:
+            return
+        self.files -= len(folder.files)
+        for name in folder.folders:
+            self._forget(os.path.join(path, name))
+
+    def poll(self, emit=True):
+        """
+        Обходит дерево и возвращает события изменений с прошлого опроса.
+
+        Папка, время изменения которой не изменилось, не перечитывается -
+        обход её вложенных папок идёт по снимку, так что спокойное дерево
+        обходится одним stat на папку. Изменения содержимого уже известных
+        файлов так не видны, но новые файлы проверяются на готовность
+        очередью событий, а перезапись файлов в папке output не происходит.
+        """
+        events = []
+        now = time.time()
+        stack = [self.path]
+        while stack:
+            path = stack.pop()
+            try:
+                stat = os.stat(path)
+            except OSError:
+                # Папка исчезла между опросами; её удаление найдёт родитель
+                self._forget(path)
+                continue
+            previous = self.folders.get(path)
+            if previous is not None and previous.mtime_ns == stat.st_mtime_ns and not previous.racy:
+                folder = previous
+            else:
+                try:
+                    folder = self._read(path, stat, now)
+                except OSError:
+                    self._forget(path)
+                    continue
+                self.folders[path] = folder
+                old_files = previous.files if previous is not None else set()
+                old_folders = previous.folders if previous is not None else set()
+                self.files += len(folder.files) - len(old_files)
+                if emit:
+                    for name in folder.files - old_files:
+                        events.append(FileCreatedEvent(os.path.join(path, name)))
+                    for name in old_files - folder.files:
+                        events.append(FileDeletedEvent(os.path.join(path, name)))
+                    for name in folder.folders - old_folders:
+                        events.append(DirCreatedEvent(os.path.join(path, name)))
+                for name in old_folders - folder.folders:
+                    self._forget(os.path.join(path, name))
+                    if emit:
+                        events.append(DirDeletedEvent(os.path.join(path, name)))
+            if self.is_recursive:
+                stack.extend(os.path.join(path, name) for name in folder.folders)
+        return events
+
+
+class ScandirPollingObserver(threading.Thread):
+    """
+    Наблюдатель, который опрашивает дерево папок вместо системных событий -
+    для сетевых дисков (SMB/NFS), где inotify и ReadDirectoryChangesW
+    не видят изменений с других машин. Совместим с Observer из watchdog:
+    schedule(), start(), stop(), join(), is_alive().
+
+    Интервал опроса подстраивается под активность: после найденных
+    изменений он сбрасывается до min_interval, в затишье растёт до
+    max_interval. Кроме того, опрос занимает не больше max_load времени:
+    если обход дерева длится 0.5 с, следующий начнётся не раньше чем
+    через 0.5 / max_load секунд.
+    """
+
+    def __init__(self, min_interval=0.5, max_interval=5.0, backoff=1.5, max_load=0.1):
+        super().__init__(name="polling-observer", daemon=True)
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.max_load = max_load
+        self.interval = min_interval
+        self.polls = 0
+        self.last_poll_s = 0.0
+        self._watches = []
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def schedule(self, event_handler, path, recursive=False, **kwargs):
+        """
+        Запоминает текущее состояние дерева; события будут только
+        об изменениях после этого вызова
+        """
+        watch = _PolledWatch(event_handler, path, recursive)
+        watch.poll(emit=False)
+        with self._lock:
+            self._watches.append(watch)
+        return watch
+
+    def unschedule(self, watch):
+        with self._lock:
+            self._watches.remove(watch)
+
+    def poll(self):
+        """
+        Один опрос всех деревьев; возвращает количество событий
+        """
+        with self._lock:
+            watches = list(self._watches)
+        count = 0
+        for watch in watches:
+            for event in watch.poll():
+                count += 1
+                try:
+                    watch.handler.dispatch(event)
+                except Exception:
+                    # Ошибка обработчика не должна останавливать наблюдение
+                    pass
+        self.polls += 1
+        return count
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            started = time.perf_counter()
+            count = self.poll()
+            self.last_poll_s = time.perf_counter() - started
+            if count:
+                self.interval = self.min_interval
+            else:
+                self.interval = min(self.max_interval, self.interval * self.backoff)
+            self.interval = max(self.interval, self.last_poll_s / self.max_load)
+
+    def stop(self):
+        self._stopped.set()
+
+    def metrics(self):
+        with self._lock:
+            watches = list(self._watches)
+        return {
+            "mode": "polling",
+            "polls": self.polls,
+            "interval_s": round(self.interval, 3),
+            "last_poll_s": round(self.last_poll_s, 4),
+            "folders": sum(len(watch.folders) for watch in watches),
+            "files": sum(watch.files for watch in watches),
+        }
+
+
+class _ProbeHandler(FileSystemEventHandler):
+    def __init__(self, probe_path):
+        self.probe_path = probe_path
+        self.seen = threading.Event()
+
+    def on_any_event(self, event):
+        if event.src_path == self.probe_path:
+            self.seen.set()
+
+
+def _native_events_arrive(observer, path, timeout):
+    """
+    Создаёт в папке пробный файл и ждёт от наблюдателя события о нём.
+    Если файл создать нельзя, считаем, что события приходят.
+    """
+    probe_path = os.path.join(os.path.abspath(path), f".sd_organizer_probe_{uuid.uuid4().hex}")
+    handler = _ProbeHandler(probe_path)
+    watch = observer.schedule(handler, path, recursive=False)
+    try:
+        try:
+            with open(probe_path, "w"):
+                pass
+        except OSError:
+            return True
+        return handler.seen.wait(timeout)
+    finally:
+        observer.unschedule(watch)
+        try:
+            os.remove(probe_path)
+        except OSError:
+            pass
+
+
+def start_observer(event_handler, path, mode="auto", log_callback=None, probe_timeout=2.0):
+    """
+    Запускает наблюдение за папкой (рекурсивно) и возвращает наблюдатель.
+
+    mode="native" - системные события (watchdog Observer), "polling" -
+    опрос папок (ScandirPollingObserver), "auto" - системные события,
+    если они работают: опрос выбирается для сетевых файловых систем,
+    при ошибке запуска (например, исчерпан лимит inotify) и если
+    на пробный файл не пришло событие за probe_timeout секунд.
+    """
+    from watchdog.observers import Observer
+
+    log = log_callback or (lambda message: None)
+    if mode not in OBSERVER_MODES:
+        raise ValueError(f"Неизвестный режим наблюдения: {mode!r}")
+    if mode == "auto" and needs_polling(path):
+        log(f"Папка '{path}' на сетевой файловой системе: включаем опрос папок")
+        mode = "polling"
+    if mode != "polling":
+        observer = Observer()
+        try:
+            observer.schedule(event_handler, path, recursive=True)
+            observer.start()
+        except OSError as e:
+            if mode == "native":
+                raise
+            observer.stop()
+            log(f"Системные события недоступны ({e}): включаем опрос папок")
+        else:
+            if mode == "native" or _native_events_arrive(observer, path, probe_timeout):
+                return observer
+            log("Системные события о новых файлах не приходят: включаем опрос папок")
+            observer.stop()
+            observer.join()
+    observer = ScandirPollingObserver()
+    observer.schedule(event_handler, path, recursive=True)
+    observer.start()
+    return observer
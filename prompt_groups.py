@@ -0,0 +1,239 @@
+import hashlib
+import operator
+import os
+import re
+import sqlite3
+import struct
+import threading
+import time
+from collections import OrderedDict
+
+from catalog import get_data_folder
+
+
+GROUPS_FILE_NAME = "prompt_groups.sqlite"
+
+# Длина подписи MinHash и её разбиение на полосы для LSH: промпты попадают
+# в кандидаты, если совпала хотя бы одна полоса из BANDS значений по ROWS.
+# При 16 x 4 кандидатом почти наверняка станет промпт со сходством от 0.7,
+# и редко - со сходством ниже 0.3.
+# Подпись строится одной хеш-функцией (one permutation hashing): хеш слова
+# выбирает ячейку подписи и значение в ней, пустые ячейки заполняются
+# из соседних (densification). Это в NUM_PERM раз меньше хеширования,
+# чем у классического MinHash, при той же оценке сходства
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+
+DEFAULT_THRESHOLD = 0.7
+
+_WORD = re.compile(r"\w+")
+_BIN_BITS = NUM_PERM.bit_length() - 1
+# Сдвиг значения, взятого из соседней ячейки, чтобы оно не совпало с собственным
+_BORROWED = 1 << (64 - _BIN_BITS)
+_SIGNATURE = struct.Struct(f"<{NUM_PERM}Q")
+_BAND = struct.Struct(f"<{ROWS}Q")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS groups (
+    id INTEGER PRIMARY KEY,
+    folder_name TEXT NOT NULL,
+    model TEXT NOT NULL,
+    prompt TEXT NOT NULL,
+    negative_prompt TEXT NOT NULL,
+    signature BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS bands (
+    key INTEGER NOT NULL,
+    group_id INTEGER NOT NULL,
+    PRIMARY KEY (key, group_id)
+) WITHOUT ROWID;
+"""
+
+
+def shingles(prompt):
+    """
+    Множество слов промпта и пар соседних слов (регистр не учитывается)
+    """
+    tokens = _WORD.findall(prompt.lower())
+    result = set(tokens)
+    result.update(f"{first} {second}" for first, second in zip(tokens, tokens[1:]))
+    return result
+
+
+def similarity(first, second):
+    """
+    Оценка коэффициента Жаккара по двум подписям MinHash
+    """
+    return sum(map(operator.eq, first, second)) / NUM_PERM
+
+
+def band_keys(signature, model):
+    """
+    Ключи полос подписи. Модель входит в ключ, поэтому промпты разных
+    моделей никогда не попадают в одну группу.
+    """
+    model = model.encode("utf-8") + b"\0"
+    keys = []
+    for band in range(BANDS):
+        values = _BAND.pack(*signature[band * ROWS:(band + 1) * ROWS])
+        digest = hashlib.blake2b(model + values, digest_size=8, person=band.to_bytes(16, "little"))
+        keys.append(int.from_bytes(digest.digest(), "little", signed=True))
+    return keys
+
+
+class PromptGroups:
+    """
+    Группировка похожих промптов (MinHash/LSH) для режима, в котором новый
+    промпт попадает в папку уже известного похожего промпта.
+
+    Для каждой группы хранятся имя её папки, первый промпт (он же пишется
+    в prompt.txt) и подпись MinHash по словам и парам слов положительного
+    промпта. Поиск кандидатов идёт по индексу полос подписи, поэтому
+    время поиска не растёт с числом групп; кандидаты проверяются оценкой
+    сходства по подписи (threshold). Отрицательный промпт в сравнении
+    не участвует, модель должна совпадать.
+
+    Новые группы записываются пакетами, как в Catalog; до фиксации их
+    видит то же соединение, так что промпты одного запуска тоже группируются.
+    """
+
+    def __init__(self, project_folder, threshold=DEFAULT_THRESHOLD, batch_size=500, flush_interval=2.0,
+                 memory_items=10000, dry_run=False):
+        self.path = os.path.join(get_data_folder(project_folder), GROUPS_FILE_NAME)
+        self.threshold = threshold
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.memory_items = memory_items
+        # Пробный запуск: группы видны до закрытия, но в файл не сохраняются
+        self.dry_run = dry_run
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._last_flush = time.monotonic()
+        # Последние промпты и их группы, а также хеши слов и пар слов
+        self._assigned = OrderedDict()
+        self._hashes = {}
+        self.created = 0
+        self.joined = 0
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript(_SCHEMA)
+
+    def _hash(self, shingle):
+        value = self._hashes.get(shingle)
+        if value is None:
+            value = int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "little")
+            if len(self._hashes) >= 10 * self.memory_items:
+                self._hashes.clear()
+            self._hashes[shingle] = value
+        return value
+
+    def signature(self, prompt):
+        """
+        Подпись MinHash промпта или None, если в нём нет слов
+        """
+        bins = [None] * NUM_PERM
+        for shingle in shingles(prompt):
+            value = self._hash(shingle)
+            index, value = value & (NUM_PERM - 1), value >> _BIN_BITS
+            current = bins[index]
+            if current is None or value < current:
+                bins[index] = value
+        filled = [index for index, value in enumerate(bins) if value is not None]
+        if not filled:
+            return None
+        # Пустая ячейка берёт значение ближайшей заполненной справа (по кругу)
+        signature = list(bins)
+        for position, index in enumerate(filled):
+            previous = filled[position - 1]
+            empty = (index - previous - 1) % NUM_PERM if len(filled) > 1 else NUM_PERM - 1
+            for distance in range(1, empty + 1):
+                signature[(index - distance) % NUM_PERM] = bins[index] + distance * _BORROWED
+        return tuple(signature)
+
+    def _remember(self, key, group):
+        self._assigned[key] = group
+        if len(self._assigned) > self.memory_items:
+            self._assigned.popitem(last=False)
+
+    def _best_match(self, signature, keys):
+        placeholders = ", ".join("?" for _ in keys)
+        rows = self._connection.execute(
+            f"SELECT id, folder_name, prompt, negative_prompt, model, signature FROM groups "
+            f"WHERE id IN (SELECT group_id FROM bands WHERE key IN ({placeholders}))",
+            keys,
+        ).fetchall()
+        best, best_rank = None, None
+        for group_id, folder_name, prompt, negative_prompt, model, blob in rows:
+            score = similarity(signature, _SIGNATURE.unpack(blob))
+            # Самая похожая группа, при равенстве - более ранняя
+            if score >= self.threshold and (best is None or (score, -group_id) > best_rank):
+                best, best_rank = (group_id, folder_name, (prompt, negative_prompt, model)), (score, -group_id)
+        return best
+
+    def assign(self, pos_prompt, neg_prompt, model, folder_name):
+        """
+        Находит группу похожего промпта или создаёт новую с папкой folder_name.
+
+        Returns:
+            tuple: (имя папки группы, (pos, neg, model) промпта группы для prompt.txt)
+        """
+        key = (pos_prompt, model)
+        with self._lock:
+            group = self._assigned.get(key)
+            if group is not None:
+                self._assigned.move_to_end(key)
+                return group[1], group[2]
+
+            signature = self.signature(pos_prompt)
+            if signature is None:
+                # Промпт без слов сравнивать не с чем
+                return folder_name, (pos_prompt, neg_prompt, model)
+            keys = band_keys(signature, model)
+            group = self._best_match(signature, keys)
+            if group is not None:
+                self.joined += 1
+            else:
+                cursor = self._connection.execute(
+                    "INSERT INTO groups (folder_name, model, prompt, negative_prompt, signature) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (folder_name, model, pos_prompt, neg_prompt, _SIGNATURE.pack(*signature)),
+                )
+                self._connection.executemany(
+                    "INSERT OR IGNORE INTO bands (key, group_id) VALUES (?, ?)",
+                    [(band_key, cursor.lastrowid) for band_key in keys],
+                )
+                group = (cursor.lastrowid, folder_name, (pos_prompt, neg_prompt, model))
+                self.created += 1
+                self._pending += 1
+            self._remember(key, group)
+            due = (
+                self._pending >= self.batch_size
+                or time.monotonic() - self._last_flush >= self.flush_interval
+            )
+        if due:
+            self.flush()
+        return group[1], group[2]
+
+    def count(self):
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM groups").fetchone()[0]
+
+    def flush(self):
+        """
+        Фиксирует новые группы одной транзакцией
+        """
+        with self._lock:
+            self._last_flush = time.monotonic()
+            if self.dry_run or not self._pending:
+                return
+            self._pending = 0
+            self._connection.commit()
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            if self.dry_run:
+                self._connection.rollback()
+            self._connection.close()
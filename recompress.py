@@ -0,0 +1,373 @@
+import os
+import sqlite3
+import struct
+import sys
+import threading
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from catalog import get_data_folder
+
+
+RECOMPRESS_FILE_NAME = "recompressed.sqlite"
+RECOMPRESS_TEMP_SUFFIX = ".recompress.tmp"
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# Размер чанков IDAT в новом файле
+IDAT_CHUNK_SIZE = 1 << 20
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    status TEXT NOT NULL
+);
+"""
+
+
+def _read_chunks(data):
+    """
+    Чанки PNG целиком (длина, тип, данные, CRC) - для копирования без изменений
+    """
+    if not data.startswith(PNG_SIGNATURE):
+        raise ValueError("не PNG")
+    chunks = []
+    position = len(PNG_SIGNATURE)
+    while position < len(data):
+        if position + 8 > len(data):
+            raise ValueError("обрезанный чанк")
+        length, kind = struct.unpack(">I4s", data[position:position + 8])
+        end = position + 12 + length
+        if end > len(data):
+            raise ValueError("обрезанный чанк")
+        chunks.append((kind, data[position:end]))
+        position = end
+        if kind == b"IEND":
+            break
+    if not chunks or chunks[-1][0] != b"IEND" or position != len(data):
+        # Данные после IEND (их дописывают некоторые программы) не трогаем
+        raise ValueError("нет IEND или данные после него")
+    return chunks
+
+
+def _chunk(kind, payload):
+    return struct.pack(">I4s", len(payload), kind) + payload + struct.pack(">I", zlib.crc32(kind + payload))
+
+
+def _payload(chunk):
+    return chunk[8:-4]
+
+
+def recompress_png(data, min_saving=0.01, level=9):
+    """
+    Пережимает PNG без потерь. Все чанки, кроме IDAT (в том числе текст
+    parameters с параметрами генерации), копируются байт в байт; данные
+    изображения распаковываются и сжимаются заново с уровнем level, а
+    фильтры строк остаются прежними, так что пиксели не меняются.
+
+    Returns:
+        bytes: новый файл или None, если выигрыш меньше min_saving от размера
+    """
+    chunks = _read_chunks(data)
+    kinds = [kind for kind, _ in chunks]
+    if b"IDAT" not in kinds:
+        raise ValueError("нет данных изображения")
+    first = kinds.index(b"IDAT")
+    last = len(kinds) - 1 - kinds[::-1].index(b"IDAT")
+    if kinds[first:last + 1].count(b"IDAT") != last - first + 1:
+        raise ValueError("чанки IDAT идут не подряд")
+    stream = b"".join(_payload(chunk) for _, chunk in chunks[first:last + 1])
+    raw = zlib.decompress(stream)
+
+    # Перефильтровать строки заново (как Pillow с optimize) для файлов,
+    # сохранённых Pillow, почти ничего не даёт, а стоит столько же, сколько
+    # само сжатие. Стратегия Z_FILTERED на отфильтрованных строках PNG
+    # обычно немного лучше стандартной
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 15, 9, zlib.Z_FILTERED)
+    best = compressor.compress(raw) + compressor.flush()
+    if len(best) > len(stream) * (1 - min_saving):
+        return None
+    if zlib.decompress(best) != raw:
+        raise ValueError("сжатые данные не совпали с исходными")
+
+    parts = [PNG_SIGNATURE]
+    parts.extend(chunk for _, chunk in chunks[:first])
+    parts.extend(_chunk(b"IDAT", best[offset:offset + IDAT_CHUNK_SIZE])
+                 for offset in range(0, len(best), IDAT_CHUNK_SIZE))
+    parts.extend(chunk for _, chunk in chunks[last + 1:])
+    return b"".join(parts)
+
+
+def _lower_priority():
+    # Рабочие процессы не должны отнимать процессор и диск у упорядочивания.
+    # В Linux приоритет ввода-вывода по умолчанию следует за nice
+    try:
+        if hasattr(os, "nice"):
+            os.nice(19)
+        elif sys.platform == "win32":
+            import ctypes
+
+            process_mode_background_begin = 0x00100000
+            kernel32 = ctypes.windll.kernel32
+            kernel32.SetPriorityClass(kernel32.GetCurrentProcess(), process_mode_background_begin)
+    except OSError:
+        pass
+
+
+def recompress_file(path, min_saving=0.01, level=9):
+    """
+    Пережимает файл и атомарно подменяет его (в рабочем процессе).
+    Время изменения файла сохраняется.
+
+    Returns:
+        dict: {"status": "recompressed" | "kept" | "skipped" | "error", "before", "after",
+               "size", "mtime_ns" (итоговые), "cpu_s", "message"}
+    """
+    started = time.process_time()
+    result = {"path": path, "status": "kept", "before": 0, "after": 0}
+    temp_path = path + RECOMPRESS_TEMP_SUFFIX
+    try:
+        stat = os.stat(path)
+        result["before"] = result["after"] = stat.st_size
+        result["size"], result["mtime_ns"] = stat.st_size, stat.st_mtime_ns
+        if stat.st_nlink > 1:
+            # Замена разорвала бы жёсткую ссылку и удвоила место на диске
+            result["status"] = "skipped"
+            return result
+        with open(path, "rb") as f:
+            data = f.read()
+        try:
+            new_data = recompress_png(data, min_saving, level)
+        except (ValueError, zlib.error) as e:
+            result.update(status="skipped", message=str(e))
+            return result
+        if new_data is None:
+            return result
+        with open(temp_path, "wb") as f:
+            f.write(new_data)
+            # Иначе после сбоя питания на месте оригинала может оказаться пустой файл
+            f.flush()
+            os.fsync(f.fileno())
+        os.utime(temp_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        current = os.stat(path)
+        if (current.st_size, current.st_mtime_ns, current.st_nlink) != (stat.st_size, stat.st_mtime_ns, 1):
+            # Файл изменили, пока он пережимался
+            os.remove(temp_path)
+            result["status"] = "skipped"
+            return result
+        os.replace(temp_path, path)
+        _fsync_directory(os.path.dirname(path))
+        result.update(status="recompressed", after=len(new_data), size=len(new_data))
+    except Exception as e:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        result.update(status="error", message=str(e))
+    finally:
+        result["cpu_s"] = time.process_time() - started
+    return result
+
+
+def _fsync_directory(folder):
+    # Сбрасывает на диск запись о переименовании; в Windows папку открыть нельзя
+    if os.name == "nt":
+        return
+    fd = os.open(folder or ".", os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    except OSError:
+        # Некоторые файловые системы не поддерживают fsync папки
+        pass
+    finally:
+        os.close(fd)
+
+
+class Recompressor:
+    """
+    Фоновое сжатие PNG, уже разложенных по папкам проекта.
+
+    Файлы пережимаются в пуле процессов с пониженным приоритетом. Новые
+    файлы не отдаются в пул, пока идёт упорядочивание (pause/resume), а
+    после каждого файла следующий откладывается так, чтобы в среднем пул
+    занимал не больше cpu_budget процессора на рабочий процесс и читал
+    и писал не больше io_budget байт в секунду.
+
+    Результаты запоминаются в recompressed.sqlite по размеру и времени
+    изменения: пережатые, не давшие выигрыша и пропущенные файлы повторно
+    не читаются.
+    """
+
+    def __init__(self, project_folder, workers=1, cpu_budget=0.25, io_budget=20 * 1024 * 1024,
+                 min_saving=0.01, level=9, log_callback=None, flush_interval=2.0):
+        self.workers = workers
+        self.cpu_budget = cpu_budget
+        self.io_budget = io_budget
+        self.min_saving = min_saving
+        self.level = level
+        self.log = log_callback
+        self.flush_interval = flush_interval
+        self._connection = sqlite3.connect(os.path.join(get_data_folder(project_folder), RECOMPRESS_FILE_NAME),
+                                           check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript(_SCHEMA)
+        self._db_lock = threading.Lock()
+        self._pending_rows = []
+        self._last_flush = time.monotonic()
+
+        self._condition = threading.Condition()
+        self._queue = deque()
+        self._queued = set()
+        self._in_flight = 0
+        self._paused = 0
+        self._resume_at = time.monotonic()
+        self._stopping = False
+        self._started = time.monotonic()
+        self.counts = dict.fromkeys(("files", "recompressed", "kept", "skipped", "failed", "unchanged",
+                                     "bytes_before", "bytes_after"), 0)
+        self._executor = ProcessPoolExecutor(max_workers=workers, initializer=_lower_priority)
+        self._thread = threading.Thread(target=self._dispatch, name="recompress", daemon=True)
+        self._thread.start()
+
+    def pause(self):
+        """
+        Не отдавать новые файлы в пул до resume() (вызовы могут быть вложенными)
+        """
+        with self._condition:
+            self._paused += 1
+
+    def resume(self):
+        with self._condition:
+            self._paused = max(self._paused - 1, 0)
+            self._condition.notify_all()
+
+    def _known(self, path, stat):
+        with self._db_lock:
+            row = self._connection.execute("SELECT size, mtime_ns FROM files WHERE path = ?", (path,)).fetchone()
+            if row is None:
+                row = next((r[1:3] for r in reversed(self._pending_rows) if r[0] == path), None)
+        return row is not None and row == (stat.st_size, stat.st_mtime_ns)
+
+    def submit(self, path):
+        """
+        Ставит PNG в очередь, если он ещё не пережимался
+        """
+        if not path.lower().endswith(".png"):
+            return
+        path = os.path.abspath(path)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return
+        if self._known(path, stat):
+            with self._condition:
+                self.counts["unchanged"] += 1
+            return
+        with self._condition:
+            if self._stopping or path in self._queued:
+                return
+            self._queue.append(path)
+            self._queued.add(path)
+            self._condition.notify_all()
+
+    def _dispatch(self):
+        while True:
+            with self._condition:
+                while True:
+                    if self._stopping and not self._queue and not self._in_flight:
+                        return
+                    delay = self._resume_at - time.monotonic()
+                    ready = self._queue and not self._paused and self._in_flight < self.workers
+                    if ready and delay <= 0:
+                        break
+                    self._condition.wait(max(delay, 0.05) if ready else None)
+                path = self._queue.popleft()
+                self._queued.discard(path)
+                self._in_flight += 1
+            future = self._executor.submit(recompress_file, path, self.min_saving, self.level)
+            future.add_done_callback(self._on_done)
+
+    def _on_done(self, future):
+        try:
+            result = future.result()
+        except Exception as e:
+            result = {"status": "error", "message": str(e), "before": 0, "after": 0, "cpu_s": 0.0}
+        status = result["status"]
+        with self._condition:
+            self._in_flight -= 1
+            self.counts["files"] += 1
+            self.counts["failed" if status == "error" else status] += 1
+            if status in ("recompressed", "kept"):
+                self.counts["bytes_before"] += result["before"]
+                self.counts["bytes_after"] += result["after"]
+            # Долг по бюджету: процессорное время сверх доли cpu_budget
+            # и время чтения и записи файла при скорости io_budget
+            debt = result["cpu_s"] * (1 / self.cpu_budget - 1) / self.workers
+            debt += (result["before"] + result["after"]) / self.io_budget
+            self._resume_at = max(self._resume_at, time.monotonic()) + debt
+            self._condition.notify_all()
+        if status == "error" and self.log:
+            self.log(f"Не удалось пережать {result.get('path')}: {result.get('message')}")
+        if status != "error":
+            # Файл, изменённый во время сжатия, записан с прежними размером
+            # и временем - при следующей встрече он будет пережат заново
+            with self._db_lock:
+                self._pending_rows.append((result["path"], result["size"], result["mtime_ns"], status))
+                due = time.monotonic() - self._last_flush >= self.flush_interval
+            if due:
+                self.flush()
+
+    def flush(self):
+        with self._db_lock:
+            self._last_flush = time.monotonic()
+            if not self._pending_rows:
+                return
+            rows, self._pending_rows = self._pending_rows, []
+            with self._connection:
+                self._connection.executemany(
+                    "INSERT OR REPLACE INTO files (path, size, mtime_ns, status) VALUES (?, ?, ?, ?)", rows
+                )
+
+    def report(self):
+        """
+        Счётчики запуска и сэкономленные байты
+        """
+        with self._condition:
+            report = dict(self.counts)
+            report["queued"] = len(self._queue)
+        report["bytes_saved"] = report["bytes_before"] - report["bytes_after"]
+        report["elapsed_s"] = round(time.monotonic() - self._started, 3)
+        return report
+
+    def close(self, wait=True):
+        """
+        Останавливает сжатие. wait=True - дожидается всей очереди, иначе
+        только файлов, которые уже пережимаются.
+
+        Returns:
+            dict: report()
+        """
+        with self._condition:
+            self._stopping = True
+            if not wait:
+                self._queue.clear()
+                self._queued.clear()
+            # Упорядочивание уже закончено - ждать его незачем
+            self._paused = 0
+            self._condition.notify_all()
+        self._thread.join()
+        self._executor.shutdown(wait=True)
+        self.flush()
+        with self._db_lock:
+            self._connection.close()
+        report = self.report()
+        if self.log and report["files"]:
+            self.log(
+                f"Пережато PNG: {report['recompressed']} из {report['files']}, "
+                f"сэкономлено {report['bytes_saved'] / (1024 * 1024):.1f} МБ"
+            )
+        return report
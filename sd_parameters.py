@@ -0,0 +1,245 @@
+import json
+import re
+from functools import cached_property
+
+
+# Пара "Ключ: значение" в строке настроек A1111. Значение либо в кавычках
+# (может содержать запятые), либо до ближайшей запятой.
+_SETTING = re.compile(r'\s*(\w[\w \-/+.]*):\s*("(?:\\.|[^\\"])*"|[^,]*)(?:,|$)')
+_FAST_SETTING = re.compile(r'\s*([^,:"]+):\s*("[^"]*"|[^,]*),?')
+_CONTROLNET_KEY = re.compile(r"ControlNet(?:[ -](\d+))?(?: (.+))?$")
+_EXTRA_NETWORK = re.compile(r"<(lora|lyco|hypernet):([^:>]+)(?::([^>]*))?>", re.IGNORECASE)
+_EMBEDDING = re.compile(r"\bembedding:([\w.\-]+)")
+
+# Ключи, которые переносятся в запись как отдельные поля с приведением типа
+_TYPED_SETTINGS = {
+    "Steps": ("steps", int),
+    "Sampler": ("sampler", str),
+    "Schedule type": ("scheduler", str),
+    "CFG scale": ("cfg_scale", float),
+    "Seed": ("seed", int),
+    "Model hash": ("model_hash", str),
+    "Model": ("model", str),
+    "VAE": ("vae", str),
+    "Clip skip": ("clip_skip", int),
+    "Denoising strength": ("denoising_strength", float),
+    "Version": ("version", str),
+}
+
+
+_EMPTY_TYPED = dict.fromkeys(field for field, _ in _TYPED_SETTINGS.values())
+
+
+def _unquote(value):
+    if len(value) >= 2 and value[0] == '"' and value[-1] == '"':
+        try:
+            return json.loads(value)
+        except ValueError:
+            return value[1:-1]
+    return value
+
+
+def _convert(value, kind):
+    try:
+        return kind(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _parse_hashes(value):
+    # "name: hash, name2: hash2" -> {"name": "hash", "name2": "hash2"}
+    result = {}
+    for item in value.split(","):
+        name, sep, hash_value = item.rpartition(":")
+        if sep and name.strip():
+            result[name.strip()] = hash_value.strip()
+    return result
+
+
+def parse_settings(line):
+    """
+    Разбирает строку настроек ("Steps: 20, Sampler: ...") за один проход.
+
+    Returns:
+        dict: {ключ: значение} в порядке появления, значения без кавычек
+    """
+    if '\\"' in line:
+        # Экранированные кавычки внутри значений - медленный, но точный путь
+        return {match.group(1): _unquote(match.group(2).strip()) for match in _SETTING.finditer(line)}
+
+    settings = {}
+    for key, value in _FAST_SETTING.findall(line):
+        if value[:1] == '"':
+            value = _unquote(value) if "\\" in value else value[1:-1]
+        else:
+            value = value.rstrip()
+        settings[key.strip()] = value
+    return settings
+
+
+def _split_parameters(text):
+    # Возвращает (позитивный промпт, негативный промпт, строка настроек).
+    # Промпты выделяются так же, как в прежнем разборе: они входят в хеш имени
+    # папки. Маркер "Negative prompt:" важнее "Negative Prompt:", промпт
+    # заканчивается на первом "Steps:", даже если оно внутри текста промпта.
+    negative_start = text.find("Negative prompt:")
+    if negative_start == -1:
+        negative_start = text.find("Negative Prompt:")
+    if negative_start == -1:
+        steps = text.find("Steps:")
+        prompt = text[:steps] if steps != -1 else text
+        negative = ""
+    else:
+        prompt = text[:negative_start]
+        negative = text[negative_start + len("Negative prompt:"):]
+        steps = negative.find("Steps:")
+        if steps != -1:
+            negative = negative[:steps]
+
+    # Строка настроек - последняя строка, начинающаяся со "Steps: "
+    settings_start = text.rfind("\nSteps: ")
+    if settings_start == -1:
+        settings_start = text.find("Steps:")
+    settings_line = text[settings_start:].strip() if settings_start != -1 else ""
+    return prompt.strip(), negative.strip(), settings_line
+
+
+# Модель ищется так же, как в прежнем разборе: она входит в хеш имени папки,
+# и любое расхождение переименовало бы папки уже упорядоченных изображений.
+# (начало, ближайший из концов значения); перед началом не должно быть _MODEL_EXCLUDE
+_MODEL_PATTERNS = (
+    ("Model: ", re.compile(r"Clip skip:|, Clip|ControlNet|Style Selector|Version:|Denoising strength:")),
+    ("Model hash: ", re.compile(r"Model:|Denoising strength:")),
+)
+_MODEL_EXCLUDE = ("ControlNet", "Module:")
+
+
+def find_model(text):
+    """
+    Имя модели (или её хеш) из полного текста генерации, как его находил
+    прежний разбор, или None
+    """
+    model = None
+    for start_marker, end_marker in _MODEL_PATTERNS:
+        start = 0
+        while True:
+            index = text.find(start_marker, start)
+            if index == -1:
+                break
+            before = text[max(0, index - 50):index]
+            if any(word in before for word in _MODEL_EXCLUDE):
+                start = index + 1
+                continue
+            index += len(start_marker)
+            end = end_marker.search(text, index)
+            if end is not None:
+                value = text[index:end.start()].strip()
+                if value:
+                    model = value.rstrip(",")
+                    break
+            start = index
+        if model is not None and model != "unknown":
+            break
+    if model and "," in model:
+        model = model.split(",")[0].strip()
+    if not model or model.isspace() or model == "unknown":
+        return None
+    return model
+
+
+class GenerationParameters:
+    """
+    Текст генерации A1111, разобранный за один проход.
+
+    Промпты и модель выделяются сразу - этого достаточно для сортировки
+    (model - как в прежнем разборе, иногда хеш модели). Полная запись (настройки, LoRA, ControlNet, hires) строится при первом
+    обращении к record и затем кешируется.
+    """
+
+    def __init__(self, text):
+        if text.startswith("Parameters:"):
+            text = text[len("Parameters:"):].strip()
+        self.prompt, self.negative_prompt, self.settings_line = _split_parameters(text)
+        self.model = find_model(text)
+
+    @cached_property
+    def record(self):
+        return _build_record(self.prompt, self.negative_prompt, self.settings_line)
+
+
+def parse_parameters(text):
+    """
+    Разбирает текст генерации A1111 в структурированную запись.
+
+    Returns:
+        dict: prompt, negative_prompt, steps, sampler, cfg_scale, seed, width, height,
+        model_hash, model, loras, textual_inversions, controlnets, hires и прочие
+        настройки в settings. Отсутствующие значения - None.
+    """
+    return GenerationParameters(text).record
+
+
+def _build_record(prompt, negative_prompt, settings_line):
+    settings = parse_settings(settings_line)
+
+    record = {
+        "prompt": prompt,
+        "negative_prompt": negative_prompt,
+        "width": None,
+        "height": None,
+        "loras": {},
+        "textual_inversions": {},
+        "controlnets": [],
+        "hires": {},
+        "settings": settings,
+    }
+    record.update(_EMPTY_TYPED)
+
+    size = settings.get("Size", "")
+    if "x" in size:
+        width, _, height = size.partition("x")
+        record["width"] = _convert(width, int)
+        record["height"] = _convert(height, int)
+
+    # Один проход по настройкам: типизированные поля, hires, ControlNet, хеши сетей
+    controlnets = {}
+    for key, value in settings.items():
+        typed = _TYPED_SETTINGS.get(key)
+        if typed is not None:
+            if value:
+                record[typed[0]] = _convert(value, typed[1])
+        elif key[:5] == "Hires":
+            record["hires"][key[len("Hires "):].strip().lower() or key] = value
+        elif key[:10] == "ControlNet":
+            match = _CONTROLNET_KEY.match(key)
+            if not match:
+                continue
+            unit = controlnets.setdefault(int(match.group(1) or 0), {})
+            if match.group(2):
+                # Старый формат: "ControlNet-0 Module: canny, ControlNet-0 Model: ..."
+                unit[match.group(2).lower()] = value
+            else:
+                # Новый формат: ControlNet 0: "Module: canny, Model: ..., Weight: 1"
+                unit.update({k.lower(): v for k, v in parse_settings(value).items()})
+        elif key == "Lora hashes":
+            record["loras"].update(_parse_hashes(value))
+        elif key == "TI hashes":
+            record["textual_inversions"].update(_parse_hashes(value))
+    record["controlnets"] = [controlnets[index] for index in sorted(controlnets)]
+    if record["hires"] and record["denoising_strength"] is not None:
+        record["hires"]["denoising strength"] = record["denoising_strength"]
+
+    # LoRA и эмбеддинги, упомянутые в самом промпте
+    if "<" in prompt:
+        for kind, name, _ in _EXTRA_NETWORK.findall(prompt):
+            if kind.lower() in ("lora", "lyco"):
+                record["loras"].setdefault(name, None)
+    for part in (prompt, negative_prompt):
+        if "embedding:" in part:
+            for name in _EMBEDDING.findall(part):
+                record["textual_inversions"].setdefault(name, None)
+
+    # Хеш вместо имени - только если имени модели в настройках нет
+    if record["model"] is None:
+        record["model"] = record["model_hash"]
+    return record
@@ -0,0 +1,317 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from catalog import get_data_folder
+
+
+SEARCH_FILE_NAME = "search.sqlite"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    size INTEGER,
+    mtime_ns INTEGER,
+    prompt TEXT,
+    negative_prompt TEXT,
+    model TEXT,
+    model_hash TEXT,
+    sampler TEXT,
+    steps INTEGER,
+    cfg_scale REAL,
+    seed INTEGER,
+    width INTEGER,
+    height INTEGER,
+    loras TEXT,
+    controlnets TEXT,
+    settings TEXT,
+    added_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS images_seed ON images(seed);
+CREATE VIRTUAL TABLE IF NOT EXISTS images_fts USING fts5(
+    prompt, negative_prompt, model, sampler, loras, controlnets, settings,
+    content='images', content_rowid='id', tokenize='unicode61'
+);
+CREATE TRIGGER IF NOT EXISTS images_insert AFTER INSERT ON images BEGIN
+    INSERT INTO images_fts(rowid, prompt, negative_prompt, model, sampler, loras, controlnets, settings)
+    VALUES (new.id, new.prompt, new.negative_prompt, new.model, new.sampler, new.loras, new.controlnets, new.settings);
+END;
+CREATE TRIGGER IF NOT EXISTS images_delete AFTER DELETE ON images BEGIN
+    INSERT INTO images_fts(images_fts, rowid, prompt, negative_prompt, model, sampler, loras, controlnets, settings)
+    VALUES ('delete', old.id, old.prompt, old.negative_prompt, old.model, old.sampler, old.loras,
+            old.controlnets, old.settings);
+END;
+"""
+
+_COLUMNS = (
+    "path", "size", "mtime_ns", "prompt", "negative_prompt", "model", "model_hash", "sampler",
+    "steps", "cfg_scale", "seed", "width", "height", "loras", "controlnets", "settings",
+)
+
+# Поля запроса вида "model:dreamshaper": текстовые ищутся в полнотекстовом индексе,
+# числовые сравниваются на равенство
+_TEXT_FIELDS = {
+    "prompt": "prompt", "neg": "negative_prompt", "negative": "negative_prompt",
+    "model": "model", "sampler": "sampler", "lora": "loras", "controlnet": "controlnets",
+}
+_NUMBER_FIELDS = {"seed": "seed", "steps": "steps", "cfg": "cfg_scale", "width": "width", "height": "height"}
+
+_TOKEN = re.compile(r'(-?)(?:(\w+):)?("[^"]*"|\S+)')
+
+
+def _phrase(text):
+    # Строка запроса пользователя как фраза FTS5 (служебные символы не интерпретируются)
+    prefix = text.endswith("*") and len(text) > 1
+    text = text.rstrip("*") if prefix else text
+    return '"' + text.replace('"', '""') + '"' + ("*" if prefix else "")
+
+
+def parse_query(query):
+    """
+    Разбирает строку поиска в выражение FTS5 и фильтры по числовым полям.
+
+    Слова ищутся во всех полях, "фраза в кавычках" - целиком, слово* - по
+    началу, -слово исключает совпадения, поле:значение ищет в одном поле
+    (prompt, neg, model, sampler, lora, controlnet; seed, steps, cfg, width,
+    height - точное значение).
+
+    Returns:
+        tuple: (выражение MATCH для включения или None,
+                выражение MATCH для исключения или None, [(столбец, значение)])
+    """
+    include, exclude, filters = [], [], []
+    for negate, field, value in _TOKEN.findall(query):
+        value = value.strip('"') if value.startswith('"') else value
+        if not value:
+            continue
+        field = field.lower()
+        if field in _NUMBER_FIELDS:
+            try:
+                filters.append((_NUMBER_FIELDS[field], float(value) if field == "cfg" else int(value)))
+            except ValueError:
+                pass
+            continue
+        if field in _TEXT_FIELDS:
+            term = f"{_TEXT_FIELDS[field]} : {_phrase(value)}"
+        else:
+            term = _phrase(f"{field}:{value}" if field else value)
+        (exclude if negate else include).append(term)
+    match = " AND ".join(include) or None
+    if match and exclude:
+        return f"({match}) NOT ({' OR '.join(exclude)})", None, filters
+    # Только исключения проверяются отдельным подзапросом: FTS5 не ищет по одному NOT
+    return match, (" OR ".join(exclude) or None), filters
+
+
+def row_from_metadata(path, metadata, size=None, mtime_ns=None):
+    """
+    Строка индекса по метаданным (pos, neg, model[, GenerationParameters])
+    """
+    pos_prompt, neg_prompt, model = metadata[:3]
+    row = dict.fromkeys(_COLUMNS)
+    row.update(path=os.path.abspath(path), size=size, mtime_ns=mtime_ns,
+               prompt=None if pos_prompt == "unknown" else pos_prompt,
+               negative_prompt=None if neg_prompt == "unknown" else neg_prompt,
+               model=None if model == "unknown" else model)
+    generation = metadata[3] if len(metadata) > 3 else None
+    if generation is not None:
+        record = generation.record
+        # Имя модели из настроек, а не хеш, по которому иногда называется папка
+        for name in ("model", "model_hash", "sampler", "steps", "cfg_scale", "seed", "width", "height"):
+            row[name] = record.get(name)
+        row["loras"] = " ".join(record["loras"]) or None
+        row["controlnets"] = " ".join(
+            " ".join(filter(None, (unit.get("module"), unit.get("model")))) for unit in record["controlnets"]
+        ) or None
+        row["settings"] = generation.settings_line
+    return tuple(row[name] for name in _COLUMNS)
+
+
+class SearchIndex:
+    """
+    Полнотекстовый индекс упорядоченных изображений (SQLite FTS5) в папке проекта.
+
+    Строки добавляются пакетами, как в Catalog. Поиск возвращает изображения
+    по промптам, модели, сэмплеру, LoRA, ControlNet и прочим параметрам;
+    записи файлов, которых больше нет на диске, удаляются при поиске.
+    """
+
+    def __init__(self, project_folder, batch_size=500, flush_interval=2.0):
+        self.path = os.path.join(get_data_folder(project_folder), SEARCH_FILE_NAME)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._pending = []
+        self._last_flush = time.monotonic()
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        # Иначе INSERT OR REPLACE не вызывает триггер удаления и в FTS остаются старые строки
+        self._connection.execute("PRAGMA recursive_triggers=ON")
+        self._connection.executescript(_SCHEMA)
+
+    @staticmethod
+    def exists(project_folder):
+        """
+        Есть ли в проекте поисковый индекс (без создания файла)
+        """
+        return os.path.exists(os.path.join(get_data_folder(project_folder), SEARCH_FILE_NAME))
+
+    def add(self, path, metadata, size=None, mtime_ns=None):
+        """
+        Добавляет изображение в очередь на запись
+        """
+        row = row_from_metadata(path, metadata, size, mtime_ns)
+        with self._lock:
+            self._pending.append(row)
+            due = (
+                len(self._pending) >= self.batch_size
+                or time.monotonic() - self._last_flush >= self.flush_interval
+            )
+        if due:
+            self.flush()
+
+    def known(self):
+        """
+        Возвращает {путь: (размер, mtime_ns)} всех проиндексированных файлов
+        """
+        self.flush()
+        with self._lock:
+            rows = self._connection.execute("SELECT path, size, mtime_ns FROM images").fetchall()
+        return {path: (size, mtime_ns) for path, size, mtime_ns in rows}
+
+    def remove(self, paths):
+        """
+        Удаляет записи изображений по путям
+        """
+        self.flush()
+        with self._lock:
+            with self._connection:
+                self._connection.executemany("DELETE FROM images WHERE path = ?",
+                                             [(os.path.abspath(path),) for path in paths])
+
+    def lookup(self, paths):
+        """
+        Строки индекса для путей (кортежи в порядке row_from_metadata); пути без записи пропускаются
+        """
+        self.flush()
+        columns = ", ".join(_COLUMNS)
+        rows = []
+        with self._lock:
+            for path in paths:
+                row = self._connection.execute(
+                    f"SELECT {columns} FROM images WHERE path = ?", (os.path.abspath(path),)
+                ).fetchone()
+                if row is not None:
+                    rows.append(row)
+        return rows
+
+    def rows(self, batch_size=10000):
+        """
+        Все строки индекса в порядке добавления (кортежи в порядке row_from_metadata)
+        """
+        self.flush()
+        last_id = 0
+        columns = ", ".join(_COLUMNS)
+        while True:
+            with self._lock:
+                batch = self._connection.execute(
+                    f"SELECT id, {columns} FROM images WHERE id > ? ORDER BY id LIMIT ?",
+                    (last_id, batch_size),
+                ).fetchall()
+            if not batch:
+                return
+            last_id = batch[-1][0]
+            for row in batch:
+                yield row[1:]
+
+    def relocate(self, moves):
+        """
+        Обновляет пути после переноса файлов внутри проекта: moves - пары (прежний путь, новый)
+        """
+        self.flush()
+        with self._lock:
+            with self._connection:
+                # OR REPLACE убирает устаревшую запись с новым путём, если она была
+                self._connection.executemany(
+                    "UPDATE OR REPLACE images SET path = ? WHERE path = ?",
+                    [(os.path.abspath(new), os.path.abspath(old)) for old, new in moves],
+                )
+
+    def flush(self):
+        """
+        Записывает накопленные строки одной транзакцией
+        """
+        with self._lock:
+            self._last_flush = time.monotonic()
+            if not self._pending:
+                return
+            rows, self._pending = self._pending, []
+            now = time.time()
+            placeholders = ", ".join("?" for _ in _COLUMNS)
+            with self._connection:
+                # REPLACE удаляет старую строку (триггер чистит FTS) и вставляет новую
+                self._connection.executemany(
+                    f"INSERT OR REPLACE INTO images ({', '.join(_COLUMNS)}, added_at) "
+                    f"VALUES ({placeholders}, ?)",
+                    [row + (now,) for row in rows],
+                )
+
+    def search(self, query, limit=200, offset=0, check_exists=True):
+        """
+        Ищет изображения по строке запроса (см. parse_query).
+        check_exists - убирать из результата (и из индекса) файлы, которых нет на диске.
+
+        Returns:
+            list: словари {"path", "prompt", "negative_prompt", "model", "sampler", "seed", ...},
+                сначала недавно добавленные (сортировка по релевантности потребовала бы
+                оценить все совпадения и на сотнях тысяч строк занимает секунды)
+        """
+        self.flush()
+        match, exclude, filters = parse_query(query)
+        columns = ", ".join(f"images.{name}" for name in _COLUMNS)
+        where = [f"images.{column} = ?" for column, _ in filters]
+        params = [value for _, value in filters]
+        if exclude:
+            where.append("images.id NOT IN (SELECT rowid FROM images_fts WHERE images_fts MATCH ?)")
+            params.append(exclude)
+        if match:
+            sql = (f"SELECT {columns} FROM images_fts JOIN images ON images.id = images_fts.rowid "
+                   f"WHERE images_fts MATCH ?{''.join(' AND ' + clause for clause in where)} "
+                   f"ORDER BY images_fts.rowid DESC LIMIT ? OFFSET ?")
+            params.insert(0, match)
+        elif where:
+            sql = (f"SELECT {columns} FROM images WHERE {' AND '.join(where)} "
+                   f"ORDER BY images.id DESC LIMIT ? OFFSET ?")
+        else:
+            sql = f"SELECT {columns} FROM images ORDER BY images.id DESC LIMIT ? OFFSET ?"
+        params += [limit, offset]
+        with self._lock:
+            try:
+                rows = self._connection.execute(sql, params).fetchall()
+            except sqlite3.OperationalError:
+                # Запрос, который FTS5 не смог разобрать, ничего не находит
+                return []
+
+        results = [dict(zip(_COLUMNS, row)) for row in rows]
+        if not check_exists:
+            return results
+        missing = {result["path"] for result in results if not os.path.exists(result["path"])}
+        if missing:
+            # Файл удалили или вернули отменой обработки
+            self.remove(missing)
+            results = [result for result in results if result["path"] not in missing]
+        return results
+
+    def count(self):
+        self.flush()
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM images").fetchone()[0]
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            self._connection.close()
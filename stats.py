@@ -0,0 +1,214 @@
+import bisect
+import json
+import os
+import threading
+import time
+from contextlib import nullcontext
+
+
+# Границы корзин гистограммы задержек, в секундах
+LATENCY_BUCKETS = (
+    0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+    0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+_DISABLED = nullcontext()
+
+
+class Histogram:
+    """
+    Гистограмма с фиксированными корзинами (как histogram в Prometheus)
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        # Верхняя граница корзины, в которую попадает квантиль q (не больше максимума)
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return min(self.buckets[index], self.max) if index < len(self.buckets) else self.max
+        return self.max
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "avg": self.sum / self.count if self.count else None,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "max": self.max,
+        }
+
+
+class _Timer:
+    __slots__ = ("stats", "stage", "start")
+
+    def __init__(self, stats, stage):
+        self.stats = stats
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.stats.observe(self.stage, time.perf_counter() - self.start)
+        return False
+
+
+class Stats:
+    """
+    Счётчики и гистограммы задержек по стадиям обработки файла.
+
+    Пока статистика выключена, time() возвращает пустой контекст, а increment()
+    и observe() сразу выходят, так что затраты сводятся к проверке флага.
+    """
+
+    def __init__(self, enabled=False, prefix="sd_organizer"):
+        self.enabled = enabled
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self.reset()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        with self._lock:
+            self._stages = {}
+            self._statuses = {}
+            self._counters = {}
+            self._started = time.time()
+
+    def time(self, stage):
+        """
+        Контекстный менеджер, замеряющий длительность стадии stage
+        """
+        if not self.enabled:
+            return _DISABLED
+        return _Timer(self, stage)
+
+    def observe(self, stage, seconds):
+        if not self.enabled:
+            return
+        with self._lock:
+            histogram = self._stages.get(stage)
+            if histogram is None:
+                histogram = self._stages[stage] = Histogram()
+            histogram.observe(seconds)
+
+    def increment(self, name, value=1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def record_result(self, result):
+        if not self.enabled:
+            return
+        status = result["status"]
+        with self._lock:
+            self._statuses[status] = self._statuses.get(status, 0) + 1
+
+    def snapshot(self):
+        """
+        Текущие значения: {"uptime", "stages": {стадия: {...}}, "statuses", "counters"}
+        """
+        with self._lock:
+            return {
+                "uptime": time.time() - self._started,
+                "stages": {stage: histogram.snapshot() for stage, histogram in self._stages.items()},
+                "statuses": dict(self._statuses),
+                "counters": dict(self._counters),
+            }
+
+    def to_prometheus(self):
+        """
+        Статистика в текстовом формате Prometheus
+        """
+        prefix = self.prefix
+        lines = [f"# TYPE {prefix}_stage_seconds histogram"]
+        with self._lock:
+            for stage, histogram in sorted(self._stages.items()):
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + ("+Inf",), histogram.counts):
+                    cumulative += count
+                    lines.append(f'{prefix}_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'{prefix}_stage_seconds_sum{{stage="{stage}"}} {histogram.sum}')
+                lines.append(f'{prefix}_stage_seconds_count{{stage="{stage}"}} {histogram.count}')
+            lines.append(f"# TYPE {prefix}_results_total counter")
+            for status, count in sorted(self._statuses.items()):
+                lines.append(f'{prefix}_results_total{{status="{status}"}} {count}')
+            for name, value in sorted(self._counters.items()):
+                lines.append(f"# TYPE {prefix}_{name}_total counter")
+                lines.append(f"{prefix}_{name}_total {value}")
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path):
+        """
+        Записывает статистику в файл: .prom/.txt - формат Prometheus, иначе JSON.
+        Файл заменяется целиком, чтобы читатель не увидел его наполовину записанным.
+        """
+        if path.endswith((".prom", ".txt")):
+            content = self.to_prometheus()
+        else:
+            content = json.dumps(self.snapshot(), indent=2, ensure_ascii=False)
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write(content)
+        os.replace(temp_path, path)
+
+
+class StatsDumper:
+    """
+    Фоновый поток, который раз в interval секунд записывает статистику в файл
+    """
+
+    def __init__(self, stats, path, interval=10.0):
+        self.stats = stats
+        self.path = path
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="stats-dumper", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._dump()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._dump()
+
+    def _dump(self):
+        try:
+            self.stats.dump(self.path)
+        except OSError as e:
+            print(f"Ошибка при записи статистики в {self.path}: {e}")
@@ -0,0 +1,236 @@
+import hashlib
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import pytest
+
+import update_checker
+from benchmark import _DownloadStandIn, _ReleaseStandIn
+from update_checker import UpdateChecker
+
+
+@pytest.fixture
+def release():
+    server = _ReleaseStandIn()
+    yield server
+    server.close()
+
+
+def _checker(url, tmp_path, version="1.0.0", **kwargs):
+    return UpdateChecker(version, update_url=url, cache_path=str(tmp_path / "update_check.json"), **kwargs)
+
+
+def _closed_port_url():
+    # Порт, который только что освободился: соединение будет отклонено
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    return f"http://127.0.0.1:{port}/releases/latest"
+
+
+def test_check_reports_new_version(release, tmp_path):
+    info = _checker(release.url, tmp_path).check_for_updates()
+    assert info["available"]
+    assert info["version"] == "99.0.0"
+    assert info["download_url"] == "http://127.0.0.1/update.exe"
+
+
+def test_current_version_is_not_an_update(release, tmp_path):
+    assert _checker(release.url, tmp_path, version="99.0.0").check_for_updates() == {"available": False}
+
+
+def test_result_is_cached_on_disk(release, tmp_path):
+    first = _checker(release.url, tmp_path).check_for_updates()
+    # Новый экземпляр - как при следующем запуске программы
+    second = _checker(release.url, tmp_path).check_for_updates()
+    assert second == first
+    assert release.requests == 1
+
+    _checker(release.url, tmp_path).check_for_updates(use_cache=False)
+    assert release.requests == 2
+
+
+def test_cache_is_ignored_after_upgrade(release, tmp_path):
+    _checker(release.url, tmp_path, version="1.0.0").check_for_updates()
+    _checker(release.url, tmp_path, version="2.0.0").check_for_updates()
+    assert release.requests == 2
+
+
+def test_expired_cache_is_refreshed(release, tmp_path, monkeypatch):
+    _checker(release.url, tmp_path).check_for_updates()
+    now = time.time()
+    monkeypatch.setattr(update_checker.time, "time", lambda: now + update_checker.CACHE_TTL + 1)
+    _checker(release.url, tmp_path).check_for_updates()
+    assert release.requests == 2
+
+
+def test_unreachable_server_is_cached_as_error(tmp_path):
+    checker = _checker(_closed_port_url(), tmp_path, timeout=1)
+    assert checker.check_for_updates() == {"available": False}
+    with open(checker.cache_path, encoding="utf-8") as f:
+        assert json.load(f)["error"] is True
+    # Повторная проверка не идёт в сеть до истечения ERROR_CACHE_TTL
+    assert checker._read_cache() == {"available": False}
+
+
+def test_slow_server_is_bounded_by_timeout(tmp_path):
+    server = _ReleaseStandIn(delay=3.0)
+    try:
+        start = time.perf_counter()
+        result = _checker(server.url, tmp_path, timeout=0.5).check_for_updates()
+        elapsed = time.perf_counter() - start
+    finally:
+        server.close()
+    assert result == {"available": False}
+    assert elapsed < 2.0
+
+
+def test_requests_is_not_imported_with_module():
+    code = "import sys, update_checker; print('requests' in sys.modules)"
+    folder = os.path.dirname(os.path.abspath(update_checker.__file__))
+    output = subprocess.run([sys.executable, "-c", code], cwd=folder, capture_output=True, text=True, check=True)
+    assert output.stdout.strip() == "False"
+
+
+def test_window_appears_before_slow_check(tmp_path, monkeypatch):
+    monkeypatch.setenv("QT_QPA_PLATFORM", os.environ.get("QT_QPA_PLATFORM", "offscreen"))
+    widgets = pytest.importorskip("PyQt5.QtWidgets")
+    gui = pytest.importorskip("gui")
+
+    # Старая версия на сервере: окно с предложением обновиться не появится
+    server = _ReleaseStandIn(delay=2.0, tag="v0.0.1")
+    monkeypatch.setattr(update_checker, "UPDATE_URL", server.url)
+    monkeypatch.setattr(update_checker, "get_cache_folder", lambda: str(tmp_path))
+    try:
+        app = widgets.QApplication.instance() or widgets.QApplication([])
+        start = time.perf_counter()
+        window = gui.SDOrganizerGUI()
+        window.show()
+        app.processEvents()
+        elapsed = time.perf_counter() - start
+        # Окно не закрываем, пока не придёт сигнал проверки в фоне: он идёт в это окно
+        checked = []
+        window.c.update_signal.connect(checked.append)
+        deadline = time.monotonic() + 10
+        while not checked and time.monotonic() < deadline:
+            app.processEvents()
+            time.sleep(0.05)
+        window.close()
+    finally:
+        server.close()
+    assert elapsed < 1.0
+
+
+PAYLOAD = os.urandom(1024 * 1024)
+PAYLOAD_SHA256 = hashlib.sha256(PAYLOAD).hexdigest()
+
+
+@pytest.fixture
+def download(tmp_path, monkeypatch):
+    # Файлы загрузки - во временной папке теста, паузы между попытками не нужны
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path))
+    monkeypatch.setattr(update_checker.time, "sleep", lambda seconds: None)
+    server = _DownloadStandIn(PAYLOAD, drop_after=128 * 1024, drops=0)
+    yield server
+    server.close()
+
+
+def _part_path(server, version=None):
+    return update_checker._update_path(server.url, version) + ".part"
+
+
+def _write_part(server, data, info, version=None):
+    part_path = _part_path(server, version)
+    with open(part_path, "wb") as f:
+        f.write(data)
+    if info is not None:
+        update_checker._write_part_info(part_path, info)
+    return part_path
+
+
+def _read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def test_download_resumes_after_dropped_connections(download):
+    download.drops = 3
+    path = UpdateChecker("1.0.0").download_update(download.url, sha256=PAYLOAD_SHA256, size=len(PAYLOAD))
+    assert path is not None and _read(path) == PAYLOAD
+    assert download.requests == 4
+    # Каждая докачка продолжает дальше прежней и проверяет, что файл тот же
+    assert download.ranges[0] == (None, None)
+    offsets = [int(header[len("bytes="):-1]) for header, _ in download.ranges[1:]]
+    assert 0 < offsets[0] < offsets[1] < offsets[2] < len(PAYLOAD)
+    assert all(if_range == download.etag for _, if_range in download.ranges[1:])
+    assert not os.path.exists(_part_path(download))
+    assert not os.path.exists(_part_path(download) + ".json")
+
+
+def test_part_name_depends_on_version_and_asset(download):
+    assert _part_path(download, "2.0.0") != _part_path(download, "2.1.0")
+    assert update_checker._update_path(download.url, "2.0.0") != update_checker._update_path(
+        download.url.replace("update.exe", "other.exe"), "2.0.0")
+
+
+def test_part_of_changed_file_is_not_continued(download):
+    # Часть прежней версии файла на сервере: If-Range не совпадает, сервер отдаёт файл целиком
+    _write_part(download, os.urandom(len(PAYLOAD) // 2), {"etag": '"v0"', "total": len(PAYLOAD)})
+    path = UpdateChecker("1.0.0").download_update(download.url, sha256=PAYLOAD_SHA256, size=len(PAYLOAD))
+    assert path is not None and _read(path) == PAYLOAD
+    assert download.ranges == [(f"bytes={len(PAYLOAD) // 2}-", '"v0"')]
+
+
+def test_part_without_validator_is_downloaded_again(download):
+    _write_part(download, os.urandom(1000), None)
+    path = UpdateChecker("1.0.0").download_update(download.url, sha256=PAYLOAD_SHA256)
+    assert path is not None and _read(path) == PAYLOAD
+    assert download.ranges == [(None, None)]
+
+
+def test_complete_part_is_accepted_on_416(download):
+    _write_part(download, PAYLOAD, {"etag": download.etag, "total": len(PAYLOAD)})
+    path = UpdateChecker("1.0.0").download_update(download.url, sha256=PAYLOAD_SHA256, size=len(PAYLOAD))
+    assert path is not None and _read(path) == PAYLOAD
+    assert download.requests == 1
+
+
+def test_oversized_part_is_discarded_on_416(download):
+    _write_part(download, PAYLOAD + b"tail", {"etag": download.etag, "total": len(PAYLOAD) + 4})
+    path = UpdateChecker("1.0.0").download_update(download.url, sha256=PAYLOAD_SHA256, size=len(PAYLOAD))
+    assert path is not None and _read(path) == PAYLOAD
+    assert download.ranges == [(f"bytes={len(PAYLOAD) + 4}-", download.etag), (None, None)]
+
+
+def test_wrong_asset_size_is_rejected(download):
+    checker = UpdateChecker("1.0.0")
+    assert checker.download_update(download.url, sha256=PAYLOAD_SHA256, size=len(PAYLOAD) + 1) is None
+    assert not os.path.exists(_part_path(download))
+    assert not os.path.exists(update_checker._update_path(download.url, None))
+
+
+def test_bad_checksum_is_rejected(download):
+    assert UpdateChecker("1.0.0").download_update(download.url, sha256="0" * 64, size=len(PAYLOAD)) is None
+    assert not os.path.exists(_part_path(download))
+    assert not os.path.exists(update_checker._update_path(download.url, None))
+
+
+def test_gives_up_after_max_retries(download):
+    download.drops = 10
+    assert UpdateChecker("1.0.0").download_update(download.url, sha256=PAYLOAD_SHA256, max_retries=2) is None
+    assert download.requests == 3
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes 100-199/1000", (100, 1000)),
+    ("bytes */1000", (None, 1000)),
+    ("bytes 0-99/*", (0, None)),
+    (None, (None, None)),
+])
+def test_parse_content_range(header, expected):
+    assert update_checker._parse_content_range(header) == expected
@@ -0,0 +1,214 @@
+import io
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+
+from catalog import get_data_folder
+
+
+THUMBNAIL_PACK_NAME = "thumbnails.pack"
+THUMBNAIL_INDEX_NAME = "thumbnails.sqlite"
+THUMBNAIL_SIZE = 160
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS thumbnails (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    offset INTEGER NOT NULL,
+    length INTEGER NOT NULL
+);
+"""
+
+
+def make_thumbnail(path, size=THUMBNAIL_SIZE):
+    """
+    Уменьшенная копия изображения в формате JPEG.
+
+    Для JPEG используется draft(): декодер сразу масштабирует изображение
+    в 2-8 раз, и полноразмерная картинка в память не попадает.
+    """
+    from PIL import Image
+
+    with Image.open(path) as img:
+        if img.format == "JPEG":
+            img.draft("RGB", (size, size))
+        img.thumbnail((size, size))
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        buffer = io.BytesIO()
+        img.save(buffer, "JPEG", quality=85)
+    return buffer.getvalue()
+
+
+class ThumbnailCache:
+    """
+    Постоянный кеш миниатюр в папке проекта.
+
+    Миниатюры дописываются подряд в один файл thumbnails.pack, а смещение
+    и длина каждой хранятся в индексе SQLite вместе с размером и временем
+    изменения исходного файла (изменённый файл получает новую миниатюру).
+    Последние memory_items миниатюр держатся в памяти (LRU).
+
+    Недостающие миниатюры создаются в фоне (request): сначала самые свежие
+    запросы, а самые старые отбрасываются, если их больше max_queued, -
+    при быстрой прокрутке не приходится ждать уже невидимые картинки.
+    """
+
+    def __init__(self, project_folder, size=THUMBNAIL_SIZE, memory_items=2000, workers=2,
+                 max_queued=256, flush_interval=1.0):
+        data_folder = get_data_folder(project_folder)
+        self.pack_path = os.path.join(data_folder, THUMBNAIL_PACK_NAME)
+        self.size = size
+        self.memory_items = memory_items
+        self.max_queued = max_queued
+        self.flush_interval = flush_interval
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._pack_lock = threading.Lock()
+        self._pending_rows = []
+        self._last_flush = time.monotonic()
+        self._connection = sqlite3.connect(os.path.join(data_folder, THUMBNAIL_INDEX_NAME),
+                                           check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript(_SCHEMA)
+        self._pack = open(self.pack_path, "a+b")
+        self._queue = deque()
+        self._queued = set()
+        self._callbacks = {}
+        self._condition = threading.Condition()
+        self._stop = False
+        self._threads = [
+            threading.Thread(target=self._work, name=f"thumbnails-{number}", daemon=True)
+            for number in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def _remember(self, path, data):
+        with self._lock:
+            self._memory[path] = data
+            self._memory.move_to_end(path)
+            while len(self._memory) > self.memory_items:
+                self._memory.popitem(last=False)
+
+    def cached(self, path):
+        """
+        Миниатюра из памяти или None - без обращения к диску
+        """
+        with self._lock:
+            data = self._memory.get(path)
+            if data is not None:
+                self._memory.move_to_end(path)
+            return data
+
+    def get(self, path):
+        """
+        Миниатюра из памяти или из файла кеша; None, если её ещё нет
+        или исходный файл изменился
+        """
+        data = self.cached(path)
+        if data is not None:
+            return data
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT size, mtime_ns, offset, length FROM thumbnails WHERE path = ?", (path,)
+            ).fetchone()
+            if row is None:
+                row = next((r[1:] for r in reversed(self._pending_rows) if r[0] == path), None)
+        if row is None or row[0] != stat.st_size or row[1] != stat.st_mtime_ns:
+            return None
+        with self._pack_lock:
+            self._pack.seek(row[2])
+            data = self._pack.read(row[3])
+        self._remember(path, data)
+        return data
+
+    def request(self, path, callback=None):
+        """
+        Ставит создание миниатюры в очередь. callback(path, data) вызывается
+        из фонового потока, когда миниатюра готова (data - None при ошибке).
+        """
+        with self._condition:
+            if callback is not None:
+                self._callbacks[path] = callback
+            if path in self._queued:
+                # Повторный запрос поднимает файл в начало очереди
+                self._queue.remove(path)
+            self._queue.append(path)
+            self._queued.add(path)
+            while len(self._queue) > self.max_queued:
+                dropped = self._queue.popleft()
+                self._queued.discard(dropped)
+                self._callbacks.pop(dropped, None)
+            self._condition.notify()
+
+    def _store(self, path, stat, data):
+        with self._pack_lock:
+            self._pack.seek(0, os.SEEK_END)
+            offset = self._pack.tell()
+            self._pack.write(data)
+            self._pack.flush()
+        with self._lock:
+            self._pending_rows.append((path, stat.st_size, stat.st_mtime_ns, offset, len(data)))
+            due = time.monotonic() - self._last_flush >= self.flush_interval
+        if due:
+            self.flush()
+        self._remember(path, data)
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while not self._queue and not self._stop:
+                    self._condition.wait()
+                if self._stop:
+                    return
+                path = self._queue.pop()
+                self._queued.discard(path)
+                callback = self._callbacks.pop(path, None)
+            data = self.get(path)
+            if data is None:
+                try:
+                    stat = os.stat(path)
+                    data = make_thumbnail(path, self.size)
+                    self._store(path, stat, data)
+                except Exception:
+                    data = None
+            if callback is not None:
+                callback(path, data)
+
+    def flush(self):
+        """
+        Записывает индекс новых миниатюр одной транзакцией
+        """
+        with self._lock:
+            self._last_flush = time.monotonic()
+            if not self._pending_rows:
+                return
+            rows, self._pending_rows = self._pending_rows, []
+            with self._connection:
+                self._connection.executemany(
+                    "INSERT OR REPLACE INTO thumbnails (path, size, mtime_ns, offset, length) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    rows,
+                )
+
+    def close(self):
+        with self._condition:
+            self._stop = True
+            self._queue.clear()
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join()
+        self.flush()
+        with self._lock:
+            self._connection.close()
+        with self._pack_lock:
+            self._pack.close()
@@ -1,49 +1,305 @@
-import requests
+import hashlib
 import json
 import os
-from packaging import version
+import random
+import re
+import tempfile
+import time
+
+# requests и packaging загружаются только при реальной проверке обновлений
+
+UPDATE_URL = "https://api.github.com/repos/ваш_username/SD_Organizer/releases/latest"
+DOWNLOAD_BASE_URL = "https://github.com/ваш_username/SD_Organizer/releases/download/"
+
+# Сколько секунд хранится результат проверки (при ошибке сети - меньше)
+CACHE_TTL = 12 * 60 * 60
+ERROR_CACHE_TTL = 60 * 60
+REQUEST_TIMEOUT = 5
+
+# Размер блока загрузки подстраивается под скорость в этих пределах
+MIN_CHUNK_SIZE = 64 * 1024
+MAX_CHUNK_SIZE = 4 * 1024 * 1024
+PROGRESS_INTERVAL = 0.1
+
+def get_cache_folder():
+    """
+    Папка для кеша приложения: %LOCALAPPDATA% в Windows, ~/.cache в остальных системах
+    """
+    base = os.getenv('LOCALAPPDATA') or os.getenv('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    if not os.path.isdir(base):
+        base = tempfile.gettempdir()
+    return os.path.join(base, 'SD_Organizer')
 
 class UpdateChecker:
-    def __init__(self, current_version):
+    def __init__(self, current_version, update_url=None, cache_path=None, timeout=REQUEST_TIMEOUT):
         self.current_version = current_version
-        self.update_url = "https://api.github.com/repos/ваш_username/SD_Organizer/releases/latest"
-        self.download_base_url = "https://github.com/ваш_username/SD_Organizer/releases/download/"
+        self.update_url = update_url or UPDATE_URL
+        self.download_base_url = DOWNLOAD_BASE_URL
+        self.cache_path = cache_path or os.path.join(get_cache_folder(), 'update_check.json')
+        self.timeout = timeout
+
+    def _read_cache(self):
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if cached.get('current_version') != self.current_version or cached.get('url') != self.update_url:
+            return None
+        ttl = ERROR_CACHE_TTL if cached.get('error') else CACHE_TTL
+        if time.time() - cached.get('checked_at', 0) > ttl:
+            return None
+        return cached.get('result')
+
+    def _write_cache(self, result, error=False):
+        try:
+            os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+            temp_path = self.cache_path + '.tmp'
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump({
+                    'checked_at': time.time(),
+                    'current_version': self.current_version,
+                    'url': self.update_url,
+                    'error': error,
+                    'result': result,
+                }, f, ensure_ascii=False)
+            os.replace(temp_path, self.cache_path)
+        except OSError:
+            pass
+
+    def check_for_updates(self, use_cache=True):
+        """
+        Проверяет наличие новой версии.
+
+        Результат кешируется на диске на CACHE_TTL секунд, поэтому большинство
+        запусков обходятся без сетевого запроса. Запрос ограничен timeout секундами.
+        """
+        if use_cache:
+            cached = self._read_cache()
+            if cached is not None:
+                return cached
 
-    def check_for_updates(self):
         try:
-            response = requests.get(self.update_url)
+            import requests
+            from packaging import version
+
+            response = requests.get(self.update_url, timeout=self.timeout)
+            result = {'available': False}
             if response.status_code == 200:
                 latest = response.json()
                 latest_version = latest['tag_name'].lstrip('v')
                 
                 if version.parse(latest_version) > version.parse(self.current_version):
-                    return {
+                    asset = latest['assets'][0]
+                    result = {
                         'available': True,
                         'version': latest_version,
-                        'download_url': latest['assets'][0]['browser_download_url'],
+                        'download_url': asset['browser_download_url'],
+                        'download_size': asset.get('size'),
                         'changes': latest['body']
                     }
-            return {'available': False}
+                    # Контрольная сумма, если она опубликована рядом с релизом
+                    for asset in latest['assets']:
+                        if asset.get('name', '').endswith('.sha256'):
+                            result['sha256_url'] = asset['browser_download_url']
+            self._write_cache(result)
+            return result
         except Exception:
+            # Нет сети или сервер недоступен - не повторяем попытку при каждом запуске
+            self._write_cache({'available': False}, error=True)
             return {'available': False}
 
-    def download_update(self, download_url, callback=None):
+    def download_update(self, download_url, callback=None, sha256=None, sha256_url=None,
+                        max_retries=5, version=None, size=None):
+        """
+        Загружает обновление с докачкой и проверкой размера и контрольной суммы.
+
+        Данные пишутся в файл .part, имя которого зависит от версии и адреса
+        ассета, поэтому недокачанный файл другого релиза не продолжается.
+        Докачка (HTTP Range) идёт только с If-Range по сохранённому ETag:
+        если файл на сервере изменился, загрузка начинается заново. Файл,
+        размер которого не совпадает с размером ассета (size), удаляется.
+        Размер блока подстраивается под скорость соединения, callback
+        вызывается не чаще PROGRESS_INTERVAL секунд.
+
+        Returns:
+            str | None: путь к загруженному файлу или None при ошибке
+        """
         try:
-            response = requests.get(download_url, stream=True)
-            total_size = int(response.headers.get('content-length', 0))
-            
-            # Сохраняем во временную папку
-            temp_path = os.path.join(os.getenv('TEMP'), 'SD_Organizer_update.exe')
-            
-            with open(temp_path, 'wb') as f:
-                downloaded = 0
-                for data in response.iter_content(chunk_size=4096):
-                    downloaded += len(data)
-                    f.write(data)
-                    if callback:
-                        callback(downloaded / total_size * 100)
-            
+            import requests
+
+            if sha256 is None and sha256_url:
+                response = requests.get(sha256_url, timeout=self.timeout)
+                response.raise_for_status()
+                sha256 = response.text.split()[0]
+
+            temp_path = _update_path(download_url, version)
+            part_path = temp_path + '.part'
+            progress = _ThrottledProgress(callback)
+
+            for attempt in range(max_retries + 1):
+                try:
+                    self._download_part(requests, download_url, part_path, progress, size)
+                    break
+                except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError):
+                    if attempt == max_retries:
+                        raise
+                    # Экспоненциальная задержка со случайным разбросом перед докачкой
+                    time.sleep(min(30, 2 ** attempt) * random.uniform(0.5, 1.0))
+
+            expected_size = size or _read_part_info(part_path).get('total')
+            actual_size = os.path.getsize(part_path)
+            if expected_size and actual_size != expected_size:
+                _remove_part(part_path)
+                raise ValueError(f"Размер загруженного файла {actual_size} байт, ожидалось {expected_size}")
+            if not expected_size and not sha256:
+                _remove_part(part_path)
+                raise ValueError("Неизвестен размер файла и нет контрольной суммы - файл не проверить")
+
+            if sha256 and _file_sha256(part_path).lower() != sha256.lower():
+                _remove_part(part_path)
+                raise ValueError("Контрольная сумма загруженного файла не совпадает")
+
+            os.replace(part_path, temp_path)
+            _remove_part(part_path)
+            progress.finish()
             return temp_path
         except Exception as e:
             print(f"Ошибка загрузки обновления: {e}")
-            return None 
\ No newline at end of file
+            return None
+
+    def _download_part(self, requests, download_url, part_path, progress, expected_size=None):
+        # Докачивает файл part_path; исключение при обрыве соединения
+        from urllib3.exceptions import ProtocolError
+
+        info = _read_part_info(part_path)
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        validator = info.get('etag') or info.get('last_modified')
+        headers = {}
+        if offset and validator:
+            headers = {'Range': f'bytes={offset}-', 'If-Range': validator}
+        else:
+            # Без ETag нельзя убедиться, что на сервере тот же файл
+            offset = 0
+        with requests.get(download_url, stream=True, timeout=self.timeout, headers=headers) as response:
+            if response.status_code == 416:
+                _, total = _parse_content_range(response.headers.get('content-range'))
+                total = total or expected_size or info.get('total')
+                if total and offset == total:
+                    # Файл уже загружен полностью
+                    return
+                # Часть не совпадает с файлом на сервере - загружаем заново
+                _remove_part(part_path)
+                raise requests.ConnectionError(f"Сервер отклонил докачку с {offset} байт")
+            response.raise_for_status()
+            length = int(response.headers.get('content-length') or 0)
+            if response.status_code == 206:
+                start, total_size = _parse_content_range(response.headers.get('content-range'))
+                if start != offset:
+                    _remove_part(part_path)
+                    raise requests.ConnectionError(f"Сервер вернул диапазон с {start} байт вместо {offset}")
+                total_size = total_size or offset + length
+                etag = response.headers.get('etag') or info.get('etag')
+                last_modified = response.headers.get('last-modified') or info.get('last_modified')
+            else:
+                # Сервер не поддерживает докачку или файл изменился - начинаем заново
+                offset = 0
+                total_size = length
+                etag = response.headers.get('etag')
+                last_modified = response.headers.get('last-modified')
+            if expected_size and total_size and total_size != expected_size:
+                _remove_part(part_path)
+                raise ValueError(f"Сервер отдаёт файл {total_size} байт, размер ассета {expected_size}")
+            # Слабый ETag нельзя передавать в If-Range
+            if etag and etag.startswith('W/'):
+                etag = None
+            _write_part_info(part_path, {'etag': etag, 'last_modified': last_modified, 'total': total_size})
+
+            chunk_size = MIN_CHUNK_SIZE
+            with open(part_path, 'ab' if offset else 'wb') as f:
+                downloaded = offset
+                while True:
+                    started = time.monotonic()
+                    try:
+                        data = response.raw.read(chunk_size, decode_content=True)
+                    except ProtocolError as e:
+                        raise requests.ConnectionError(e)
+                    if not data:
+                        break
+                    f.write(data)
+                    downloaded += len(data)
+                    progress.update(downloaded, total_size)
+                    # Быстрое соединение - читаем крупнее, медленное - мельче
+                    elapsed = time.monotonic() - started
+                    if elapsed < 0.05 and chunk_size < MAX_CHUNK_SIZE:
+                        chunk_size *= 2
+                    elif elapsed > 0.5 and chunk_size > MIN_CHUNK_SIZE:
+                        chunk_size //= 2
+            if total_size and downloaded < total_size:
+                raise requests.ConnectionError(f"Соединение прервано на {downloaded} из {total_size} байт")
+
+
+class _ThrottledProgress:
+    # Вызывает callback с процентом не чаще PROGRESS_INTERVAL секунд
+
+    def __init__(self, callback):
+        self.callback = callback
+        self.last_call = 0.0
+
+    def update(self, downloaded, total_size):
+        if not self.callback or not total_size:
+            return
+        now = time.monotonic()
+        if now - self.last_call >= PROGRESS_INTERVAL:
+            self.last_call = now
+            self.callback(min(100.0, downloaded / total_size * 100))
+
+    def finish(self):
+        if self.callback:
+            self.callback(100.0)
+
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(MAX_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _update_path(download_url, version):
+    # Имя зависит от версии и адреса ассета: части разных релизов не смешиваются
+    tag = re.sub(r'[^\w.-]', '_', version or '') or 'latest'
+    key = hashlib.sha1(download_url.encode('utf-8')).hexdigest()[:10]
+    return os.path.join(tempfile.gettempdir(), f'SD_Organizer_update_{tag}_{key}.exe')
+
+
+def _parse_content_range(header):
+    # "bytes 100-199/1000" -> (100, 1000), "bytes */1000" -> (None, 1000)
+    match = re.match(r'bytes\s+(?:(\d+)-\d+|\*)/(\d+|\*)', header or '')
+    if not match:
+        return None, None
+    start, total = match.groups()
+    return (int(start) if start else None), (int(total) if total != '*' else None)
+
+
+def _read_part_info(part_path):
+    # ETag и полный размер файла, из которого загружена часть part_path
+    try:
+        with open(part_path + '.json', 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_part_info(part_path, info):
+    with open(part_path + '.json', 'w', encoding='utf-8') as f:
+        json.dump(info, f)
+
+
+def _remove_part(part_path):
+    for path in (part_path, part_path + '.json'):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass